@@ -102,3 +102,11 @@ class GenerateNumException(ValueError):
 
     def __str__(self):
         return f"Failed Generated Numeric: {self.message}"
+
+
+class PayloadTooLargeException(RequestFormatException):
+    def __init__(self, message):
+        super().__init__(message)
+
+    def __str__(self):
+        return f"Payload too large Exception: {self.message}"
@@ -7,15 +7,18 @@ import json
 import logging
 import time
 import traceback
-from typing import List
+from collections import defaultdict
+from typing import List, Optional
 
 import numpy as np
 from cachetools import TTLCache
 
 from sub_platforms.sql_opt.histogram.ndv_estimator import NDVEstimator, safe_tolist
 from sub_platforms.sql_opt.histogram.histogram_utils import load_sample_file
+from sub_platforms.sql_opt.videx.videx_deadline import deadline_expired, mark_degraded, is_degraded
 from sub_platforms.sql_opt.videx.videx_histogram import MEANINGLESS_INT
 from sub_platforms.sql_opt.videx.videx_metadata import VidexTableStats, PCT_CACHED_MODE_PREFER_META
+from sub_platforms.sql_opt.videx.videx_metrics import metrics, PHASE_HISTOGRAM_SEARCH, PHASE_NDV_ESTIMATE, CACHE_NDV
 from sub_platforms.sql_opt.videx.model.videx_strategy import VidexModelBase, VidexStrategy, calc_mulcol_ndv_independent
 from sub_platforms.sql_opt.videx.videx_utils import IndexRangeCond, RangeCond
 
@@ -73,7 +76,10 @@ class VidexModelInnoDB(VidexModelBase):
     def get_memory_buffer_size(self, req_json_item: dict) -> int:
         return self.table_stats.innodb_buffer_pool_size
 
-    def cardinality(self, idx_range_cond: IndexRangeCond) -> int:
+    def _known_cardinality(self, idx_range_cond: IndexRangeCond) -> Optional[int]:
+        """
+        cardinality injected by @VIDEX_OPTIONS or recorded as ground truth, None if unknown
+        """
         condition_str = idx_range_cond.ranges_to_str()
         if condition_str in self.inject_cardinality_dict:
             return self.inject_cardinality_dict[condition_str]
@@ -91,12 +97,35 @@ class VidexModelInnoDB(VidexModelBase):
                 logging.warning(f"TRY to use GT records_in_range but NOGT. {gt=}")
         except Exception as e:
             logging.error(f"DEBUG NOGT:    {debug_msg}\n Meet error: {e} {traceback.format_exc()}")
+        return None
+
+    def _records_in_freqs(self, min_freqs: list, max_freqs: list) -> int:
+        records_in_ranges = int(self.table_stats.records * np.prod(np.array(max_freqs) - np.array(min_freqs)))
+        if records_in_ranges == 0:
+            # refer to innodb.cc
+            # The MySQL optimizer seems to believe an estimate of 0 rows is always accurate and may return
+            # the result 'Empty set' based on that. The accuracy is not guaranteed, and even if it were,
+            # for a locking read we should anyway perform the search to set the next-key lock.
+            # Add 1 to the value to make sure MySQL does not make the assumption!
+            logging.warning(f"records_in_ranges is 0, set to 1")
+            records_in_ranges = 1
+        return records_in_ranges
 
+    def cardinality(self, idx_range_cond: IndexRangeCond) -> int:
+        known = self._known_cardinality(idx_range_cond)
+        if known is not None:
+            return known
 
+        hist_st = time.perf_counter()
         ranges = idx_range_cond.get_valid_ranges(self.ignore_range_after_neq)
         min_freqs, max_freqs = [0] * len(ranges), [1] * len(ranges)
         for c, rc in enumerate(ranges):
             rc: RangeCond
+            if deadline_expired():
+                # the caller is leaving, treat the remaining columns as unfiltered, like the missing histograms
+                logging.warning(f"deadline expired, ignore the range of {rc.col} and the following columns")
+                mark_degraded('cardinality')
+                break
             col_hist = self.table_stats.get_col_hist(rc.col)
             if col_hist is None or len(col_hist.buckets) == 0:
                 # If a column ndv is missing, we tend to overestimate its cost
@@ -124,23 +153,87 @@ class VidexModelInnoDB(VidexModelBase):
                          f"[{c}/{len(ranges)}]: {rc} selectivity={max_freqs[c]-min_freqs[c]:.3%}, "
                          f"after_rows={int(self.table_stats.records * np.prod(np.array(max_freqs[:c+1]) - np.array(min_freqs[:c+1])))} "
                          f"freq: [{min_freqs[c]:.4f}, {max_freqs[c]:.4f}], ")
-        records_in_ranges = int(self.table_stats.records * np.prod(np.array(max_freqs) - np.array(min_freqs)))
-        if records_in_ranges == 0:
-            # refer to innodb.cc
-            # The MySQL optimizer seems to believe an estimate of 0 rows is always accurate and may return
-            # the result 'Empty set' based on that. The accuracy is not guaranteed, and even if it were,
-            # for a locking read we should anyway perform the search to set the next-key lock.
-            # Add 1 to the value to make sure MySQL does not make the assumption!
-            logging.warning(f"records_in_ranges is 0, set to 1")
-            records_in_ranges = 1
+        metrics.observe_phase(PHASE_HISTOGRAM_SEARCH, time.perf_counter() - hist_st)
+        return self._records_in_freqs(min_freqs, max_freqs)
 
-        return records_in_ranges
+    def cardinality_batch(self, idx_range_conds: List[IndexRangeCond]) -> List[Optional[int]]:
+        """
+        cardinality of many index range conditions, e.g. the ranges of an IN list on an index.
+        The bounds of each column in all conditions are located in its histogram by one vectorized search
+        (see HistogramStats.find_range_key_pos), the results are the same as cardinality.
+        Conditions with an invalid range, or not estimated before the deadline, are left to cardinality (None).
+        """
+        results: List[Optional[int]] = [None] * len(idx_range_conds)
+        hist_st = time.perf_counter()
+        # condition index -> (ranges, min_freqs, max_freqs)
+        pending = {}
+        for k, idx_range_cond in enumerate(idx_range_conds):
+            known = self._known_cardinality(idx_range_cond)
+            if known is not None:
+                results[k] = known
+                continue
+            ranges = idx_range_cond.get_valid_ranges(self.ignore_range_after_neq)
+            pending[k] = (ranges, [0] * len(ranges), [1] * len(ranges))
+
+        # column -> [(condition index, range index, range)]
+        col_ranges = defaultdict(list)
+        for k, (ranges, _, _) in pending.items():
+            for c, rc in enumerate(ranges):
+                col_ranges[rc.col].append((k, c, rc))
+        failed = set()
+        for col, items in col_ranges.items():
+            if deadline_expired():
+                # cardinality of each of the remaining conditions falls back by itself
+                return results
+            col_hist = self.table_stats.get_col_hist(col)
+            if col_hist is None or len(col_hist.buckets) == 0:
+                logging.warning(f"require cardinality for {col} but no hist found. ignore it.")
+                continue
+            try:
+                min_pos, max_pos = col_hist.find_range_key_pos(
+                    [rc.min_value for _, _, rc in items],
+                    [rc.min_key_pos_side if rc.has_min() else None for _, _, rc in items],
+                    [rc.max_value for _, _, rc in items],
+                    [rc.max_key_pos_side if rc.has_max() else None for _, _, rc in items])
+            except Exception as e:
+                logging.warning(f"batch histogram search of {self.table_name}.{col} failed, "
+                                f"estimate the conditions one by one: {e}")
+                failed.update(k for k, _, _ in items)
+                continue
+            for (k, c, rc), min_freq, max_freq in zip(items, min_pos.tolist(), max_pos.tolist()):
+                pending[k][1][c], pending[k][2][c] = min_freq, max_freq
+
+        for k, (ranges, min_freqs, max_freqs) in pending.items():
+            if k in failed:
+                continue
+            valid = True
+            for c, rc in enumerate(ranges):
+                if min_freqs[c] > max_freqs[c]:
+                    if abs(min_freqs[c] - max_freqs[c]) / max(min_freqs[c], max_freqs[c]) >= 0.01:
+                        # cardinality raises it
+                        valid = False
+                        break
+                    logging.warning(f"invalid range: {self.table_name}.{rc.col} {rc} "
+                                    f"min={min_freqs[c]} max={max_freqs[c]}")
+                    min_freqs[c], max_freqs[c] = max_freqs[c], min_freqs[c]
+            if valid:
+                results[k] = self._records_in_freqs(min_freqs, max_freqs)
+        metrics.observe_phase(PHASE_HISTOGRAM_SEARCH, time.perf_counter() - hist_st)
+        logging.info(f"card_range_cond batch ({self.table_name}({self.table_stats.records})): "
+                     f"{len(idx_range_conds)} conditions, {len(col_ranges)} columns, "
+                     f"{sum(r is None for r in results)} left to cardinality")
+        return results
 
     def ndv(self, index_name, field_list: List[str]) -> int:
         ndv = self.table_stats.get_ideal_ndv(index_name, field_list)
         print("----GET_IDEAL_NDV   NDV IS :", ndv, "----", flush=True)
         if ndv is None:
-            if self.df_sample_raw is not None:
+            if self.df_sample_raw is not None and deadline_expired():
+                mark_degraded('ndv')
+                ndv = calc_mulcol_ndv_independent(field_list, self.table_stats.ndvs_single,
+                                                   self.table_stats.records)
+                logging.warning(f"deadline expired, estimate NDV({field_list}) by single-column ndvs: {ndv}")
+            elif self.df_sample_raw is not None:
                 print(f"------Using sampling data with {len(self.df_sample_raw)} rows", flush=True)
                 rows = float(self.table_stats.records)
                 st = time.perf_counter()
@@ -152,6 +245,9 @@ class VidexModelInnoDB(VidexModelBase):
                 
                 ndv_candidates = []
                 for m in methods:
+                    if deadline_expired():
+                        # keep the estimations done so far
+                        break
                     try:
                         if len(field_list) == 1:
                             # Single column: directly call the estimator method
@@ -188,9 +284,15 @@ class VidexModelInnoDB(VidexModelBase):
                     except Exception as e:
                         print(f"NDV({m}) failed: {e}", flush=True)
                 
+                if len(ndv_candidates) < len(methods) and deadline_expired():
+                    mark_degraded('ndv')
                 if ndv_candidates:
                     ndv = min(v for _, v in ndv_candidates)  # Take the minimum; can be changed to the median, etc.
                     chosen = [m for m, v in ndv_candidates if v == ndv][0]
+                elif deadline_expired():
+                    ndv = calc_mulcol_ndv_independent(field_list, self.table_stats.ndvs_single,
+                                                       self.table_stats.records)
+                    chosen = 'deadline_fallback'
                 else:
                     ndv, chosen = rows, 'fallback_rows'
                 
@@ -276,12 +378,17 @@ class VidexModelInnoDB(VidexModelBase):
                 first_fields.append(field_name)
                 ndv_key = (key_name, tuple(first_fields))
                 if ndv_key in self.ndv_cache:
+                    metrics.cache_access(CACHE_NDV, True)
                     ndv = self.ndv_cache[ndv_key]
                     logging.info(f"load existing ndv from cache: table={self.table_name} NDV({ndv_key}) = {ndv}")
                 else:
+                    metrics.cache_access(CACHE_NDV, False)
                     st = time.perf_counter()
                     ndv = self.ndv(key_name, first_fields)
-                    self.ndv_cache[ndv_key] = ndv
+                    metrics.observe_phase(PHASE_NDV_ESTIMATE, time.perf_counter() - st)
+                    if not is_degraded():
+                        # a fallback answer is only for this request
+                        self.ndv_cache[ndv_key] = ndv
                     logging.info(f"calculate ndv and save to cache: table={self.table_name}: NDV({ndv_key}) = {ndv} "
                                  f"use {time.perf_counter() - st:.2f}s")
 
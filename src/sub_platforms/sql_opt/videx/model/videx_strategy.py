@@ -9,8 +9,9 @@ from abc import abstractmethod, ABC
 from typing import List, Dict, Optional
 
 from sub_platforms.sql_opt.meta import Index
+from sub_platforms.sql_opt.videx.videx_metrics import metrics, PHASE_RANGE_PARSE
 from sub_platforms.sql_opt.videx.videx_metadata import VidexTableStats
-from sub_platforms.sql_opt.videx.videx_utils import str_lower_eq, IndexRangeCond
+from sub_platforms.sql_opt.videx.videx_utils import IndexRangeCond
 
 
 class VidexStrategy(enum.Enum):
@@ -56,6 +57,16 @@ class VidexModelBase(ABC):
         """
         pass
 
+    def cardinality_batch(self, idx_range_conds: List[IndexRangeCond]) -> List[Optional[int]]:
+        """
+        Estimates the cardinality of many index range conditions at once, e.g. the ranges of an IN list.
+        Override it to share the work between the conditions, e.g. one histogram search for all of them.
+
+        Returns:
+        List[Optional[int]]: cardinality of each condition, None means the condition is left to `cardinality`.
+        """
+        return [None] * len(idx_range_conds)
+
     @abstractmethod
     def ndv(self, index_name: str, field_list: List[str]) -> int:
         """
@@ -103,20 +114,8 @@ class VidexModelBase(ABC):
         """
         virtual ull records_in_range();
         """
-        # parse key
-        # assert str_lower_eq(req_json_item.get('properties').get('dbname'), self.stats.dbname)
-        assert str_lower_eq(req_json_item.get('properties').get('table_name'), self.table_stats.table_name)
-        assert len(req_json_item['data']) == 2
-        min_key = req_json_item['data'][0]
-        max_key = req_json_item['data'][1]
-        assert min_key['item_type'] == 'min_key'
-        assert max_key['item_type'] == 'max_key'
-        index_name = min_key['properties'].get('index_name', max_key['properties'].get('index_name'))
-        assert index_name is not None, f"both min and max key has no index_name, {req_json_item=}"
-
-        idx_range_cond = IndexRangeCond.from_dict(min_key, max_key,
-                                                  index_meta=self.get_index_schema(index_name),
-                                                  )
+        with metrics.phase(PHASE_RANGE_PARSE):
+            idx_range_cond = self._parse_index_range_cond(req_json_item)
 
         """
         有 key 的格式如下：
@@ -155,6 +154,22 @@ class VidexModelBase(ABC):
         """
         return self.cardinality(idx_range_cond)
 
+    def records_in_range_batch(self, req_json_items: List[dict]) -> List[Optional[int]]:
+        """
+        records_in_range of many requests to this table, by cardinality_batch.
+        None means the request is left to records_in_range.
+        """
+        with metrics.phase(PHASE_RANGE_PARSE):
+            idx_range_conds = [self._parse_index_range_cond(req_json_item) for req_json_item in req_json_items]
+        return self.cardinality_batch(idx_range_conds)
+
+    def _parse_index_range_cond(self, req_json_item: dict) -> IndexRangeCond:
+        # parse key. The request is validated before dispatched (see videx_dispatch): data is [min_key, max_key],
+        # and one of them has index_name. The table is the one of this model.
+        min_key, max_key = req_json_item['data']
+        index_name = min_key['properties'].get('index_name', max_key['properties'].get('index_name'))
+        return IndexRangeCond.from_dict(min_key, max_key, index_meta=self.get_index_schema(index_name))
+
 
 def record_range_request_to_str(min_key: dict, max_key: dict) -> str:
     """
@@ -5,6 +5,8 @@ SPDX-License-Identifier: MIT
 import argparse
 from typing import Type
 
+from sub_platforms.sql_opt.videx import videx_logging
+from sub_platforms.sql_opt.videx.videx_deadline import DEFAULT_REQUEST_TIMEOUT
 from sub_platforms.sql_opt.videx.videx_metadata import PCT_CACHED_MODE_PREFER_META
 from sub_platforms.sql_opt.videx.videx_service import startup_videx_server
 from sub_platforms.sql_opt.videx.model.videx_strategy import VidexStrategy, VidexModelBase
@@ -15,6 +17,9 @@ if __name__ == '__main__':
     """
     Examples:
         python start_videx_server.py --port 5001
+        # multi-worker mode served by gunicorn
+        python start_videx_server.py --port 5001 --workers 4 --threads 8 --preload
+        python start_videx_server.py --bind unix:/tmp/videx.sock --workers 4
     """
     parser = argparse.ArgumentParser(description='Start the Videx stats server.')
     parser.add_argument('--server_ip', type=str, default='0.0.0.0', help='The IP address to bind the server to.')
@@ -25,8 +30,46 @@ if __name__ == '__main__':
                         help='Table loaded cache percentage can significantly impact table scan costs. '
                              'If set to -1, it prefers to use values calculated from the system table. '
                              'If set to a float between 0 and 1, it forces the use of the specified value.')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes. If set (or --bind is set), serve by gunicorn instead of '
+                             'the flask development server.')
+    parser.add_argument('--threads', type=int, default=1, help='Number of threads in each gunicorn worker.')
+    parser.add_argument('--bind', type=str, default=None,
+                        help='gunicorn bind address, e.g. 0.0.0.0:5001 or unix:/tmp/videx.sock. '
+                             'Default is {server_ip}:{port}.')
+    parser.add_argument('--preload', action='store_true', help='Load the app in gunicorn master before forking workers.')
+    parser.add_argument('--task_store_dir', type=str, default=None,
+                        help='Directory to store task meta, shared by all workers. '
+                             'If not set in multi-worker mode, a temporary directory is used.')
+    parser.add_argument('--preload_dir', '--preload-dir', type=str, default=None,
+                        help='Task store directory to load into memory at startup, so that a restarted server is '
+                             'hot immediately. It is also used as --task_store_dir.')
+    parser.add_argument('--memory_budget_mb', type=float, default=None,
+                        help='Approximate memory budget (MB) of cached task meta and models of the whole server, '
+                             'divided equally among workers. Models are discarded first, then the least recently '
+                             'used tasks. Unlimited by default.')
+    parser.add_argument('--max_body_mb', type=float, default=None,
+                        help='Limit (MB) of the decompressed size of a request body, e.g. a gzip task meta.')
+    parser.add_argument('--max_concurrent_loads', type=int, default=4,
+                        help='Max number of tasks loaded at the same time in a worker, also the number of '
+                             'background threads of /prefetch_task.')
+    parser.add_argument('--request_timeout', type=float, default=DEFAULT_REQUEST_TIMEOUT,
+                        help='Deadline (seconds) of an ask request. When it expires, expensive NDV and cardinality '
+                             'estimations fall back to cheap answers. <= 0 means no deadline.')
+    parser.add_argument('--max_in_flight', type=int, default=None,
+                        help='Max number of ask requests served at the same time in a worker. The others get a '
+                             '503 response at once, and VIDEX-MySQL uses its default estimations. Unlimited by '
+                             'default.')
+    parser.add_argument('--log_sample_n', type=int, default=1,
+                        help='Log the one-line summary of 1-in-N requests, errors are always logged. '
+                             'If <= 0, only errors are logged.')
+    parser.add_argument('--log_full_payload_tasks', type=str, default='',
+                        help='Comma separated task ids, whose full request/response payload are logged.')
 
     args = parser.parse_args()
+    videx_logging.set_request_log_policy(
+        sample_n=args.log_sample_n,
+        full_payload_task_ids=[t for t in args.log_full_payload_tasks.split(',') if t])
 
     MainVidexModelClass: Type[VidexModelBase]
     """
@@ -41,5 +84,11 @@ if __name__ == '__main__':
 
     startup_videx_server(start_ip=args.server_ip, debug=args.debug, port=args.port,
                          VidexModelClass=MainVidexModelClass,
+                         workers=args.workers, threads=args.threads, bind=args.bind, preload=args.preload,
+                         task_store_dir=args.task_store_dir, preload_dir=args.preload_dir,
+                         memory_budget_mb=args.memory_budget_mb, max_body_mb=args.max_body_mb,
+                         max_concurrent_loads=args.max_concurrent_loads,
+                         request_timeout=args.request_timeout if args.request_timeout > 0 else None,
+                         max_in_flight=args.max_in_flight,
                          cache_pct=args.cache_pct,
                          )
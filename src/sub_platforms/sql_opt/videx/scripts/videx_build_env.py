@@ -16,8 +16,8 @@ from sub_platforms.sql_opt.videx import videx_logging
 from sub_platforms.sql_opt.videx.videx_metadata import fetch_all_meta_for_videx, \
     construct_videx_task_meta_from_local_files, fetch_all_meta_with_one_file, \
     collect_sample_data_for_tables, save_sample_data_to_files, construct_meta_request_with_samples
-from sub_platforms.sql_opt.videx.videx_service import create_videx_env_multi_db, \
-    post_add_videx_meta
+from sub_platforms.sql_opt.videx.videx_client import VidexClient
+from sub_platforms.sql_opt.videx.videx_service import create_videx_env_multi_db
 from sub_platforms.sql_opt.videx.videx_utils import VIDEX_IP_WHITE_LIST
 
 
@@ -96,7 +96,7 @@ if __name__ == "__main__":
     parser.add_argument('--task_id', type=str, default=None,
                         help='task id is to distinguish different videx tasks, if they have same database names.')
     parser.add_argument('--hist_algo', type=str, default=None, 
-                   help='Histogram algorithm: None (default), block_2phase')
+                   help='Histogram algorithm: None (default), block_2phase, table_sample')
 
 
     """
@@ -240,10 +240,17 @@ if __name__ == "__main__":
 
     # step 3: create tables into VIDEX-MySQL, post metadata and statistics to VIDEX-Server
     # 向 VIDEX-MySQL 中建表
-    create_videx_env_multi_db(videx_env, meta_dict=meta_request.meta_dict, )
+    env_report = create_videx_env_multi_db(videx_env, meta_dict=meta_request.meta_dict, )
+    if env_report['failed']:
+        logging.error(f"failed to create in VIDEX-MySQL: {env_report['failed']}")
+        sys.exit(1)
     # 向 VIDEX-Server 中导入数据
-    response = post_add_videx_meta(meta_request, videx_server_ip_port=videx_server_ip_port, use_gzip=True)
-    assert response.status_code == 200
+    # 仅上传与 VIDEX-Server 上内容哈希不同的表
+    with VidexClient(videx_server_ip_port) as videx_client:
+        sync_result = videx_client.sync_task_meta(meta_request)
+    assert sync_result['code'] == 200, sync_result['message']
+    logging.info(f"sync metadata to VIDEX-Server: mode={sync_result['mode']}, "
+                 f"uploaded {len(sync_result['tables'])} tables, dropped {sync_result['dropped']}")
 
     logging.info(f"metadata file is {meta_path}")
     logging.info(get_usage_message(args, videx_ip, videx_port, videx_db, videx_user, videx_pwd, videx_server_ip_port))
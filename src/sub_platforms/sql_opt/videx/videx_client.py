@@ -0,0 +1,263 @@
+"""
+Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+SPDX-License-Identifier: MIT
+
+Client of VIDEX statistic server, with pooled connections and retries.
+
+Task meta is uploaded as a stream generated table by table (see videx_ingest), so that the client never holds the
+whole serialized payload in memory. A failed attempt regenerates the stream from the task meta.
+sync_task_meta uploads only the tables whose content hashes differ from the ones on the server.
+
+    with VidexClient('127.0.0.1:5001') as client:
+        resp = client.create_task_meta_stream(task_meta, progress=lambda p: print(p.tables_sent, p.total_tables))
+"""
+import gzip
+import itertools
+import json
+import logging
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import msgpack
+import requests
+from requests import Response
+from requests.adapters import HTTPAdapter
+from retrying import Retrying, RetryError
+
+from sub_platforms.sql_opt.videx.videx_ingest import dump_task_meta_stream, iter_gzip, MSGPACK_MIMETYPE
+from sub_platforms.sql_opt.videx.videx_metadata import VidexDBTaskStats
+
+# http status (or `code` of the response json) worth retrying: the server or a proxy is busy or restarting
+RETRY_STATUSES = (502, 503, 504)
+RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout)
+# seconds of (connect, read)
+DEFAULT_TIMEOUT = (10., 600.)
+
+Body = Union[bytes, Iterable[bytes]]
+
+
+@dataclass
+class UploadProgress:
+    attempt: int
+    tables_sent: int
+    total_tables: int
+    # bytes on the wire, i.e. after compression
+    bytes_sent: int = 0
+
+
+def encode_task_meta(req: VidexDBTaskStats, use_gzip: bool,
+                     use_msgpack: bool = False) -> Tuple[bytes, Dict[str, str]]:
+    """
+    Body and headers of /create_task_meta. msgpack falls back to json if the meta has numbers out of its range.
+    """
+    content_type = 'application/json'
+    data = None
+    if use_msgpack:
+        try:
+            data = msgpack.packb(req.model_dump(mode='json'))
+            content_type = MSGPACK_MIMETYPE
+        except OverflowError:
+            logging.warning("task meta has integers out of the range of msgpack, post it in json")
+    if data is None:
+        data = req.to_json().encode('utf-8')
+    headers = {'Content-Type': content_type}
+    if use_gzip:
+        data = gzip.compress(data)
+        headers['Content-Encoding'] = 'gzip'
+    return data, headers
+
+
+def count_stream_tables(req: VidexDBTaskStats, tables: Optional[List[Tuple[str, str]]] = None) -> int:
+    """
+    number of table lines of the task meta stream of req, see dump_task_meta_stream
+    """
+    if tables is None:
+        tables = [(db_name, table_name) for db_name, db_tables in req.stats_dict.items() for table_name in db_tables]
+    return sum(1 for db_name, table_name in tables if req.get_table_meta(db_name, table_name) is not None
+               and req.get_table_stats_info(db_name, table_name) is not None)
+
+
+class VidexClient:
+    """
+    A pooled requests.Session to one VIDEX server. Requests failed by connection errors, timeouts or
+    RETRY_STATUSES are retried with exponential backoff. It's thread safe as a requests.Session is.
+    """
+
+    def __init__(self, videx_server: str, retries: int = 3, backoff: float = 0.5, backoff_max: float = 10.,
+                 timeout: Optional[Tuple[float, float]] = DEFAULT_TIMEOUT, pool_maxsize: int = 10):
+        """
+        Args:
+            videx_server: ip:port, or a base url like http://ip:port
+            retries: max number of retries after the first attempt
+            backoff: seconds before the first retry, doubled for each of the next retries
+            backoff_max: max seconds between two attempts
+            timeout: (connect, read) timeout of an attempt, None means no timeout
+            pool_maxsize: max number of connections kept in the pool
+        """
+        self.base_url = (videx_server if '://' in videx_server else f'http://{videx_server}').rstrip('/')
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    @staticmethod
+    def should_retry(resp: Response) -> bool:
+        if resp.status_code in RETRY_STATUSES:
+            return True
+        if resp.status_code != 200 or 'json' not in resp.headers.get('Content-Type', ''):
+            return False
+        try:
+            body = resp.json()
+        except ValueError:
+            return False
+        # most routes answer errors with http 200 and the code in the response json
+        return isinstance(body, dict) and body.get('code') in RETRY_STATUSES
+
+    def request(self, method: str, path: str, body: Union[Body, Callable[[int], Body]] = None,
+                headers: Dict[str, str] = None, params: Dict[str, str] = None) -> Response:
+        """
+        Send a request to the server with retries.
+
+        Args:
+            body: bytes, or body(attempt) -> bytes or chunks. A generated body must be given as a function,
+                since it's regenerated for each attempt.
+
+        Returns:
+            Response: the response of the last attempt, which may be a retryable failure after all retries
+        """
+        url = f'{self.base_url}/{path.lstrip("/")}'
+        attempts = itertools.count(1)
+
+        def attempt():
+            n = next(attempts)
+            if n > 1:
+                logging.warning(f"retry {url}, attempt {n}")
+            data = body(n) if callable(body) else body
+            return self.session.request(method, url, data=data, headers=headers, params=params, timeout=self.timeout)
+
+        retryer = Retrying(stop_max_attempt_number=self.retries + 1,
+                           wait_exponential_multiplier=self.backoff * 500,
+                           wait_exponential_max=self.backoff_max * 1000,
+                           retry_on_exception=lambda e: isinstance(e, RETRY_EXCEPTIONS),
+                           retry_on_result=self.should_retry)
+        try:
+            return retryer.call(attempt)
+        except RetryError as e:
+            return e.last_attempt.get()
+
+    def post(self, path: str, body: Union[Body, Callable[[int], Body]], headers: Dict[str, str] = None,
+             params: Dict[str, str] = None) -> Response:
+        return self.request('POST', path, body, headers=headers, params=params)
+
+    def post_json(self, path: str, req: dict, params: Dict[str, str] = None) -> Response:
+        return self.post(path, json.dumps(req).encode('utf-8'),
+                         headers={'Content-Type': 'application/json'}, params=params)
+
+    def create_task_meta(self, req: VidexDBTaskStats, use_gzip: bool = True, use_msgpack: bool = False,
+                         warmup: bool = False) -> Response:
+        """
+        Post task meta in one body to /create_task_meta. The body is encoded once and re-sent by retries.
+        """
+        data, headers = encode_task_meta(req, use_gzip, use_msgpack)
+        logging.info(f"post videx metadata to {self.base_url}")
+        return self.post('/create_task_meta', data, headers=headers, params={'warmup': '1'} if warmup else None)
+
+    def create_task_meta_stream(self, req: VidexDBTaskStats, use_gzip: bool = True, warmup: bool = False,
+                                progress: Callable[[UploadProgress], None] = None,
+                                tables: Optional[List[Tuple[str, str]]] = None,
+                                drop_tables: Optional[List[str]] = None) -> Response:
+        """
+        Post task meta table by table to /create_task_meta_stream (chunked transfer).
+
+        Args:
+            progress: called after each chunk is sent. It restarts from zero if the upload is retried.
+            tables, drop_tables: post a delta stream, see dump_task_meta_stream
+        """
+        headers = {'Content-Type': 'application/x-ndjson'}
+        if use_gzip:
+            headers['Content-Encoding'] = 'gzip'
+        total_tables = count_stream_tables(req, tables) if progress is not None else 0
+
+        def body(attempt: int) -> Iterator[bytes]:
+            state = UploadProgress(attempt=attempt, tables_sent=0, total_tables=total_tables)
+
+            def counted_lines():
+                # the first line is the header
+                for i, line in enumerate(dump_task_meta_stream(req, tables, drop_tables)):
+                    yield line
+                    state.tables_sent = i
+
+            chunks = iter_gzip(counted_lines()) if use_gzip else counted_lines()
+            for chunk in chunks:
+                yield chunk
+                if progress is not None:
+                    state.bytes_sent += len(chunk)
+                    progress(state)
+
+        logging.info(f"post videx metadata stream to {self.base_url}")
+        return self.post('/create_task_meta_stream', body, headers=headers,
+                         params={'warmup': '1'} if warmup else None)
+
+    def task_content_hashes(self, task_id: Optional[str]) -> Optional[dict]:
+        """
+        Content hashes of a task on the server, see VidexSingleton.task_content_hashes.
+
+        Returns:
+            None if the server doesn't have the task
+        """
+        resp = self.request('GET', '/task_content_hashes', params=None if task_id is None else {'task_id': task_id})
+        if resp.status_code != 200 or resp.json().get('code') != 200:
+            return None
+        return resp.json()['data']
+
+    def sync_task_meta(self, req: VidexDBTaskStats, use_gzip: bool = True, warmup: bool = False,
+                       progress: Callable[[UploadProgress], None] = None) -> dict:
+        """
+        Make the task on the server the same as req, by uploading only the tables whose content hashes differ
+        from the server's, and removing the tables not in req. The whole task is uploaded if the server doesn't
+        have it, or if its db_config or sample files differ.
+        The non-task meta is shared by all non-task uploads, so its tables are only merged, never removed.
+
+        Returns:
+            {"mode": "full" | "delta" | "unchanged", "tables": [uploaded db.table], "dropped": [db.table],
+             "code", "message", "data"}: code, message and data are of the server response
+        """
+        task_id = None if req.key_is_none() else req.task_id
+        local = {}
+        for db_name, tables in req.get_stats_info_keys().items():
+            for table_name in tables:
+                if (h := req.table_content_hash(db_name, table_name)) is not None:
+                    local[f"{db_name}.{table_name}"] = ((db_name, table_name), h)
+
+        remote = self.task_content_hashes(task_id)
+        if remote is not None and remote['header'] == req.header_content_hash():
+            changed = [table for name, (table, h) in local.items() if remote['tables'].get(name) != h]
+            dropped = [] if task_id is None else sorted(set(remote['tables']) - set(local))
+            if not changed and not dropped:
+                data = self.post_json('/warmup_task', {'task_id': task_id}).json()['data'] if warmup else {}
+                return {'mode': 'unchanged', 'tables': [], 'dropped': [], 'code': 200, 'message': 'OK', 'data': data}
+            logging.info(f"sync task meta {task_id}: {len(changed)} of {len(local)} tables changed, "
+                         f"{len(dropped)} dropped")
+            body = self.create_task_meta_stream(req, use_gzip, warmup, progress,
+                                                tables=changed, drop_tables=dropped).json()
+            # 404: evicted from the server since we got the hashes
+            if body.get('code') != 404:
+                return {'mode': 'delta', 'tables': [f"{db}.{tb}" for db, tb in changed],
+                        'dropped': (body.get('data') or {}).get('dropped', []), **body}
+
+        body = self.create_task_meta_stream(req, use_gzip, warmup, progress).json()
+        return {'mode': 'full', 'tables': list(local), 'dropped': [], **body}
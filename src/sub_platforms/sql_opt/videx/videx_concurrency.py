@@ -0,0 +1,114 @@
+"""
+Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+SPDX-License-Identifier: MIT
+
+Concurrency helpers of VIDEX statistic server.
+"""
+import itertools
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List
+
+
+class AtomicCounter:
+    """
+    Lock-free counter. `next(itertools.count())` is atomic in CPython, since it's implemented in C and holds the GIL.
+    """
+
+    def __init__(self, start: int = 0):
+        self._counter = itertools.count(start)
+        self._last = start - 1
+
+    def incr(self) -> int:
+        """
+        Returns:
+            the value before increment, i.e. start, start + 1, ...
+        """
+        value = next(self._counter)
+        self._last = value
+        return value
+
+    @property
+    def value(self) -> int:
+        """
+        number of incr() called, approximate under concurrency
+        """
+        return self._last + 1
+
+
+class StripedLock:
+    """
+    A fixed number of locks, a key is mapped to one of them by hash.
+    It bounds the memory of per-key locks (e.g. per task, per table), at the cost of rare false sharing.
+    """
+
+    def __init__(self, n_stripes: int = 64):
+        self._locks: List[threading.RLock] = [threading.RLock() for _ in range(n_stripes)]
+
+    def lock_for(self, key: Hashable) -> threading.RLock:
+        return self._locks[hash(key) % len(self._locks)]
+
+
+class SingleFlight:
+    """
+    Dedupe concurrent calls with the same key: the first caller (leader) runs the function, the others wait for
+    its result (or exception). A call after the leader finishes runs the function again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = func()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+
+class AdmissionControl:
+    """
+    Bound the number of requests being served. A request waits at most wait_timeout seconds for a slot,
+    otherwise it's rejected (shed) at once, instead of piling up threads.
+    """
+
+    def __init__(self, max_in_flight: int, wait_timeout: float = 0.):
+        self.max_in_flight = max_in_flight
+        self.wait_timeout = wait_timeout
+        self._semaphore = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = AtomicCounter()
+
+    def try_enter(self) -> bool:
+        if self.wait_timeout > 0:
+            admitted = self._semaphore.acquire(timeout=self.wait_timeout)
+        else:
+            admitted = self._semaphore.acquire(blocking=False)
+        if not admitted:
+            self.rejected.incr()
+            return False
+        with self._lock:
+            self.in_flight += 1
+        return True
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._semaphore.release()
@@ -0,0 +1,88 @@
+"""
+Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+SPDX-License-Identifier: MIT
+
+Per-request deadlines of VIDEX statistic server.
+
+VIDEX-MySQL gives up a request after its 30s curl timeout. The deadline of the request being served is kept in a
+thread-local context, so that expensive estimations (e.g. NDV by sampling) can check it and fall back to cheap
+answers instead of computing for a caller that has already left.
+
+    with request_deadline(25):
+        ...
+        if deadline_expired():
+            mark_degraded('ndv')
+            return cheap_answer
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+from sub_platforms.sql_opt.videx.videx_metrics import metrics
+
+# a bit less than the curl timeout of VIDEX-MySQL, so that the fallback answer is still received
+DEFAULT_REQUEST_TIMEOUT = 25.
+
+_context = threading.local()
+
+
+class Deadline:
+    __slots__ = ('expires_at', 'degraded')
+
+    def __init__(self, timeout: float):
+        self.expires_at = time.monotonic() + timeout
+        # phases answered by fallbacks because the deadline expired
+        self.degraded: List[str] = []
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+
+def current_deadline() -> Optional[Deadline]:
+    return getattr(_context, 'deadline', None)
+
+
+@contextmanager
+def request_deadline(timeout: Optional[float]) -> Iterator[Optional[Deadline]]:
+    """
+    Set the deadline of the current thread. A nested deadline never extends the outer one, e.g. an item of a batch
+    shares the deadline of the batch. None means no (new) deadline.
+    """
+    outer = current_deadline()
+    if timeout is None or (outer is not None and outer.remaining() <= timeout):
+        yield outer
+        return
+    deadline = Deadline(timeout)
+    _context.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        if outer is not None:
+            # a fallback of the inner request also degrades the outer one
+            outer.degraded.extend(deadline.degraded)
+        _context.deadline = outer
+
+
+def deadline_expired() -> bool:
+    deadline = current_deadline()
+    return deadline is not None and deadline.expired()
+
+
+def mark_degraded(phase: str):
+    """
+    Record that a phase of the current request is answered by a fallback, so that the answer is not cached.
+    """
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.degraded.append(phase)
+    metrics.inc('videx_deadline_fallbacks_total', 'Number of answers by fallbacks after the deadline expired.',
+                {'phase': phase})
+
+
+def is_degraded() -> bool:
+    deadline = current_deadline()
+    return deadline is not None and len(deadline.degraded) > 0
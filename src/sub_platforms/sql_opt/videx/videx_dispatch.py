@@ -0,0 +1,142 @@
+"""
+Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+SPDX-License-Identifier: MIT
+
+Dispatch of VIDEX requests: handlers keyed by the exact function id, with request validators compiled once
+per function.
+
+A new estimation function is added by registering a handler, e.g.
+    @videx_funcs.register('records_in_range_batch', RequestSpec(data_item_types=...))
+    def records_in_range_batch(table_model, req_json_item) -> dict: ...
+"""
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+# function id for metrics and logs of the functions without handler
+NOT_SUPPORTED = 'not_supported'
+
+
+@lru_cache(maxsize=1024)
+def parse_func_id(func_str: str) -> str:
+    """
+    Function id of the `function` property, i.e. the method name in __PRETTY_FUNCTION__ of VIDEX-MySQL:
+        "virtual ha_rows ha_videx::records_in_range(uint, key_range*, key_range*)" -> "records_in_range"
+        "virtual longlong ha_videx::get_memory_buffer_size() const" -> "get_memory_buffer_size"
+    """
+    name = func_str.split('(', 1)[0].rsplit('::', 1)[-1].split()
+    return name[-1].lower() if name else ''
+
+
+@dataclass(frozen=True)
+class RequestSpec:
+    """
+    Expected shape of a request, beyond dbname, table_name and function which are required by all functions.
+    """
+    # item types of `data` in order, None means data is not checked
+    data_item_types: Optional[Tuple[str, ...]] = None
+    # properties that at least one item of `data` must have
+    data_properties: Tuple[str, ...] = ()
+
+
+def compile_validator(spec: Optional[RequestSpec]) -> Callable[[dict], Optional[str]]:
+    """
+    Build the validator of a spec once, so that a request is checked by a few comparisons.
+
+    Returns:
+        validator(req_json_item) -> error message, None if the request is valid
+    """
+    if spec is None or (spec.data_item_types is None and not spec.data_properties):
+        return lambda req_json_item: None
+    item_types = spec.data_item_types
+    data_properties = spec.data_properties
+
+    def validate(req_json_item: dict) -> Optional[str]:
+        data = req_json_item.get('data')
+        if not isinstance(data, list):
+            return f"'data' must be a list, but got {type(data).__name__}"
+        if item_types is not None:
+            types = tuple(item.get('item_type') if isinstance(item, dict) else None for item in data)
+            if types != item_types:
+                return f"item types of 'data' must be {list(item_types)}, but got {list(types)}"
+        for prop in data_properties:
+            if not any(isinstance(item, dict) and (item.get('properties') or {}).get(prop) is not None
+                       for item in data):
+                return f"no item of 'data' has property '{prop}'"
+        return None
+
+    return validate
+
+
+@dataclass(frozen=True)
+class VidexFuncHandler:
+    func_id: str
+    # handler(table_model, req_json_item) -> response dict
+    handler: Callable[[object, dict], dict]
+    validate: Callable[[dict], Optional[str]] = field(compare=False)
+    # batch_handler(table_model, [req_json_item]) -> [response dict or None], answers many requests to one table
+    # at once. None in the results means the request is left to handler.
+    batch_handler: Optional[Callable[[object, List[dict]], List[Optional[dict]]]] = field(default=None, compare=False)
+
+
+class VidexFuncRegistry:
+    """
+    function id -> VidexFuncHandler. Lookup is a dict access on the parsed (and cached) function id.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, VidexFuncHandler] = {}
+        self._lock = threading.Lock()
+
+    def register(self, func_id: str, spec: Optional[RequestSpec] = None,
+                 handler: Callable[[object, dict], dict] = None,
+                 batch_handler: Callable[[object, List[dict]], List[Optional[dict]]] = None):
+        """
+        Register (or replace) the handler of func_id. Used as a decorator if handler is not given.
+        """
+        def decorator(func):
+            with self._lock:
+                # copy on write, so that lookups never see a half-updated dict
+                handlers = dict(self._handlers)
+                handlers[func_id.lower()] = VidexFuncHandler(func_id.lower(), func, compile_validator(spec),
+                                                                batch_handler)
+                self._handlers = handlers
+            return func
+
+        return decorator if handler is None else decorator(handler)
+
+    def unregister(self, func_id: str):
+        with self._lock:
+            handlers = dict(self._handlers)
+            handlers.pop(func_id.lower(), None)
+            self._handlers = handlers
+
+    def get(self, func_str: str) -> Optional[VidexFuncHandler]:
+        return self._handlers.get(parse_func_id(func_str))
+
+    def label(self, func_str) -> str:
+        """
+        function id for metrics and logs, bounded by the registered functions
+        """
+        if not isinstance(func_str, str):
+            return NOT_SUPPORTED
+        func_id = parse_func_id(func_str)
+        return func_id if func_id in self._handlers else NOT_SUPPORTED
+
+    def func_ids(self):
+        return list(self._handlers)
+
+
+# the global registry, with the functions called by VIDEX-MySQL
+videx_funcs = VidexFuncRegistry()
+
+videx_funcs.register('scan_time', handler=lambda model, req: {"value": model.scan_time(req)})
+videx_funcs.register('get_memory_buffer_size',
+                     handler=lambda model, req: {"value": model.get_memory_buffer_size(req)})
+videx_funcs.register('records_in_range',
+                     RequestSpec(data_item_types=('min_key', 'max_key'), data_properties=('index_name',)),
+                     handler=lambda model, req: {"value": model.records_in_range(req)},
+                     batch_handler=lambda model, reqs: [None if n is None else {"value": n}
+                                                        for n in model.records_in_range_batch(reqs)])
+videx_funcs.register('info_low', handler=lambda model, req: model.info_low(req))
@@ -0,0 +1,70 @@
+"""
+Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+SPDX-License-Identifier: MIT
+
+Multi-worker serving mode of VIDEX statistic server, based on gunicorn.
+"""
+import logging
+from typing import Callable
+
+from flask import Flask
+from gunicorn.app.base import BaseApplication
+
+
+class VidexGunicornApplication(BaseApplication):
+    """
+    Serve the VIDEX flask app by gunicorn.
+
+    It's a pre-fork application factory: the flask app can be loaded in the master (preload), while the
+    VidexSingleton is built in each worker after fork by `worker_init_func`, so that no lock, thread or
+    log handler is shared across processes. Task meta is kept consistent across workers by the task store
+    of VidexSingleton (see VidexTaskStore).
+    """
+
+    def __init__(self, flask_app: Flask, worker_init_func: Callable[[], None], options: dict):
+        self.flask_app = flask_app
+        self.worker_init_func = worker_init_func
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if value is not None and key in self.cfg.settings:
+                self.cfg.set(key, value)
+
+        worker_init_func = self.worker_init_func
+
+        # N.B. gunicorn checks the arity of the hook, so we use a function instead of a bound method
+        def post_fork(server, worker):
+            worker_init_func()
+            # N.B. logging is re-configured by VidexSingleton in the worker, gunicorn's logger may be disabled
+            logging.info(f"VIDEX worker initialized: pid={worker.pid}")
+
+        self.cfg.set('post_fork', post_fork)
+
+    def load(self):
+        return self.flask_app
+
+
+def run_videx_gunicorn_server(flask_app: Flask, worker_init_func: Callable[[], None],
+                              bind: str, workers: int = 1, threads: int = 1, preload: bool = False,
+                              timeout: int = 120):
+    """
+    Args:
+        flask_app: the flask app to serve
+        worker_init_func: called in each worker after fork, to build the VidexSingleton
+        bind: "ip:port" or "unix:/path/to/videx.sock"
+        workers: number of worker processes
+        threads: number of threads in each worker, use gthread worker if > 1
+        preload: load the flask app in master before forking workers
+        timeout: seconds, workers silent for more than this are killed and restarted
+    """
+    options = {
+        'bind': bind,
+        'workers': workers,
+        'threads': threads,
+        'worker_class': 'gthread' if threads > 1 else 'sync',
+        'preload_app': preload,
+        'timeout': timeout,
+    }
+    VidexGunicornApplication(flask_app, worker_init_func, options).run()
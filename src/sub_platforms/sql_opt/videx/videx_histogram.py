@@ -4,15 +4,21 @@ Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
 SPDX-License-Identifier: MIT
 """
 import base64
+import bisect
 import json
 import logging
-from collections import defaultdict
-from typing import List, Optional, Union, Dict, Any, Tuple
-from pydantic import BaseModel, PlainSerializer, BeforeValidator
+from collections import Counter, defaultdict
+from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
+from typing import List, Optional, Union, Dict, Any, Tuple, Sequence
+from collections.abc import Sequence as SequenceABC
+from pydantic import BaseModel, ConfigDict, PlainSerializer, BeforeValidator, PrivateAttr, field_serializer
 from typing_extensions import Annotated
 import time
 import math
 import numpy as np
+import pandas as pd
 
 from sub_platforms.sql_opt.common.pydantic_utils import PydanticDataClassJsonMixin
 from sub_platforms.sql_opt.databases.mysql.mysql_command import MySQLVersion
@@ -20,7 +26,7 @@ from sub_platforms.sql_opt.env.rds_env import Env
 from sub_platforms.sql_opt.meta import Table, Column
 from sub_platforms.sql_opt.videx import videx_logging
 from sub_platforms.sql_opt.videx.videx_utils import BTreeKeySide, target_env_available_for_videx, parse_datetime, \
-    data_type_is_int, reformat_datetime_str
+    data_type_is_int, reformat_datetime_str, datetime_to_epoch_us, MICROSECONDS_PER_DAY
 from sub_platforms.sql_opt.histogram.histogram_utils import (
     block_level_sample,
     sort_and_validate,
@@ -38,6 +44,27 @@ MEANINGLESS_INT = -1357
 # Note that this NULL is distinct from "NULL"—the latter is a string with the value 'NULL'.
 NULL_STR = 'NULL'
 
+# rows read by generate_table_histograms_by_sample per table
+DEFAULT_TABLE_SAMPLE_ROWS = 100_000
+
+# numbers in (-2^51, 2^51) are exact in float64, as are their sums and differences. The vectorized search of
+# numeric histograms only handles them, so that it gives exactly the same results as find_nearest_key_pos.
+_EXACT_FLOAT_LIMIT = 2 ** 51
+
+
+def _exact_in_float64(value) -> bool:
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return -_EXACT_FLOAT_LIMIT < value < _EXACT_FLOAT_LIMIT
+    return isinstance(value, float) and not math.isnan(value)
+
+
+def _exact_in_float64_array(array: np.ndarray) -> bool:
+    if array.dtype == np.int64:
+        return bool(np.all((array > -_EXACT_FLOAT_LIMIT) & (array < _EXACT_FLOAT_LIMIT)))
+    return array.dtype == np.float64 and not np.isnan(array).any()
+
 
 def decode_base64(raw):
     """
@@ -103,8 +130,8 @@ def convert_str_by_type(raw, data_type: str, str_in_base4: bool = True):
                 (res.startswith('"') and res.endswith('"')):
             res = res[1:-1]
         return res
-    elif data_type in ['datetime', 'date', 'timestamp']:
-        if '0000-00-00' in str(raw) or '1-01-01 00:00:00' in str(raw):
+    elif data_type in TEMPORAL_TYPES:
+        if is_zero_datetime(raw):
             return raw
         return reformat_datetime_str(str(raw))
     elif data_type == 'decimal':
@@ -119,6 +146,29 @@ def convert_str_by_type(raw, data_type: str, str_in_base4: bool = True):
         raise ValueError(f"Not support data type: {data_type}")
 
 
+TEMPORAL_TYPES = ('date', 'datetime', 'timestamp')
+_YEAR_1000_EPOCH_US = datetime_to_epoch_us(datetime(1000, 1, 1))
+
+
+def is_zero_datetime(raw) -> bool:
+    # MySQL zero dates, kept as they are by convert_str_by_type
+    return '0000-00-00' in str(raw) or '1-01-01 00:00:00' in str(raw)
+
+
+@lru_cache(maxsize=4096)
+def temporal_to_epoch_us(raw) -> Optional[int]:
+    """
+    Microseconds since 1970-01-01 of a date/datetime literal, None for zero dates.
+    Cached by the raw literal, since the optimizer probes the same literals again and again.
+    """
+    try:
+        return datetime_to_epoch_us(parse_datetime(str(raw)))
+    except ValueError:
+        if is_zero_datetime(raw):
+            return None
+        raise
+
+
 def large_number_encoder(x):
     MIN_LONG = -2 ** 63
     MAX_LONG = 2 ** 63 - 1
@@ -143,6 +193,169 @@ class HistogramBucket(BaseModel, PydanticDataClassJsonMixin):
     bucket_freq: float = None  # =buckets[i+1].cum_freq - buckets[i].cum_freq. For now, it's only used to sort singleton buckets.
 
 
+class _FrozenHistogramBucket(HistogramBucket):
+    """
+    A bucket created by HistogramBuckets. Assigning a field raises, since the write would be lost.
+    It equals a HistogramBucket with the same fields.
+    """
+    model_config = ConfigDict(frozen=True)
+
+    def __eq__(self, other):
+        if isinstance(other, HistogramBucket):
+            return self.__dict__ == other.__dict__
+        return NotImplemented
+
+    __hash__ = None
+
+
+class _Column(SequenceABC):
+    """
+    A read-only column of bucket values, see HistogramBuckets. Subclasses implement _item.
+    """
+
+    def _item(self, i: int):
+        raise NotImplementedError
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._item(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("column index out of range")
+        return self._item(i)
+
+    def __eq__(self, other):
+        return isinstance(other, SequenceABC) and len(self) == len(other) and list(self) == list(other)
+
+    __hash__ = None
+
+
+class _ArrayColumn(_Column):
+    """
+    Numbers kept in a numpy array. Items are python numbers, as in a list.
+    """
+
+    def __init__(self, array: np.ndarray):
+        self.array = array
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.array[i].tolist()
+        return self.array.item(i)
+
+
+class _StrColumn(_Column):
+    """
+    Strings encoded in one utf-8 blob, with the offsets of each string.
+    """
+
+    def __init__(self, values: List[str]):
+        encoded = [v.encode('utf-8', 'surrogatepass') for v in values]
+        self.blob = b''.join(encoded)
+        self.offsets = np.cumsum([0] + [len(e) for e in encoded],
+                                 dtype=np.int32 if len(self.blob) < 2 ** 31 else np.int64)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _item(self, i: int):
+        return self.blob[self.offsets.item(i):self.offsets.item(i + 1)].decode('utf-8', 'surrogatepass')
+
+
+class _RepeatColumn(_Column):
+    """
+    The same value in all buckets, e.g. size.
+    """
+
+    def __init__(self, value, n: int):
+        self.value = value
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def _item(self, i: int):
+        return self.value
+
+
+class _DiffColumn(_Column):
+    """
+    Differences of a column of cumulative numbers, i.e. bucket_freq of cum_freq.
+    """
+
+    def __init__(self, cum: _ArrayColumn):
+        self.cum = cum
+
+    def __len__(self):
+        return len(self.cum)
+
+    def _item(self, i: int):
+        return self.cum[0] if i == 0 else self.cum[i] - self.cum[i - 1]
+
+
+def _pack_column(values: list, dtype=None) -> Sequence:
+    """
+    Compact column of values: a numpy array of numbers (of dtype if given), or one blob of strings.
+    Values of other or mixed types (e.g. NULL bounds, integers out of int64) are kept in the list.
+    """
+    if len(values) == 0:
+        return values
+    if dtype is not None:
+        if all(v is not None for v in values):
+            if all(v == values[0] for v in values):
+                return _RepeatColumn(dtype(values[0]).item(), len(values))
+            return _ArrayColumn(np.array(values, dtype=dtype))
+    elif all(type(v) is int for v in values):
+        if -2 ** 63 <= min(values) and max(values) < 2 ** 63:
+            return _ArrayColumn(np.array(values, dtype=np.int64))
+    elif all(type(v) is float for v in values):
+        return _ArrayColumn(np.array(values, dtype=np.float64))
+    elif all(type(v) is str for v in values):
+        return _StrColumn(values)
+    return values
+
+
+class HistogramBuckets(SequenceABC):
+    """
+    Buckets of a HistogramStats, stored as columns (see _pack_column) instead of one HistogramBucket per bucket.
+    It's a read-only sequence of HistogramBucket, which are created (frozen) when accessed.
+    """
+
+    def __init__(self, buckets: List[HistogramBucket]):
+        self.min_values = _pack_column([b.min_value for b in buckets])
+        self.max_values = _pack_column([b.max_value for b in buckets])
+        self.cum_freqs = _ArrayColumn(np.array([b.cum_freq for b in buckets], dtype=np.float64))
+        self.row_counts = _ArrayColumn(np.array([b.row_count for b in buckets], dtype=np.float64))
+        self.sizes = _pack_column([b.size for b in buckets], np.int64)
+        self.bucket_freqs = _pack_column([b.bucket_freq for b in buckets], np.float64)
+        if isinstance(self.bucket_freqs, _ArrayColumn) and \
+                np.array_equal(self.bucket_freqs.array, np.diff(self.cum_freqs.array, prepend=0.)):
+            # bucket_freq is computed from cum_freq, except for the re-sorted singleton buckets
+            self.bucket_freqs = _DiffColumn(self.cum_freqs)
+
+    def __len__(self):
+        return len(self.cum_freqs)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return _FrozenHistogramBucket.model_construct(min_value=self.min_values[i], max_value=self.max_values[i],
+                                                      cum_freq=self.cum_freqs[i], row_count=self.row_counts[i],
+                                                      size=self.sizes[i], bucket_freq=self.bucket_freqs[i])
+
+    def __eq__(self, other):
+        return isinstance(other, SequenceABC) and len(self) == len(other) and list(self) == list(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+
 def init_bucket_by_type(bucket_raw: list, data_type: str, hist_type: str) -> HistogramBucket:
     """
     init HistogramBucket
@@ -212,6 +425,7 @@ class HistogramStats(BaseModel, PydanticDataClassJsonMixin):
     }
     """
     # table_rows: int
+    # a list when validated, then kept in columns (HistogramBuckets) by model_post_init, serialized as the list
     buckets: Optional[List[HistogramBucket]]
     data_type: Optional[str]
     histogram_type: Optional[str]
@@ -222,6 +436,19 @@ class HistogramStats(BaseModel, PydanticDataClassJsonMixin):
     number_of_buckets_specified: Optional[int] = MEANINGLESS_INT
     database_type: Optional[str] = 'mysql'
 
+    # search index over the buckets, built in model_post_init. Buckets are treated as read-only after init.
+    _min_values: Sequence = PrivateAttr(default_factory=list)
+    _max_values: Sequence = PrivateAttr(default_factory=list)
+    _cum_freqs: Sequence[float] = PrivateAttr(default_factory=list)
+    _row_counts: Sequence[float] = PrivateAttr(default_factory=list)
+    # False if bucket bounds are not sorted (or not comparable), then we fall back to the linear scan
+    _bounds_sorted: bool = PrivateAttr(default=False)
+    # True if the bounds of a temporal histogram are kept as epoch microseconds, instead of datetime strings
+    _epoch_bounds: bool = PrivateAttr(default=False)
+    # columns of (min_values, max_values, cum_freqs, row_counts) for find_nearest_key_pos_batch,
+    # None if the histogram is not numeric or its bounds are not exact in float64
+    _np_bounds: Optional[Tuple[_ArrayColumn, ...]] = PrivateAttr(default=None)
+
     def model_post_init(self, __context: Any) -> None:
         if int(self.null_values) == MEANINGLESS_INT:
             self.null_values = 0
@@ -244,6 +471,8 @@ class HistogramStats(BaseModel, PydanticDataClassJsonMixin):
                 assert self.buckets[i + 1].bucket_freq > 0, f"bucket_freq must > 0, but got {self.buckets[i]=}, {self.buckets[i+1]=}"
 
         if len(self.buckets) == 0:
+            self.buckets = HistogramBuckets(self.buckets)
+            self._build_search_index()
             return
 
         # if row_count (i.e., ndv) is 1, let bucket.max -> bucket.min
@@ -283,10 +512,122 @@ class HistogramStats(BaseModel, PydanticDataClassJsonMixin):
                 self.buckets[-1].cum_freq = 1.0
             else:
                 raise ValueError(f"Buckets must have monotonically increasing, but got {self}")
+        # buckets are read-only from now on, keep them in columns. Writes to them raise, see _FrozenHistogramBucket
+        self.buckets = HistogramBuckets(self.buckets)
+        self._build_search_index()
+
+    @field_serializer('buckets', mode='wrap')
+    def _serialize_buckets(self, buckets, handler):
+        # serialized as the list of HistogramBucket
+        return handler(list(buckets) if isinstance(buckets, HistogramBuckets) else buckets)
+
+    def _build_search_index(self):
+        """
+        Index the bucket columns (bounds, cum_freq and row_count), so that find_nearest_key_pos can
+        locate the bucket by binary search instead of scanning the buckets one by one.
+        """
+        self._min_values = self.buckets.min_values
+        self._max_values = self.buckets.max_values
+        self._epoch_bounds = False
+        if self.data_type in TEMPORAL_TYPES and len(self.buckets) > 0:
+            # parse the datetime strings once, instead of for each key
+            try:
+                epochs = [datetime_to_epoch_us(parse_datetime(v))
+                          for v in list(self._min_values) + list(self._max_values)]
+            except (ValueError, TypeError, OverflowError):
+                # e.g. zero dates in bounds
+                epochs = None
+            # years before 1000 are not ordered as datetime strings, keep comparing the strings
+            if epochs is not None and min(epochs) >= _YEAR_1000_EPOCH_US:
+                n = len(self.buckets)
+                self._min_values = _ArrayColumn(np.array(epochs[:n], dtype=np.int64))
+                self._max_values = _ArrayColumn(np.array(epochs[n:], dtype=np.int64))
+                self._epoch_bounds = True
+        self._cum_freqs = self.buckets.cum_freqs
+        self._row_counts = self.buckets.row_counts
+        if isinstance(self._min_values, _ArrayColumn) and isinstance(self._max_values, _ArrayColumn):
+            min_array, max_array = self._min_values.array, self._max_values.array
+            self._bounds_sorted = bool(np.all(min_array <= max_array) and np.all(max_array[:-1] <= min_array[1:]))
+        else:
+            try:
+                self._bounds_sorted = all(lo <= hi for lo, hi in zip(self._min_values, self._max_values)) and \
+                                      all(self._max_values[i] <= self._min_values[i + 1]
+                                          for i in range(len(self._min_values) - 1))
+            except TypeError:
+                # e.g. mixed types in bounds, bisect is meaningless
+                self._bounds_sorted = False
+
+        self._np_bounds = None
+        numeric = self.data_type is not None and \
+            (data_type_is_int(self.data_type) or self.data_type in ['float', 'double', 'decimal'])
+        mariadb_ranges = self.database_type == 'mariadb' and not self.histogram_type == 'singleton'
+        columns = (self._min_values, self._max_values, self._cum_freqs, self._row_counts)
+        if numeric and self._bounds_sorted and not mariadb_ranges and len(self.buckets) > 0 \
+                and all(isinstance(c, _ArrayColumn) for c in columns) \
+                and all(_exact_in_float64_array(c.array) for c in columns[:2]) \
+                and _exact_in_float64_array(self._row_counts.array) and np.all(self._row_counts.array > 0):
+            self._np_bounds = columns
+
+    def _search_bucket(self, value) -> Tuple[Optional[int], Any]:
+        """
+        Binary search the first bucket that contains the value. The value must be in [buckets[0].min, buckets[-1].max].
+
+        Returns:
+            (bucket index, value). index is None if no bucket is found.
+            If the value falls in the gap between two buckets, it's clamped to the max_value of the left bucket.
+        """
+        if not self._bounds_sorted:
+            return self._search_bucket_linear(value)
+        n = len(self._max_values)
+        if self.database_type == 'mariadb' and not self.histogram_type == 'singleton':
+            # MariaDB: [min_value, max_value) for the buckets except the last one, which is [min_value, max_value]
+            i = bisect.bisect_right(self._max_values, value, 0, n - 1)
+            if self._min_values[i] <= value:
+                return i, value
+        else:
+            # MySQL: [min_value, max_value]
+            i = bisect.bisect_left(self._max_values, value)
+            if i < n:
+                if self._min_values[i] <= value:
+                    return i, value
+                if i > 0 and self._max_values[i - 1] < value:
+                    logging.warning(f"!!!!!!!!! value(={value})%s is "
+                                    f"between buckets-{i - 1} and {i}: {self.buckets[i - 1]}, {self.buckets[i]}")
+                    return i - 1, self._max_values[i - 1]
+        # rare cases, e.g. the value is in the gap of MariaDB buckets, or NaN. Keep the behavior of linear scan.
+        return self._search_bucket_linear(value)
+
+    def _search_bucket_linear(self, value) -> Tuple[Optional[int], Any]:
+        """
+        Scan from left to right, find the first bucket that contains the value. Same return as _search_bucket.
+        """
+        for i in range(len(self.buckets)):
+            if i < len(self.buckets) and (self._max_values[i] < value < self._min_values[i + 1]):
+                logging.warning(f"!!!!!!!!! value(={value})%s is "
+                                f"between buckets-{i} and {i + 1}: {self.buckets[i]}, {self.buckets[i + 1]}")
+                value = self._max_values[i]
+            min_value, max_value = self._min_values[i], self._max_values[i]
+            if self.database_type == 'mariadb' and not self.histogram_type == 'singleton':
+                # MariaDB: closed interval for the last bucket, open interval for the others
+                # As we handled in model_post, in singleton mode,
+                # the MariaDB bucket ranges are also closed on both ends (i.e., [a, b] intervals).
+                if i == len(self.buckets) - 1:
+                    # the last bucket: closed interval [min_value, max_value]
+                    if min_value <= value <= max_value:
+                        return i, value
+                else:
+                    # other buckets: open interval [min_value, max_value)
+                    if min_value <= value < max_value:
+                        return i, value
+            else:
+                # MySQL bucket is closed interval
+                if min_value <= value <= max_value:
+                    return i, value
+        return None, value
 
     def find_nearest_key_pos(self, value, side: BTreeKeySide) -> Union[int, float]:
         """
-        Scan from left to right, find the first bucket that contains the value.
+        Find the first bucket that contains the value (binary search), and return the cumulative frequency of the key.
 
         Args:
             value: the value to search
@@ -319,113 +660,101 @@ class HistogramStats(BaseModel, PydanticDataClassJsonMixin):
             # So, the cumulative count up to this value includes all NULLs.
             return self.null_values
 
-        value = convert_str_by_type(value, self.data_type, str_in_base4=False)  # histogram is base4 encoding，but request is raw string
+        if self._epoch_bounds:
+            value = temporal_to_epoch_us(value)
+            if value is None:
+                # zero dates are before all dates
+                return self.null_values
+        else:
+            value = convert_str_by_type(value, self.data_type, str_in_base4=False)  # histogram is base4 encoding，but request is raw string
 
         # convert to 0
-        if value > self.buckets[-1].max_value:
+        if value > self._max_values[-1]:
             key_cum_freq = 1
-        elif value < self.buckets[0].min_value:
+        elif value < self._min_values[0]:
             key_cum_freq = 0
         else:
             key_cum_freq = None
-            bucket_found = False
-            for i in range(len(self.buckets)):
-                if i < len(self.buckets) and (self.buckets[i].max_value < value < self.buckets[i + 1].min_value):
-                    logging.warning(f"!!!!!!!!! value(={value})%s is "
-                                    f"between buckets-{i} and {i + 1}: {self.buckets[i]}, {self.buckets[i + 1]}")
-                    value = self.buckets[i].max_value
-                cur: HistogramBucket = self.buckets[i]
-
-                if self.database_type == 'mariadb' and not self.histogram_type == 'singleton':
-                    # MariaDB: closed interval for the last bucket, open interval for the others
-                    # As we handled in model_post, in singleton mode,
-                    # the MariaDB bucket ranges are also closed on both ends (i.e., [a, b] intervals).
-                    if i == len(self.buckets) - 1:
-                        # the last bucket: closed interval [min_value, max_value]
-                        if cur.min_value <= value <= cur.max_value:
-                            bucket_found = True
-                    else:
-                        # other buckets: open interval [min_value, max_value)
-                        if cur.min_value <= value < cur.max_value:
-                            bucket_found = True
+            i, value = self._search_bucket(value)
+            if i is not None:
+                min_value, max_value, row_count = self._min_values[i], self._max_values[i], self._row_counts[i]
+                # a float number between [0, 1], it's the width of one value in the bucket,
+                # 1 means that all values in the bucket are same.
+                one_value_width: float
+                # a float number between [0, 1], it's the offset of one value in the bucket,
+                # 0 means that the value is the min value in the bucket, 1 means that the value is the max value in the bucket.
+                one_value_offset: float
+
+                # TODO we use the uniform distribution assumption temporarily.
+                # Under the uniform distribution, the width of a value is at least 1 / bucket_ndv.
+                one_value_width = 1 / row_count
+
+                if min_value == max_value:
+                    one_value_width, one_value_offset = 1, 0
                 else:
-                    # MySQL bucket is closed interval
-                    if cur.min_value <= value <= cur.max_value:
-                        bucket_found = True
-                
-                if bucket_found:
-                    # a float number between [0, 1], it's the width of one value in the bucket,
-                    # 1 means that all values in the bucket are same.
-                    one_value_width: float
-                    # a float number between [0, 1], it's the offset of one value in the bucket,
-                    # 0 means that the value is the min value in the bucket, 1 means that the value is the max value in the bucket.
-                    one_value_offset: float
-
-                    # TODO we use the uniform distribution assumption temporarily.
-                    # Under the uniform distribution, the width of a value is at least 1 / bucket_ndv.
-                    one_value_width = 1 / cur.row_count
-
-                    if cur.min_value == cur.max_value:
-                        one_value_width, one_value_offset = 1, 0
-                    else:
-                        if data_type_is_int(self.data_type):
-                            one_value_width = max(1 / (int(cur.max_value) - int(cur.min_value) + 1), one_value_width)
-                            one_value_offset = (value - cur.min_value) / (cur.max_value + 1 - cur.min_value)
-                        elif self.data_type in ['float', 'double', 'decimal']:
-                            # we thought the width of float number can be close to 0 temporarily
-                            one_value_offset = (value - cur.min_value) / (cur.max_value - cur.min_value)
-                        elif self.data_type in ['string', 'varchar', 'char', 'enum']:
-                            # Strings and enums only support comparison and do not support addition or subtraction,
-                            # so we only compare the two ends.
-                            # For values that are neither the minimum (min) nor the maximum (max), we take 1/2.
-                            if value == cur.min_value:
-                                one_value_offset = 0
-                            elif value == cur.max_value:
-                                one_value_offset = 1
-                            else:
-                                one_value_offset = 0.5
-                        elif self.data_type in ['date']:
-                            # In MySQL, columns of the DATE type contain only the year, month, and day components,
-                            # excluding the time (i.e., hours, minutes, and seconds).
-                            # According to the official MySQL documentation,
-                            # the format for date values should be 'YYYY-MM-DD'.
-                            # However, formats such as YYYYMMDD, YY-MM-DD and even timestamps are also supported:
-                            # e.g. SELECT L_SHIPDATE FROM lineitem WHERE FROM_UNIXTIME(1672531200) < L_SHIPDATE LIMIT 5;
-                            # But in the underlying implementation, all are converted to the format YYYY-MM-DD.
-                            min_date = parse_datetime(cur.min_value).date()
-                            max_date = parse_datetime(cur.max_value).date()
-                            value_date = parse_datetime(value).date()
-
-                            total_days = (max_date - min_date).days + 1
-                            one_value_width = max(1 / total_days, one_value_width)
-                            one_value_offset = (value_date - min_date).days / total_days
-
-                        elif self.data_type in ['datetime', 'timestamp']:
-                            min_datetime = parse_datetime(cur.min_value)
-                            max_datetime = parse_datetime(cur.max_value)
-                            value_datetime = parse_datetime(value)
-
-                            total_seconds = int((max_datetime - min_datetime).total_seconds())
-                            one_value_width = max(1 / total_seconds, one_value_width)
-                            if total_seconds != 0:
-                                one_value_offset = (value_datetime - min_datetime).total_seconds() / total_seconds
-                            else:
-                                one_value_offset = 0
+                    if data_type_is_int(self.data_type):
+                        one_value_width = max(1 / (int(max_value) - int(min_value) + 1), one_value_width)
+                        one_value_offset = (value - min_value) / (max_value + 1 - min_value)
+                    elif self.data_type in ['float', 'double', 'decimal']:
+                        # we thought the width of float number can be close to 0 temporarily
+                        one_value_offset = (value - min_value) / (max_value - min_value)
+                    elif self.data_type in ['string', 'varchar', 'char', 'enum']:
+                        # Strings and enums only support comparison and do not support addition or subtraction,
+                        # so we only compare the two ends.
+                        # For values that are neither the minimum (min) nor the maximum (max), we take 1/2.
+                        if value == min_value:
+                            one_value_offset = 0
+                        elif value == max_value:
+                            one_value_offset = 1
                         else:
-                            raise NotImplementedError(f"data_type {self.data_type} not supported")
-                        # the case that one_value_offset is at the right boundary
-                        one_value_offset = min(one_value_offset, 1 - one_value_width)
-
-                    if side == BTreeKeySide.left:
-                        pos_in_bucket = one_value_offset
-                    elif side == BTreeKeySide.right:
-                        pos_in_bucket = one_value_offset + one_value_width
+                            one_value_offset = 0.5
+                    elif self.data_type in ['date']:
+                        # In MySQL, columns of the DATE type contain only the year, month, and day components,
+                        # excluding the time (i.e., hours, minutes, and seconds).
+                        # According to the official MySQL documentation,
+                        # the format for date values should be 'YYYY-MM-DD'.
+                        # However, formats such as YYYYMMDD, YY-MM-DD and even timestamps are also supported:
+                        # e.g. SELECT L_SHIPDATE FROM lineitem WHERE FROM_UNIXTIME(1672531200) < L_SHIPDATE LIMIT 5;
+                        # But in the underlying implementation, all are converted to the format YYYY-MM-DD.
+                        if self._epoch_bounds:
+                            min_days, max_days, value_days = (v // MICROSECONDS_PER_DAY
+                                                              for v in (min_value, max_value, value))
+                        else:
+                            min_days, max_days, value_days = (parse_datetime(v).date().toordinal()
+                                                              for v in (min_value, max_value, value))
+
+                        total_days = max_days - min_days + 1
+                        one_value_width = max(1 / total_days, one_value_width)
+                        one_value_offset = (value_days - min_days) / total_days
+
+                    elif self.data_type in ['datetime', 'timestamp']:
+                        if self._epoch_bounds:
+                            min_us, max_us, value_us = min_value, max_value, value
+                        else:
+                            min_us, max_us, value_us = (datetime_to_epoch_us(parse_datetime(v))
+                                                        for v in (min_value, max_value, value))
+
+                        # same as timedelta.total_seconds()
+                        total_seconds = int((max_us - min_us) / 10 ** 6)
+                        one_value_width = max(1 / total_seconds, one_value_width)
+                        if total_seconds != 0:
+                            one_value_offset = (value_us - min_us) / 10 ** 6 / total_seconds
+                        else:
+                            one_value_offset = 0
                     else:
-                        raise ValueError(f"only support key pos side left and right, but get {side}")
+                        raise NotImplementedError(f"data_type {self.data_type} not supported")
+                    # the case that one_value_offset is at the right boundary
+                    one_value_offset = min(one_value_offset, 1 - one_value_width)
+
+                if side == BTreeKeySide.left:
+                    pos_in_bucket = one_value_offset
+                elif side == BTreeKeySide.right:
+                    pos_in_bucket = one_value_offset + one_value_width
+                else:
+                    raise ValueError(f"only support key pos side left and right, but get {side}")
 
-                    pre_cum_freq = 0 if i == 0 else self.buckets[i - 1].cum_freq
-                    key_cum_freq = pre_cum_freq + (cur.cum_freq - pre_cum_freq) * pos_in_bucket
-                    break
+                pre_cum_freq = 0 if i == 0 else self._cum_freqs[i - 1]
+                key_cum_freq = pre_cum_freq + (self._cum_freqs[i] - pre_cum_freq) * pos_in_bucket
         assert key_cum_freq is not None
 
         # MySQL histogram frequency is inconsistent with the in-equation condition.
@@ -433,6 +762,91 @@ class HistogramStats(BaseModel, PydanticDataClassJsonMixin):
         # 0, null_values(ratio), null_values + buckets[0].min, null_values + buckets[-1].max(almost 1)
         return key_cum_freq + self.null_values
 
+    def find_nearest_key_pos_batch(self, values: Sequence, sides: Sequence[BTreeKeySide]) -> np.ndarray:
+        """
+        find_nearest_key_pos of many keys, with one np.searchsorted over the bucket bounds for all of them.
+        Numeric keys are computed by the same float operations as find_nearest_key_pos, so the results are exactly
+        the same. The other keys (e.g. NULL, strings, dates, or numbers not exact in float64) are computed one by one.
+        """
+        result = np.empty(len(values), dtype=np.float64)
+        fast_idx, fast_values, fast_right = [], [], []
+        for k, (value, side) in enumerate(zip(values, sides)):
+            if self._np_bounds is not None and value is not None \
+                    and side in (BTreeKeySide.left, BTreeKeySide.right):
+                typed_value = convert_str_by_type(value, self.data_type, str_in_base4=False)
+                if _exact_in_float64(typed_value):
+                    fast_idx.append(k)
+                    fast_values.append(typed_value)
+                    fast_right.append(side == BTreeKeySide.right)
+                    continue
+            result[k] = self.find_nearest_key_pos(value, side)
+        if fast_idx:
+            result[fast_idx] = self._key_pos_vectorized(np.array(fast_values, dtype=np.float64),
+                                                        np.array(fast_right, dtype=bool))
+        return result
+
+    def _key_pos_vectorized(self, values: np.ndarray, right: np.ndarray) -> np.ndarray:
+        """
+        Vectorized find_nearest_key_pos of non-null numeric values, see find_nearest_key_pos_batch.
+        """
+        min_values, max_values, cum_freqs, row_counts = (c.array for c in self._np_bounds)
+        key_cum_freq = np.zeros(len(values), dtype=np.float64)
+        key_cum_freq[values > max_values[-1]] = 1
+        inside = (values >= min_values[0]) & (values <= max_values[-1])
+        if inside.any():
+            value, right = values[inside], right[inside]
+            # MySQL: [min_value, max_value], the first bucket whose max_value >= value
+            i = np.searchsorted(max_values, value, side='left')
+            in_gap = min_values[i] > value
+            if in_gap.any():
+                logging.warning(f"!!!!!!!!! {int(in_gap.sum())} values are between buckets, "
+                                f"clamp them to the max_value of the left buckets")
+                i = np.where(in_gap, i - 1, i)
+                value = np.where(in_gap, max_values[i], value)
+            min_value, max_value = min_values[i], max_values[i]
+            one_value_width = 1 / row_counts[i]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                if data_type_is_int(self.data_type):
+                    one_value_width = np.maximum(1 / (max_value - min_value + 1), one_value_width)
+                    one_value_offset = (value - min_value) / (max_value + 1 - min_value)
+                else:
+                    one_value_offset = (value - min_value) / (max_value - min_value)
+            one_value_offset = np.minimum(one_value_offset, 1 - one_value_width)
+            same = min_value == max_value
+            one_value_width = np.where(same, 1., one_value_width)
+            one_value_offset = np.where(same, 0., one_value_offset)
+
+            pos_in_bucket = np.where(right, one_value_offset + one_value_width, one_value_offset)
+            pre_cum_freq = np.where(i == 0, 0., cum_freqs[np.maximum(i - 1, 0)])
+            key_cum_freq[inside] = pre_cum_freq + (cum_freqs[i] - pre_cum_freq) * pos_in_bucket
+        return key_cum_freq + self.null_values
+
+    def find_range_key_pos(self, min_values: Sequence, min_sides: Sequence[Optional[BTreeKeySide]],
+                           max_values: Sequence, max_sides: Sequence[Optional[BTreeKeySide]]
+                           ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Key positions of the bounds of many ranges, in one find_nearest_key_pos_batch.
+        The selectivity of range k is max_pos[k] - min_pos[k].
+
+        Args:
+            min_values, min_sides, max_values, max_sides: bounds of the ranges. A side of None means the range
+                has no such bound, whose position is 0 (min) or 1 (max).
+
+        Returns:
+            (min_pos, max_pos)
+        """
+        n = len(min_values)
+        min_bounded = [k for k in range(n) if min_sides[k] is not None]
+        max_bounded = [k for k in range(n) if max_sides[k] is not None]
+        pos = self.find_nearest_key_pos_batch([min_values[k] for k in min_bounded] +
+                                              [max_values[k] for k in max_bounded],
+                                              [min_sides[k] for k in min_bounded] +
+                                              [max_sides[k] for k in max_bounded])
+        min_pos, max_pos = np.zeros(n, dtype=np.float64), np.ones(n, dtype=np.float64)
+        min_pos[min_bounded] = pos[:len(min_bounded)]
+        max_pos[max_bounded] = pos[len(min_bounded):]
+        return min_pos, max_pos
+
     @staticmethod
     def init_all_null_histogram(data_type: str):
         """
@@ -917,6 +1331,160 @@ def force_generate_histogram_by_sdc_for_col(env: Env, db_name: str, table_name:
     return HistogramStats.init_from_mysql_json(res_dict)
 
 
+def _sample_value_str(value, data_type: str) -> str:
+    """ a value read from the table as the string of a histogram bucket, see convert_str_by_type """
+    if data_type in TEMPORAL_TYPES and hasattr(value, 'strftime'):
+        # datetime, date or pd.Timestamp, without the timezone suffix of str()
+        return value.strftime('%Y-%m-%d %H:%M:%S.%f' if hasattr(value, 'hour') else '%Y-%m-%d')
+    if isinstance(value, Decimal):
+        # no exponent, e.g. 1E+2
+        return format(value, 'f')
+    return str(value)
+
+
+def _widen_to_bounds(buckets: List[list], min_value, max_value):
+    """
+    Extend the first and the last [min, max, cumulative count, ndv] buckets to the MIN and MAX of the column,
+    which a sample may miss. A widened bound is a distinct value not in the sample, so it adds one to the ndv.
+    """
+    if min_value is not None and min_value < buckets[0][0]:
+        buckets[0] = [min_value, buckets[0][1], buckets[0][2], buckets[0][3] + 1]
+    if max_value is not None and max_value > buckets[-1][1]:
+        buckets[-1] = [buckets[-1][0], max_value, buckets[-1][2], buckets[-1][3] + 1]
+
+
+def build_histogram_from_column_sample(values: list, data_type: str, n_buckets: int, null_ratio: float,
+                                       min_value=None, max_value=None, sampling_rate: float = 1.0,
+                                       ndv: int = None, database_type: str = 'mysql') -> HistogramStats:
+    """
+    Build a histogram from the non-null values of a column in memory, where equal values never span two buckets.
+    It's singleton only if the values are known to have all distinct values of the column, i.e. the values are
+    the whole column (sampling_rate >= 1) or the known ndv is at most n_buckets, and they have at most n_buckets
+    distinct values and cover MIN and MAX. Otherwise, it's equi-height, extended to MIN and MAX.
+
+    Args:
+        values: non-null values of the column, sampled or all
+        null_ratio: NULL ratio of the column, in [0, 1]
+        min_value, max_value: MIN and MAX of the column if known
+        ndv: ndv of the column if known
+    """
+    res_dict = {
+        "buckets": [],
+        "data-type": data_type,
+        "histogram-type": "singleton",
+        "null-values": null_ratio,
+        "collation-id": MEANINGLESS_INT,
+        "sampling-rate": sampling_rate,
+        "number-of-buckets-specified": n_buckets,
+        "database-type": database_type,
+    }
+    if len(values) == 0 and min_value is not None and max_value is not None:
+        # the sample missed all non-null values
+        values = [min_value] if min_value == max_value else [min_value, max_value]
+    if len(values) == 0 or n_buckets <= 0:
+        res_dict['number-of-buckets-specified'] = 0
+        return HistogramStats.init_from_mysql_json(res_dict)
+
+    distinct = sorted(Counter(values).items(), key=lambda item: item[0])
+    n_values, non_null_freq = len(values), 1 - null_ratio
+    all_distinct_known = sampling_rate >= 1 or (ndv is not None and ndv <= n_buckets)
+    covers_bounds = (min_value is None or not min_value < distinct[0][0]) and \
+                    (max_value is None or not max_value > distinct[-1][0])
+    if all_distinct_known and covers_bounds and len(distinct) <= n_buckets and (ndv is None or ndv <= n_buckets):
+        cum = 0
+        for value, count in distinct:
+            cum += count
+            res_dict['buckets'].append([_sample_value_str(value, data_type), non_null_freq * cum / n_values])
+        return HistogramStats.init_from_mysql_json(res_dict)
+
+    res_dict['histogram-type'] = 'equi-height'
+    # [min, max, cumulative count, ndv]
+    buckets = []
+    cum, bucket_min, bucket_ndv = 0, None, 0
+    for i, (value, count) in enumerate(distinct):
+        if bucket_min is None:
+            bucket_min, bucket_ndv = value, 0
+        cum += count
+        bucket_ndv += 1
+        # close the bucket once it reaches its share of the values
+        if cum * n_buckets >= (len(buckets) + 1) * n_values or i == len(distinct) - 1:
+            buckets.append([bucket_min, value, cum, bucket_ndv])
+            bucket_min = None
+    _widen_to_bounds(buckets, min_value, max_value)
+    for lower, upper, cum, bucket_ndv in buckets:
+        res_dict['buckets'].append([_sample_value_str(lower, data_type), _sample_value_str(upper, data_type),
+                                    non_null_freq * cum / n_values, bucket_ndv])
+    return HistogramStats.init_from_mysql_json(res_dict)
+
+
+def _scalar_or_none(value):
+    """ a value of a dataframe cell as python object, None for NULL """
+    if value is None or (isinstance(value, float) and math.isnan(value)) or value is pd.NaT:
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def generate_table_histograms_by_sample(env: Env, db_name: str, table_name: str, n_buckets: int,
+                                        col_names: List[str] = None,
+                                        sample_rows: int = DEFAULT_TABLE_SAMPLE_ROWS,
+                                        ndv_dict: Dict[str, int] = None) -> Dict[str, Optional[HistogramStats]]:
+    """
+    Generate the histograms of the columns of a table by two queries, instead of the queries per column
+    (and per bucket) of force_generate_histogram_by_sdc_for_col:
+        1. one aggregation of the row count, and COUNT, MIN, MAX of each column;
+        2. one pass reading all columns of about sample_rows rows, i.e. all rows of a small table.
+    Then the histograms are built in memory, see build_histogram_from_column_sample.
+
+    Args:
+        col_names: columns to generate, None means all columns
+        ndv_dict: column -> ndv if known
+
+    Returns:
+        column name -> HistogramStats, None if the column has no histogram (e.g. unsupported data type)
+    """
+    table_meta: Table = env.get_table_meta(db_name, table_name)
+    columns = [col for col in table_meta.columns if col_names is None or col.name in col_names]
+    if len(columns) == 0:
+        return {}
+    ndv_dict = ndv_dict or {}
+
+    agg_items = ['COUNT(1) AS total_rows']
+    for i, col in enumerate(columns):
+        agg_items += [f"COUNT(`{col.name}`) AS nn_{i}", f"MIN(`{col.name}`) AS min_{i}",
+                      f"MAX(`{col.name}`) AS max_{i}"]
+    agg = env.query_for_dataframe(f"SELECT {', '.join(agg_items)} FROM `{db_name}`.`{table_name}`").iloc[0]
+    total_rows = int(agg['total_rows'])
+
+    sampling_rate = 1. if total_rows <= sample_rows else sample_rows / total_rows
+    sample_df = None
+    if total_rows > 0:
+        select_items = ', '.join(f"`{col.name}` AS c_{i}" for i, col in enumerate(columns))
+        where = '' if sampling_rate >= 1 else f" WHERE RAND() < {sampling_rate:.10f}"
+        sample_df = env.query_for_dataframe(f"SELECT {select_items} FROM `{db_name}`.`{table_name}`{where}")
+    database_type = 'mariadb' if env.get_version() == MySQLVersion.MariaDB_11_8 else 'mysql'
+
+    res = {}
+    for i, col in enumerate(columns):
+        non_null = int(agg[f'nn_{i}'])
+        try:
+            if total_rows > 0 and non_null == 0:
+                res[col.name] = HistogramStats.init_all_null_histogram(col.data_type)
+                continue
+            values = sample_df[f'c_{i}'].dropna().tolist() if sample_df is not None else []
+            res[col.name] = build_histogram_from_column_sample(
+                values, col.data_type, n_buckets,
+                null_ratio=(total_rows - non_null) / total_rows if total_rows > 0 else 0,
+                min_value=_scalar_or_none(agg[f'min_{i}']), max_value=_scalar_or_none(agg[f'max_{i}']),
+                sampling_rate=sampling_rate, ndv=ndv_dict.get(col.name), database_type=database_type)
+        except Exception as e:
+            logging.warning(f"failed to build histogram of `{db_name}`.`{table_name}`.`{col.name}` "
+                            f"from samples: {e}")
+            res[col.name] = None
+    logging.info(f"generated {sum(h is not None for h in res.values())} histograms of `{db_name}`.`{table_name}` "
+                 f"from {0 if sample_df is None else len(sample_df)} rows ({sampling_rate=:.4f})")
+    return res
+
+
 def force_generate_histogram_by_2phase_for_col(env: Env, db_name: str, table_name: str, col_name: str,
                                                n_buckets: int, delta_req: float = 0.05,
                                                r1_hint: Optional[int] = None,
@@ -1302,6 +1870,18 @@ def generate_fetch_histogram(env: Env, target_db: str, all_table_names: List[str
 
     ndv_single_dict = ndv_single_dict or {}
 
+    if algo == 'table_sample':
+        # one aggregation and one sampled pass per table, no histogram is created on the instance
+        res_tables = defaultdict(dict)
+        for table_name in all_table_names:
+            logging.info(f"Generating Histograms for `{target_db}`.`{table_name}` with {n_buckets} n_buckets")
+            hists = generate_table_histograms_by_sample(env, target_db, table_name, n_buckets,
+                                                        ndv_dict=ndv_single_dict.get(table_name, {}))
+            for col_name, hist in hists.items():
+                res_tables[str(table_name).lower()][col_name] = \
+                    hist.to_dict() if hist is not None and ret_json else hist
+        return res_tables
+
     version = env.get_version()
     if version == MySQLVersion.MariaDB_11_8:
         return generate_fetch_histogram_mariadb(env, target_db, all_table_names, n_buckets, force, drop_hist_after_fetch, ret_json)
@@ -0,0 +1,206 @@
+"""
+Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+SPDX-License-Identifier: MIT
+
+Streaming ingestion of VIDEX task meta.
+
+A task meta stream is newline-delimited json (ndjson), optionally gzip compressed:
+    line 1: header, {"task_id": ..., "db_config": {...}, "sample_file_info": {...}}
+    line 2...: one table per line, {"dbname": ..., "table_name": ..., "meta": Table, "stats": TableStatisticsInfo}
+A delta stream has "merge": true and "drop_tables": ["db.table"] in its header. Its tables are merged into the task
+on the server instead of replacing the task.
+
+It's decompressed incrementally and parsed table by table, so the peak memory is the parsed task meta plus one line,
+instead of the whole (decompressed) body, the json dict and its validated copy.
+"""
+import json
+import zlib
+from typing import Iterable, Iterator, List, Optional, Tuple, BinaryIO
+
+from sub_platforms.sql_opt.column_statastics.statistics_info import TableStatisticsInfo
+from sub_platforms.sql_opt.common.db_variable import VariablesAboutIndex
+from sub_platforms.sql_opt.common.exceptions import PayloadTooLargeException, RequestFormatException
+from sub_platforms.sql_opt.common.sample_file_info import SampleFileInfo
+from sub_platforms.sql_opt.meta import Table
+from sub_platforms.sql_opt.videx.videx_metadata import VidexDBTaskStats
+
+STREAM_CHUNK_SIZE = 1 << 20
+# default limit of the decompressed size of a request body
+DEFAULT_MAX_DECOMPRESSED_BYTES = 8 * 1024 ** 3
+# msgpack wire format of /ask_videx, /ask_videx_batch and /create_task_meta, negotiated by Content-Type and Accept.
+# JSON is the default.
+MSGPACK_MIMETYPE = 'application/msgpack'
+MSGPACK_MIMETYPES = (MSGPACK_MIMETYPE, 'application/x-msgpack')
+
+
+def iter_decompressed_chunks(stream: BinaryIO, gzip_encoded: bool, max_bytes: Optional[int] = None,
+                             chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Read a (gzip) stream chunk by chunk, and yield decompressed chunks.
+
+    Raises:
+        PayloadTooLargeException: the decompressed size exceeds max_bytes
+        RequestFormatException: the gzip stream is truncated
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzip_encoded else None
+    total = 0
+
+    def checked(chunk: bytes) -> bytes:
+        nonlocal total
+        total += len(chunk)
+        if max_bytes is not None and total > max_bytes:
+            raise PayloadTooLargeException(f"decompressed body exceeds {max_bytes} bytes")
+        return chunk
+
+    while True:
+        raw = stream.read(chunk_size)
+        if not raw:
+            break
+        if decompressor is None:
+            yield checked(raw)
+            continue
+        data = raw
+        # bound the output of one call, and check it before inflating more,
+        # so that a highly compressed chunk is never inflated at once
+        while data:
+            if chunk := checked(decompressor.decompress(data, chunk_size)):
+                yield chunk
+            data = decompressor.unconsumed_tail
+    if decompressor is not None:
+        if tail := checked(decompressor.flush()):
+            yield tail
+        if not decompressor.eof:
+            raise RequestFormatException("truncated gzip body")
+
+
+def iter_gzip(chunks: Iterable[bytes], compress_level: int = 6) -> Iterator[bytes]:
+    """
+    gzip chunks incrementally, e.g. the lines of a task meta stream or a streamed response
+    """
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if out := compressor.compress(chunk):
+            yield out
+    yield compressor.flush()
+
+
+def decompress_bounded(data: bytes, max_bytes: Optional[int] = None) -> bytes:
+    """
+    gzip.decompress with a limit of the decompressed size
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    limit = 0 if max_bytes is None else max_bytes + 1
+    out = decompressor.decompress(data, limit)
+    if max_bytes is not None and (len(out) > max_bytes or decompressor.unconsumed_tail):
+        raise PayloadTooLargeException(f"decompressed body exceeds {max_bytes} bytes")
+    return out + decompressor.flush()
+
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Split chunks into non-empty lines.
+    """
+    # parts of the current line, joined once to avoid quadratic copies of a long line
+    pending = []
+    for chunk in chunks:
+        if b'\n' not in chunk:
+            pending.append(chunk)
+            continue
+        first, *lines, last = chunk.split(b'\n')
+        for line in [b''.join(pending + [first])] + lines:
+            if line.strip():
+                yield line
+        pending = [last]
+    line = b''.join(pending)
+    if line.strip():
+        yield line
+
+
+def read_task_meta_header(lines: Iterator[bytes]) -> dict:
+    """
+    Read the header line of a task meta stream.
+
+    Raises:
+        RequestFormatException: no or invalid header
+    """
+    try:
+        header = json.loads(next(lines))
+    except StopIteration:
+        raise RequestFormatException("empty task meta stream")
+    if not isinstance(header, dict) or 'task_id' not in header:
+        raise RequestFormatException(f"the first line of task meta stream must be the header with task_id")
+    return header
+
+
+def parse_task_meta_tables(header: dict, lines: Iterable[bytes]) -> VidexDBTaskStats:
+    """
+    Build VidexDBTaskStats from the header and the table lines of a task meta stream, table by table.
+
+    Raises:
+        RequestFormatException: invalid table line
+    """
+    meta_dict, stats_dict = {}, {}
+    for line_no, line in enumerate(lines, start=2):
+        item = json.loads(line)
+        try:
+            db_name, table_name = item['dbname'].lower(), item['table_name'].lower()
+            meta = Table.from_dict(item['meta'])
+            stats = TableStatisticsInfo.from_dict(item['stats'])
+        except (KeyError, TypeError, AttributeError, ValueError) as e:
+            raise RequestFormatException(f"invalid table at line {line_no}: {e}")
+        meta_dict.setdefault(db_name, {})[table_name] = meta
+        stats_dict.setdefault(db_name, {})[table_name] = stats
+
+    db_config = header.get('db_config')
+    sample_file_info = header.get('sample_file_info')
+    # tables are validated already, and not validated again since they're model instances
+    return VidexDBTaskStats(
+        task_id=header['task_id'],
+        meta_dict=meta_dict,
+        stats_dict=stats_dict,
+        db_config=VariablesAboutIndex() if db_config is None else VariablesAboutIndex.from_dict(db_config),
+        sample_file_info=None if sample_file_info is None else SampleFileInfo.from_dict(sample_file_info),
+    )
+
+
+def parse_task_meta_stream(lines: Iterable[bytes]) -> VidexDBTaskStats:
+    """
+    Build VidexDBTaskStats from the lines of a task meta stream, table by table.
+
+    Raises:
+        RequestFormatException: invalid header or table line
+    """
+    lines = iter(lines)
+    return parse_task_meta_tables(read_task_meta_header(lines), lines)
+
+
+def dump_task_meta_stream(stats: VidexDBTaskStats, tables: Optional[Iterable[Tuple[str, str]]] = None,
+                          drop_tables: Optional[List[str]] = None) -> Iterator[bytes]:
+    """
+    Encode VidexDBTaskStats into the lines of a task meta stream, one table at a time.
+
+    Args:
+        tables: (db, table) to encode, None means all tables
+        drop_tables: if given, it's a delta stream: the tables are merged into the task on the server,
+            and drop_tables ("db.table") are removed from it
+    """
+    header = {
+        'task_id': stats.task_id,
+        'db_config': json.loads(stats.db_config.to_json()),
+        'sample_file_info': None if stats.sample_file_info is None else json.loads(stats.sample_file_info.to_json()),
+    }
+    if drop_tables is not None:
+        header['merge'] = True
+        header['drop_tables'] = list(drop_tables)
+    yield json.dumps(header).encode('utf-8') + b'\n'
+    if tables is None:
+        tables = [(db_name, table_name) for db_name, db_tables in stats.stats_dict.items() for table_name in db_tables]
+    for db_name, table_name in tables:
+        meta = stats.get_table_meta(db_name, table_name)
+        table_stats = stats.get_table_stats_info(db_name, table_name)
+        if meta is None or table_stats is None:
+            continue
+        yield (b'{"dbname":' + json.dumps(db_name).encode('utf-8')
+               + b',"table_name":' + json.dumps(table_name).encode('utf-8')
+               + b',"meta":' + meta.to_json().encode('utf-8')
+               + b',"stats":' + table_stats.to_json().encode('utf-8') + b'}\n')
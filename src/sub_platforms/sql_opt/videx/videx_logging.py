@@ -4,11 +4,13 @@ SPDX-License-Identifier: MIT
 
 only for open-source, not for SQLBrain
 """
+import json
 import logging
 import logging.config
 import logging.handlers
 import os
 import threading
+from typing import Iterable, Optional
 
 import six
 import yaml
@@ -69,6 +71,63 @@ def get_thread_local_property(property_name: str):
     return getattr(videx_log_context, property_name)
 
 
+class RequestLogPolicy:
+    """
+    请求日志策略。默认每个请求只打印一行摘要，完整的请求/响应只对指定的 task 或 trace id 打印。
+
+    Args:
+        sample_n: log the summary of 1-in-N requests. Errors are always logged. If <= 0, only errors are logged.
+        full_payload_task_ids: log full request/response payload for these task ids
+        full_payload_trace_ids: log full request/response payload for these trace ids, e.g. "<<task_id#12>>"
+    """
+
+    def __init__(self, sample_n: int = 1,
+                 full_payload_task_ids: Optional[Iterable[str]] = None,
+                 full_payload_trace_ids: Optional[Iterable[str]] = None):
+        self.sample_n = sample_n
+        self.full_payload_task_ids = frozenset(full_payload_task_ids or [])
+        self.full_payload_trace_ids = frozenset(full_payload_trace_ids or [])
+
+    def sampled(self, req_idx: int, is_error: bool = False) -> bool:
+        if is_error:
+            return True
+        return self.sample_n > 0 and req_idx % self.sample_n == 0
+
+    def full_payload(self, task_id: Optional[str] = None, trace_id: Optional[str] = None) -> bool:
+        if not self.full_payload_task_ids and not self.full_payload_trace_ids:
+            return False
+        if trace_id is None:
+            trace_id = get_trace_id()
+        return task_id in self.full_payload_task_ids or trace_id in self.full_payload_trace_ids
+
+
+request_log_policy = RequestLogPolicy()
+
+
+def set_request_log_policy(sample_n: int = 1,
+                           full_payload_task_ids: Optional[Iterable[str]] = None,
+                           full_payload_trace_ids: Optional[Iterable[str]] = None):
+    """
+    设置请求日志策略，参数见 RequestLogPolicy
+    """
+    global request_log_policy
+    request_log_policy = RequestLogPolicy(sample_n, full_payload_task_ids, full_payload_trace_ids)
+
+
+class LazyJsonDumps:
+    """
+    Deferred json.dumps for %-style logging args, it runs only when the log record is emitted, e.g.
+    logging.info("request: %s", LazyJsonDumps(req))
+    """
+    __slots__ = ('obj',)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return json.dumps(self.obj, default=str)
+
+
 def _read_config_from_file(file_path, log_file_prefix: str = None):
     print(os.getcwd())
     if not os.path.exists(file_path):
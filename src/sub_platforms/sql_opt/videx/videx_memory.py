@@ -0,0 +1,234 @@
+"""
+Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+SPDX-License-Identifier: MIT
+
+Approximate memory accounting of VIDEX task meta and models, and the memory-budgeted task cache.
+"""
+import enum
+import logging
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Callable, Iterable, Iterator, Optional, Set
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+
+from sub_platforms.sql_opt.column_statastics.statistics_info import TableStatisticsInfo
+from sub_platforms.sql_opt.videx.videx_histogram import HistogramStats
+from sub_platforms.sql_opt.videx.videx_metadata import VidexDBTaskStats
+
+_SKIPPED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+                  enum.Enum, threading.Lock().__class__, threading.RLock().__class__, logging.Logger)
+
+
+def approx_sizeof(obj: Any, seen: Optional[Set[int]] = None) -> int:
+    """
+    Approximate deep size of an object in bytes. numpy arrays and pandas objects use their own memory usage,
+    containers, pydantic models and plain objects are walked recursively.
+
+    Args:
+        obj: the object to measure
+        seen: ids of objects that are already counted (or are shared and should not be counted). It's updated.
+    """
+    if seen is None:
+        seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if o is None or id(o) in seen or isinstance(o, _SKIPPED_TYPES):
+            continue
+        seen.add(id(o))
+        if isinstance(o, (str, bytes, bytearray, int, float, bool)):
+            total += sys.getsizeof(o)
+        elif isinstance(o, np.ndarray):
+            total += o.nbytes + 112
+        elif isinstance(o, (pd.DataFrame, pd.Series, pd.Index)):
+            usage = o.memory_usage(index=True, deep=True)
+            total += int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+        elif isinstance(o, dict):
+            total += sys.getsizeof(o)
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            total += sys.getsizeof(o)
+            stack.extend(o)
+        elif isinstance(o, BaseModel):
+            total += sys.getsizeof(o) + sys.getsizeof(o.__dict__)
+            stack.extend(o.__dict__.values())
+            if o.__pydantic_private__:
+                stack.extend(o.__pydantic_private__.values())
+        elif hasattr(o, '__dict__'):
+            total += sys.getsizeof(o) + sys.getsizeof(vars(o))
+            stack.extend(vars(o).values())
+        else:
+            total += sys.getsizeof(o)
+    return total
+
+
+def estimate_histogram_bytes(hist: Optional[HistogramStats]) -> int:
+    if hist is None:
+        return 0
+    # buckets are kept in numpy arrays and string blobs (see HistogramBuckets), so it's walked without
+    # visiting each bucket
+    return approx_sizeof(hist)
+
+
+def estimate_table_stats_info_bytes(info: TableStatisticsInfo) -> int:
+    """
+    histograms (see estimate_histogram_bytes) and the others (ndv, extra_info with gt, sample_data) are walked
+    """
+    n_bytes = sum(estimate_histogram_bytes(h) for h in (info.histogram_dict or {}).values())
+    seen = {id(info.histogram_dict)}
+    n_bytes += approx_sizeof(info, seen)
+    return n_bytes
+
+
+def estimate_task_stats_bytes(stats: Optional[VidexDBTaskStats]) -> int:
+    """
+    Approximate bytes of the source stats of a task: table meta, histograms, ndvs, gt and sample frames.
+    """
+    if stats is None:
+        return 0
+    n_bytes = approx_sizeof(stats.meta_dict) + approx_sizeof(stats.db_config) + approx_sizeof(stats.sample_file_info)
+    for db_stats in stats.stats_dict.values():
+        for info in db_stats.values():
+            n_bytes += estimate_table_stats_info_bytes(info)
+    return n_bytes
+
+
+def estimate_table_bytes(stats: Optional[VidexDBTaskStats], db_name: str, table_name: str) -> int:
+    """
+    Approximate bytes of one table in the source stats: table meta and TableStatisticsInfo.
+    Used to update the bytes of a task incrementally when some tables change.
+    """
+    if stats is None:
+        return 0
+    info = stats.get_table_stats_info(db_name, table_name)
+    return (approx_sizeof(stats.get_table_meta(db_name, table_name))
+            + (0 if info is None else estimate_table_stats_info_bytes(info)))
+
+
+def estimate_model_bytes(model: Any, shared_objects: Iterable[Any] = ()) -> int:
+    """
+    Approximate bytes of a table model (derived state), excluding the objects shared with the source stats,
+    e.g. histograms and sample_data of TableStatisticsInfo.
+    """
+    seen = {id(o) for o in shared_objects if o is not None}
+    return approx_sizeof(model, seen)
+
+
+class MemoryBudgetedTaskCache(MutableMapping):
+    """
+    LRU cache of VidexTaskCache, bounded by the number of tasks and by approximate bytes.
+    An item expires if it's not accessed for ttl seconds.
+
+    When the total bytes exceed max_bytes, the rebuildable models are discarded first (least recently used task
+    first), then whole tasks are evicted. Tasks are never evicted by bytes if they are pinned (e.g. the
+    non-task cache), but their models can be discarded.
+
+    Readers (get / in) are lock-free, writers should be serialized by the caller.
+    Values must have `total_stats_bytes()`, `total_model_bytes()` and `drop_models()`, see VidexTaskCache.
+    """
+
+    def __init__(self, maxsize: int = 1000, ttl: float = 300, max_bytes: Optional[int] = None,
+                 timer: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.timer = timer
+        # key -> [value, expire time], in LRU order (the least recently used first).
+        # The entry is updated in place by readers, so that a concurrent eviction is never undone by a reader.
+        self._data: OrderedDict = OrderedDict()
+
+    def __getitem__(self, key):
+        entry = self._data[key]
+        now = self.timer()
+        if entry[1] < now:
+            self._data.pop(key, None)
+            raise KeyError(key)
+        # refresh ttl and LRU order
+        entry[1] = now + self.ttl
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            pass
+        return entry[0]
+
+    def __setitem__(self, key, value):
+        self._data[key] = [value, self.timer() + self.ttl]
+        self._data.move_to_end(key)
+        self.expire()
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[1] >= self.timer()
+
+    def __iter__(self) -> Iterator:
+        now = self.timer()
+        return iter([k for k, (_, expires) in list(self._data.items()) if expires >= now])
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def peek(self, key, default=None):
+        """
+        get without refreshing ttl and LRU order
+        """
+        entry = self._data.get(key)
+        return default if entry is None else entry[0]
+
+    def expire(self):
+        now = self.timer()
+        for key, (_, expires) in list(self._data.items()):
+            if expires < now:
+                self._data.pop(key, None)
+
+    def total_bytes(self, pinned: Iterable[Any] = ()) -> int:
+        values = [v for v, _ in list(self._data.values())] + list(pinned)
+        return sum(v.total_stats_bytes() + v.total_model_bytes() for v in values)
+
+    def enforce_budget(self, pinned: Iterable[Any] = ()) -> int:
+        """
+        Discard models and evict tasks until the total bytes are within max_bytes.
+        The most recently used task is kept even if it alone exceeds the budget.
+
+        Returns:
+            freed bytes
+        """
+        if self.max_bytes is None:
+            return 0
+        pinned = list(pinned)
+        total = self.total_bytes(pinned)
+        if total <= self.max_bytes:
+            return 0
+        before = total
+        # 1. discard rebuildable models, the least recently used task first
+        for value in [v for v, _ in list(self._data.values())] + pinned:
+            total -= value.drop_models()
+            if total <= self.max_bytes:
+                break
+        # 2. evict source stats of the least recently used tasks
+        while total > self.max_bytes and len(self._data) > 1:
+            key, (value, _) = self._data.popitem(last=False)
+            total -= value.total_stats_bytes() + value.total_model_bytes()
+            logging.info(f"evict task {key} from memory, {value.total_stats_bytes() / 1024 ** 2:.2f} MB")
+        logging.info(f"memory budget {self.max_bytes / 1024 ** 2:.2f} MB exceeded, "
+                     f"freed {(before - total) / 1024 ** 2:.2f} MB, now {total / 1024 ** 2:.2f} MB")
+        return before - total
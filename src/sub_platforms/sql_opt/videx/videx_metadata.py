@@ -3,7 +3,7 @@
 Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
 SPDX-License-Identifier: MIT
 """
-import copy
+import hashlib
 import json
 import logging
 import math
@@ -60,6 +60,14 @@ IO_SIZE = 4096
 INVALID_VALUE = -1234
 
 
+def canonical_hash(obj: Any) -> str:
+    """
+    sha256 of the canonical json of obj: sorted keys, no whitespace
+    """
+    canonical = json.dumps(obj, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
 class VidexDBTaskStats(BaseModel, PydanticDataClassJsonMixin):
     task_id: Optional[str]
     meta_dict: Dict[str, Dict[str, Table]]
@@ -119,7 +127,22 @@ class VidexDBTaskStats(BaseModel, PydanticDataClassJsonMixin):
     def to_key(task_id: str) -> str:
         return f"{task_id}"
 
+    def shallow_copy(self) -> 'VidexDBTaskStats':
+        """
+        A copy with its own db and table dicts, sharing tables, db_config and sample_file_info with self.
+        Tables can be added, replaced or removed in the copy without affecting the readers of self,
+        as long as the shared objects are replaced instead of mutated.
+        """
+        return self.model_copy(update={
+            'meta_dict': {db: dict(tables) for db, tables in self.meta_dict.items()},
+            'stats_dict': {db: dict(tables) for db, tables in self.stats_dict.items()},
+        })
+
     def merge_with(self, other: 'VidexDBTaskStats', inplace: bool = False) -> Optional['VidexDBTaskStats']:
+        """
+        Merge the tables and sample files of other into self (inplace) or into a shallow copy of self,
+        which shares the unchanged tables with self.
+        """
         # Check for essential matches
         if self.task_id != other.task_id or (
                 self.sample_file_info and other.sample_file_info and (
@@ -128,19 +151,19 @@ class VidexDBTaskStats(BaseModel, PydanticDataClassJsonMixin):
         )):
             return None
 
-        target = self if inplace else copy.deepcopy(self)
+        target = self if inplace else self.shallow_copy()
 
         # Merge meta_dict
         for db, tables in other.meta_dict.items():
             if db not in target.meta_dict:
-                target.meta_dict[db] = tables
+                target.meta_dict[db] = dict(tables)
             else:
                 target.meta_dict[db].update(tables)
 
         # Merge stats_dict
         for db, tables in other.stats_dict.items():
             if db not in target.stats_dict:
-                target.stats_dict[db] = tables
+                target.stats_dict[db] = dict(tables)
             else:
                 target.stats_dict[db].update(tables)
 
@@ -157,14 +180,127 @@ class VidexDBTaskStats(BaseModel, PydanticDataClassJsonMixin):
                     items.update(other.sample_file_info.sample_file_dict.get(db, {}).get(table, []))
                     merged_sample_file_dict[db][table] = sorted(items)
 
-            target.sample_file_info.sample_file_dict = dict(merged_sample_file_dict)
-
+            # a new object, self.sample_file_info may be shared with other snapshots
+            update = {'sample_file_dict': dict(merged_sample_file_dict)}
             # Optionally merge table_load_rows
             if self.sample_file_info.table_load_rows and other.sample_file_info.table_load_rows:
-                target.sample_file_info.table_load_rows.update(other.sample_file_info.table_load_rows)
+                update['table_load_rows'] = {**self.sample_file_info.table_load_rows,
+                                             **other.sample_file_info.table_load_rows}
+            target.sample_file_info = self.sample_file_info.model_copy(update=update)
 
         return target
 
+    def patch_table_stats(self, db_name: str, table_name: str,
+                          histograms: Dict[str, Optional[Union[dict, HistogramStats]]] = None,
+                          ndvs_single: Dict[str, float] = None,
+                          ndvs_multi_col_gt: Dict[str, Any] = None,
+                          gt_rec_in_ranges: List[Any] = None,
+                          gt_req_resp: Dict[str, Any] = None) -> List[str]:
+        """
+        Patch the stats of one table. The patched TableStatisticsInfo is a new object swapped into stats_dict,
+        so readers holding the old one are not affected.
+
+        Args:
+            histograms: column -> histogram, None removes the histogram of the column
+            ndvs_single: column -> ndv, merged into ndv_dict
+            ndvs_multi_col_gt: merged into the ground-truth multi-column ndvs
+            gt_rec_in_ranges: replaces the ground-truth records_in_range
+            gt_req_resp: merged into the ground-truth request -> response
+
+        Returns:
+            names of the patched fields
+        """
+        db_name = db_name.lower()
+        table_name = table_name.lower()
+        if (info := self.get_table_stats_info(db_name, table_name)) is None:
+            raise ValueError(f"table not found: {db_name}.{table_name}, only: {self.get_stats_info_keys()}")
+
+        update, extra_info, patched = {}, dict(info.extra_info or {}), []
+        if histograms is not None:
+            histogram_dict = dict(info.histogram_dict or {})
+            for col, hist in histograms.items():
+                if hist is None:
+                    histogram_dict.pop(col, None)
+                else:
+                    histogram_dict[col] = hist if isinstance(hist, HistogramStats) else HistogramStats.from_dict(hist)
+            update['histogram_dict'] = histogram_dict
+            patched.append('histograms')
+        if ndvs_single is not None:
+            update['ndv_dict'] = {**(info.ndv_dict or {}), **ndvs_single}
+            patched.append('ndvs_single')
+        if ndvs_multi_col_gt is not None:
+            extra_info[EXTRA_INFO_KEY_mulcol] = {**(extra_info.get(EXTRA_INFO_KEY_mulcol) or {}), **ndvs_multi_col_gt}
+            patched.append('ndvs_multi_col_gt')
+        if gt_rec_in_ranges is not None:
+            extra_info[EXTRA_INFO_KEY_gt_rec_in_ranges] = list(gt_rec_in_ranges)
+            patched.append('gt_rec_in_ranges')
+        if gt_req_resp is not None:
+            extra_info[EXTRA_INFO_KEY_gt_req_resp] = {**(extra_info.get(EXTRA_INFO_KEY_gt_req_resp) or {}),
+                                                      **gt_req_resp}
+            patched.append('gt_req_resp')
+        update['extra_info'] = extra_info
+        self.stats_dict[db_name][table_name] = info.model_copy(update=update)
+        return patched
+
+    def drop_tables(self, tables: List[Tuple[str, str]]) -> List[str]:
+        """
+        Remove tables from meta_dict and stats_dict. Sample files of the tables are kept.
+
+        Returns:
+            db.table of the removed tables
+        """
+        dropped = []
+        for db_name, table_name in tables:
+            db_name, table_name = db_name.lower(), table_name.lower()
+            meta = self.meta_dict.get(db_name, {}).pop(table_name, None)
+            stats = self.stats_dict.get(db_name, {}).pop(table_name, None)
+            if meta is not None or stats is not None:
+                dropped.append(f"{db_name}.{table_name}")
+        return dropped
+
+    def table_content_hash(self, db_name: str, table_name: str) -> Optional[str]:
+        """
+        Content hash of a table (meta and stats), which is the same on the client and on the server
+        for the same table, see VidexClient.sync_task_meta.
+        Both are normalized by a json round trip first, since parsing changes some fields, e.g. max_pk.
+
+        Returns:
+            None if the table has no meta or no stats
+        """
+        meta = self.get_table_meta(db_name, table_name)
+        stats = self.get_table_stats_info(db_name, table_name)
+        if meta is None or stats is None:
+            return None
+        meta = Table.from_json(meta.to_json())
+        stats = TableStatisticsInfo.from_json(stats.to_json())
+        return canonical_hash({'meta': json.loads(meta.to_json()), 'stats': json.loads(stats.to_json())})
+
+    def header_content_hash(self) -> str:
+        """
+        Content hash of the task level fields: db_config and sample_file_info
+        """
+        return canonical_hash({
+            'db_config': json.loads(VariablesAboutIndex.from_json(self.db_config.to_json()).to_json()),
+            'sample_file_info': None if self.sample_file_info is None else json.loads(
+                SampleFileInfo.from_json(self.sample_file_info.to_json()).to_json()),
+        })
+
+    def set_variables(self, variables: Dict[str, str]) -> List[str]:
+        """
+        Set the values of variables in db_config, e.g. {"optimizer_switch": "mrr=on", "innodb_page_size": 16384}.
+        The patched db_config is a new object swapped in.
+
+        Returns:
+            names of the set variables
+        """
+        db_config = self.db_config.model_copy(deep=True)
+        for name, value in variables.items():
+            if name not in VariablesAboutIndex.model_fields:
+                raise ValueError(f"unknown variable: {name}, expect one of {list(VariablesAboutIndex.model_fields)}")
+            getattr(db_config, name).set_value(value)
+        self.db_config = db_config
+        return list(variables.keys())
+
 
 class VidexTableStats(BaseModel, PydanticDataClassJsonMixin):
     """
@@ -305,7 +441,8 @@ class VidexTableStats(BaseModel, PydanticDataClassJsonMixin):
         innodb_page_size = int(
             db_config.innodb_page_size.value) if db_config.innodb_page_size.value is not None else DEFAULT_INNODB_PAGE_SIZE
 
-        raw_meta_dict = copy.deepcopy(raw_meta_dict) # not affect raw data
+        # not affect raw data. Only top-level fields are updated below, so a shallow copy is enough.
+        raw_meta_dict = raw_meta_dict.model_copy()
 
         if raw_meta_dict.data_length is None:
             if raw_meta_dict.table_size is None:
@@ -0,0 +1,166 @@
+"""
+Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+SPDX-License-Identifier: MIT
+
+In-process metrics of VIDEX statistic server, exported in Prometheus text format by /metrics.
+
+N.B. metrics are per process. In multi-worker mode, each scrape is answered by one of the workers,
+and the `pid` label tells them apart.
+"""
+import bisect
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple, Optional
+
+import psutil
+
+# seconds
+DEFAULT_LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                           1., 2.5, 5., 10.)
+
+# phases of an ask request
+PHASE_TASK_LOOKUP = 'task_lookup'
+PHASE_MODEL_BUILD = 'model_build'
+PHASE_RANGE_PARSE = 'range_parse'
+PHASE_HISTOGRAM_SEARCH = 'histogram_search'
+PHASE_NDV_ESTIMATE = 'ndv_estimate'
+
+# caches
+CACHE_TASK = 'task'
+CACHE_MODEL = 'model'
+CACHE_RESPONSE = 'response'
+CACHE_NDV = 'ndv'
+
+LabelValues = Tuple[str, ...]
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = '') -> str:
+    items = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        items.append(extra)
+    return '{' + ','.join(items) + '}' if items else ''
+
+
+class VidexMetrics:
+    """
+    A tiny metrics registry: counters and histograms with labels, guarded by one lock.
+    Metric names and label names are fixed when they're first used.
+    """
+
+    def __init__(self, latency_buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        self.latency_buckets = latency_buckets
+        self._lock = threading.Lock()
+        # name -> (help, label names)
+        self._counter_meta: Dict[str, Tuple[str, Tuple[str, ...]]] = {}
+        self._counters: Dict[str, Dict[LabelValues, float]] = defaultdict(lambda: defaultdict(float))
+        self._histogram_meta: Dict[str, Tuple[str, Tuple[str, ...]]] = {}
+        self._histograms: Dict[str, Dict[LabelValues, _Histogram]] = defaultdict(dict)
+
+    def inc(self, name: str, help_: str, labels: Dict[str, str], value: float = 1.):
+        with self._lock:
+            names = self._counter_meta.setdefault(name, (help_, tuple(labels)))[1]
+            self._counters[name][tuple(str(labels[n]) for n in names)] += value
+
+    def observe(self, name: str, help_: str, labels: Dict[str, str], value: float):
+        with self._lock:
+            names = self._histogram_meta.setdefault(name, (help_, tuple(labels)))[1]
+            key = tuple(str(labels[n]) for n in names)
+            hist = self._histograms[name].get(key)
+            if hist is None:
+                hist = self._histograms[name][key] = _Histogram(self.latency_buckets)
+            hist.observe(value)
+
+    def observe_request(self, func: str, strategy: str, code: int, seconds: float):
+        labels = {'func': func, 'strategy': strategy}
+        self.inc('videx_requests_total', 'Number of ask requests.', {**labels, 'code': code})
+        if code != 200:
+            self.inc('videx_request_errors_total', 'Number of ask requests not returning 200.', labels)
+        self.observe('videx_request_seconds', 'Latency of ask requests.', labels, seconds)
+
+    def observe_phase(self, phase: str, seconds: float):
+        self.observe('videx_phase_seconds', 'Time spent in phases of ask requests.', {'phase': phase}, seconds)
+
+    def cache_access(self, cache: str, hit: bool):
+        self.inc('videx_cache_requests_total', 'Number of cache lookups.',
+                 {'cache': cache, 'result': 'hit' if hit else 'miss'})
+
+    def phase(self, phase: str) -> '_PhaseTimer':
+        """
+        with metrics.phase(PHASE_MODEL_BUILD): ...
+        """
+        return _PhaseTimer(self, phase)
+
+    def reset(self):
+        with self._lock:
+            self._counter_meta.clear()
+            self._counters.clear()
+            self._histogram_meta.clear()
+            self._histograms.clear()
+
+    def render(self, gauges: Optional[List[Tuple[str, str, float]]] = None) -> str:
+        """
+        Args:
+            gauges: extra gauges, [(name, help, value)]
+
+        Returns:
+            metrics in Prometheus text format
+        """
+        pid = os.getpid()
+        gauges = [('videx_process_resident_memory_bytes', 'Resident memory size of the process.',
+                   psutil.Process(pid).memory_info().rss)] + list(gauges or [])
+        lines = []
+        pid_label = f'pid="{pid}"'
+        with self._lock:
+            for name, (help_, names) in sorted(self._counter_meta.items()):
+                lines += [f'# HELP {name} {help_}', f'# TYPE {name} counter']
+                for values, value in sorted(self._counters[name].items()):
+                    lines.append(f'{name}{_format_labels(names, values, pid_label)} {value:g}')
+            for name, (help_, names) in sorted(self._histogram_meta.items()):
+                lines += [f'# HELP {name} {help_}', f'# TYPE {name} histogram']
+                for values, hist in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(list(hist.buckets) + [float('inf')], hist.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                        labels = _format_labels(names, values, pid_label + ',le="' + le + '"')
+                        lines.append(f'{name}_bucket{labels} {cumulative}')
+                    lines.append(f'{name}_sum{_format_labels(names, values, pid_label)} {hist.sum:.6f}')
+                    lines.append(f'{name}_count{_format_labels(names, values, pid_label)} {hist.count}')
+        for name, help_, value in gauges:
+            lines += [f'# HELP {name} {help_}', f'# TYPE {name} gauge', f'{name}{{{pid_label}}} {value:g}']
+        return '\n'.join(lines) + '\n'
+
+
+class _PhaseTimer:
+    __slots__ = ('metrics', 'phase', 'st')
+
+    def __init__(self, metrics: VidexMetrics, phase: str):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.st = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.metrics.observe_phase(self.phase, time.perf_counter() - self.st)
+        return False
+
+
+# the global metrics registry of the process
+metrics = VidexMetrics()
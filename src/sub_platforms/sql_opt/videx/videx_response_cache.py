@@ -0,0 +1,111 @@
+"""
+Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+SPDX-License-Identifier: MIT
+
+Memoization of VIDEX responses. The optimizer asks identical questions (e.g. records_in_range of the same range,
+info_low of the same table) many times within one query and across queries, and the answers only depend on the
+request and the task meta.
+"""
+import json
+import threading
+from typing import Hashable, Iterable, Optional, Tuple
+
+from cachetools import LRUCache
+
+DEFAULT_RESPONSE_CACHE_SIZE = 4096
+
+
+def request_fingerprint(req_json_item: dict, result2str: bool = True) -> str:
+    """
+    Canonical fingerprint of a request: function, db, table (case-insensitive), videx_options and key bounds,
+    regardless of the order of dict keys.
+    """
+    properties = dict(req_json_item.get('properties') or {})
+    for key in ('dbname', 'table_name', 'function'):
+        if isinstance(properties.get(key), str):
+            properties[key] = properties[key].lower()
+    if isinstance(properties.get('videx_options'), str):
+        try:
+            properties['videx_options'] = json.loads(properties['videx_options'])
+        except ValueError:
+            pass
+    return json.dumps([result2str, properties, req_json_item.get('data')],
+                      sort_keys=True, separators=(',', ':'), default=str)
+
+
+class VidexResponseCache:
+    """
+    Bounded LRU cache of successful responses of one task: (db, table, request fingerprint) -> response data.
+    It must be discarded (or cleared) when the task meta changes.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_RESPONSE_CACHE_SIZE):
+        self._cache = LRUCache(maxsize=maxsize)
+        # LRUCache is not thread-safe, even get() reorders items
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # increased on every invalidation. A response computed before an invalidation is not cached.
+        self.generation = 0
+
+    def get(self, key: Tuple[str, str, Hashable]) -> Optional[dict]:
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # copy, so that callers can't pollute the cache
+        return dict(value)
+
+    def put(self, key: Tuple[str, str, Hashable], value: dict, generation: int = None):
+        """
+        Args:
+            generation: the generation when the response was computed, ignored if it's invalidated since then
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._cache[key] = dict(value)
+
+    def clear(self) -> int:
+        with self._lock:
+            self.generation += 1
+            n = len(self._cache)
+            self._cache.clear()
+        return n
+
+    def discard_table(self, db_name: str, table_name: str) -> int:
+        """
+        Returns:
+            number of discarded responses
+        """
+        with self._lock:
+            self.generation += 1
+            keys = [k for k in self._cache.keys() if k[0] == db_name and k[1] == table_name]
+            for k in keys:
+                del self._cache[k]
+        return len(keys)
+
+    def fork(self, exclude_tables: Optional[Iterable[Tuple[str, str]]] = None) -> 'VidexResponseCache':
+        """
+        A new cache with the responses of this one, except those of exclude_tables: [(db, table)].
+        None means all tables are excluded, i.e. an empty cache.
+        """
+        forked = VidexResponseCache(self._cache.maxsize)
+        if exclude_tables is None:
+            return forked
+        excluded = {(db.lower(), tb.lower()) for db, tb in exclude_tables}
+        with self._lock:
+            for key, value in list(self._cache.items()):
+                if (key[0], key[1]) not in excluded:
+                    forked._cache[key] = value
+        return forked
+
+    def __len__(self):
+        return len(self._cache)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {'size': len(self._cache), 'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.}
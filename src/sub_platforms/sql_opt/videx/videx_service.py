@@ -3,21 +3,29 @@ Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
 SPDX-License-Identifier: MIT
 """
 
+import contextlib
 import enum
-import gzip
+import functools
 import json
 import logging
+import os
 import re
+import shutil
+import tempfile
 import threading
 import time
 import traceback
+import zlib
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import List, Tuple, Union, Callable, Type, Dict, Optional
+from typing import List, Tuple, Union, Callable, Type, Dict, Optional, Iterable, Iterator
 
+import msgpack
 import requests
-from cachetools import TTLCache
-from flask import Flask, request, jsonify
-from flask_restx import Api, Resource, fields, Namespace
+from cachetools import LRUCache
+from flask import Flask, request, jsonify, Response as FlaskResponse, stream_with_context
+from flask_restx import Api, Resource, fields, Namespace, abort
 from requests import Response
 
 from sub_platforms.sql_opt.env.rds_env import Env
@@ -26,11 +34,30 @@ from sub_platforms.sql_opt.videx.videx_metadata import VidexTableStats, VidexDBT
     EXTRA_INFO_KEY_mulcol, EXTRA_INFO_KEY_gt_rec_in_ranges, construct_videx_task_meta_from_local_files
 from sub_platforms.sql_opt.videx.model.videx_strategy import VidexModelBase
 from sub_platforms.sql_opt.videx.model.videx_model_innodb import VidexModelInnoDB
+from sub_platforms.sql_opt.videx.videx_client import VidexClient
+from sub_platforms.sql_opt.videx.videx_concurrency import AtomicCounter, StripedLock, SingleFlight, \
+    AdmissionControl
+from sub_platforms.sql_opt.videx.videx_deadline import DEFAULT_REQUEST_TIMEOUT, request_deadline, is_degraded
+from sub_platforms.sql_opt.videx.videx_dispatch import parse_func_id, videx_funcs, VidexFuncHandler
+from sub_platforms.sql_opt.common.exceptions import PayloadTooLargeException, RequestFormatException
+from sub_platforms.sql_opt.videx.videx_ingest import DEFAULT_MAX_DECOMPRESSED_BYTES, decompress_bounded, \
+    iter_decompressed_chunks, iter_lines, read_task_meta_header, parse_task_meta_tables, dump_task_meta_stream, iter_gzip, \
+    MSGPACK_MIMETYPE, MSGPACK_MIMETYPES
+from sub_platforms.sql_opt.videx.videx_metrics import metrics, CACHE_TASK, CACHE_MODEL, CACHE_RESPONSE, \
+    PHASE_TASK_LOOKUP, PHASE_MODEL_BUILD
+from sub_platforms.sql_opt.videx.videx_memory import MemoryBudgetedTaskCache, estimate_task_stats_bytes, \
+    estimate_model_bytes, estimate_table_bytes
+from sub_platforms.sql_opt.videx.videx_response_cache import VidexResponseCache, request_fingerprint
+from sub_platforms.sql_opt.videx.videx_task_store import VidexTaskStore, StoreVersion, NON_TASK_KEY
 from sub_platforms.sql_opt.videx.videx_utils import GT_Table_Return, get_local_ip, get_func_with_parent
 
 app = Flask(__name__)
+# limit of the decompressed size of a gzip request body
+app.config['VIDEX_MAX_DECOMPRESSED_BYTES'] = DEFAULT_MAX_DECOMPRESSED_BYTES
 ENV_KEY_POST_VIDEX_META = 'POST_VIDEX_META'
-
+# min number of items of one table and function in a batch to be answered by the batch handler of the function,
+# e.g. the ranges of an IN list (see videx_dispatch). Smaller groups are asked one by one.
+BATCH_VECTORIZE_MIN_ITEMS = 8
 # Create API object
 api = Api(
     app,
@@ -81,19 +108,52 @@ ask_videx_model = api.model('AskVidex', {
     'data': fields.List(fields.Raw, required=True, description='List of data items')
 })
 
+ask_videx_batch_model = api.model('AskVidexBatch', {
+    'items': fields.List(fields.Nested(ask_videx_model), required=True,
+                         description='Ordered list of AskVidex requests sharing one task_id')
+})
+
 clear_cache_model = api.model('ClearCache', {
-    'key_list': fields.List(fields.String, required=False, description='List of keys to clear')
+    'key_list': fields.List(fields.String, required=False,
+                            description='List of task ids to clear, empty means all tasks'),
+    'scope': fields.String(required=False, enum=['task', 'table', 'model'],
+                           description='task: evict tasks; table: discard models of the given tables; '
+                                       'model: discard all models of the tasks. Default is task'),
+    'tables': fields.List(fields.String, required=False, description='List of db.table, required by scope table'),
+    'purge_store': fields.Boolean(required=False, description='Also delete the tasks from the task store'),
+})
+
+warmup_task_model = api.model('WarmupTask', {
+    'task_id': NullableString(required=True, description='Task ID, null means the non-task meta'),
+    'tables': fields.List(fields.String, required=False, description='List of db.table, default all tables'),
+    'wait': fields.Boolean(required=False, description='Return after all models are built, default false'),
+})
+
+prefetch_task_model = api.model('PrefetchTask', {
+    'task_ids': fields.List(fields.String, required=True, description='List of task ids to load in background'),
 })
 
 update_gt_stats_model = api.model('UpdateGTStats', {
-    'task_id': NullableString(required=True, description='Task ID'),
-    'gt_stats_file': fields.Raw(required=True, description='GT stats file'),
-    'gt_ndv_mulcol_file': fields.Raw(required=True, description='GT ndv mulcol file'),
-    'gt_rec_in_ranges': fields.Raw(required=False, description='GT rec in ranges'),
-    'gt_req_resp': fields.Raw(required=True, description='GT req resp')
+    'task_id': NullableString(required=True, description='Task ID, null means the non-task meta'),
+    'dbname': fields.String(required=True, description='Database name'),
+    'table_name': fields.String(required=True, description='Table name'),
+    'histograms': fields.Raw(required=False, description='column -> histogram, null removes the histogram'),
+    'ndvs_single': fields.Raw(required=False, description='column -> ndv'),
+    'ndvs_multi_col_gt': fields.Raw(required=False, description='GT multi-column ndvs, merged'),
+    'gt_rec_in_ranges': fields.Raw(required=False, description='GT rec in ranges, replaced'),
+    'gt_req_resp': fields.Raw(required=False, description='GT req resp, merged')
+})
+
+set_task_variables_model = api.model('SetTaskVariables', {
+    'task_id': NullableString(required=True, description='Task ID, null means the non-task meta'),
+    'variables': fields.Raw(required=True, description='variable name -> value, e.g. {"optimizer_switch": "mrr=on"}'),
 })
 
 class VidexFunc(enum.Enum):
+    """
+    Functions called by VIDEX-MySQL. Requests are dispatched by videx_dispatch.videx_funcs,
+    where more functions can be registered.
+    """
     scan_time = "scan_time"
     get_memory_buffer_size = "get_memory_buffer_size"
     records_in_range = "records_in_range"
@@ -102,10 +162,10 @@ class VidexFunc(enum.Enum):
 
 
 def str2VidexFunc(s: str) -> VidexFunc:
-    for func in VidexFunc:
-        if func.value.lower() in s.lower():
-            return func
-    return VidexFunc.not_supported
+    try:
+        return VidexFunc(parse_func_id(s))
+    except ValueError:
+        return VidexFunc.not_supported
 
 
 @dataclass
@@ -113,6 +173,10 @@ class VidexTaskCache:
     """
     Task cache, including metadata from one or multiple databases, and the initialized videx algorithm model
     Both of them will be cleared according to TTL cached.
+
+    It's a snapshot: db_tasks_stats is never changed in place. An update derives a new snapshot (see derive),
+    which is swapped into the cache atomically, so a request keeps a consistent view with the snapshot it got.
+    Models and memoized responses are derived state, they can be discarded from a snapshot at any time.
     """
 
     # contains multi dbs: db -> table -> VidexTableStats
@@ -124,35 +188,137 @@ class VidexTaskCache:
     """
     model_cache_dict: Optional[Dict[str, Dict[str, Optional[VidexModelBase]]]] = field(default_factory=dict)
 
+    # version of db_tasks_stats in the task store, None if it's not loaded from or saved to the store
+    store_version: Optional[StoreVersion] = None
+    # time.monotonic() of the last version check against the task store
+    store_checked_at: float = 0
+
+    # approximate bytes of db_tasks_stats (source stats), None until computed by total_stats_bytes(),
+    # and of each table model (derived state): (db, table) -> bytes
+    stats_bytes: Optional[int] = None
+    model_bytes: Dict[Tuple[str, str], int] = field(default_factory=dict)
+
+    # memoized responses of ask(), derived from db_tasks_stats like the models
+    response_cache: VidexResponseCache = field(default_factory=VidexResponseCache)
+    # memoized content hashes of tables: (db, table) -> hash, see VidexDBTaskStats.table_content_hash
+    table_hashes: Dict[Tuple[str, str], str] = field(default_factory=dict)
+
     def __post_init__(self):
         self.model_cache_dict = {k.lower(): {k1.lower(): v1 for k1, v1 in v.items()} for k, v in
                                  self.model_cache_dict.items()}
 
-    def add_db_tasks_stats(self, stats: VidexDBTaskStats):
+    def derive(self, stats: VidexDBTaskStats, changed_tables: Optional[List[Tuple[str, str]]] = None) \
+            -> 'VidexTaskCache':
+        """
+        A new snapshot with stats, a copy-on-write update of db_tasks_stats (e.g. by shallow_copy or merge_with).
+        Models and memoized responses of the unchanged tables are shared with this snapshot,
+        and stats_bytes, if already computed, is updated by the changed tables only.
+
+        Args:
+            changed_tables: (db, table) changed in stats, None means all tables, e.g. db_config is changed
+        """
+        if changed_tables is None:
+            return VidexTaskCache(stats)
+        changed = {(db.lower(), tb.lower()) for db, tb in changed_tables}
+        model_cache_dict = {db: {tb: model for tb, model in list(tables.items()) if (db, tb) not in changed}
+                            for db, tables in list(self.model_cache_dict.items())}
+        model_bytes = {k: v for k, v in list(self.model_bytes.items()) if k not in changed}
+        stats_bytes = None
+        if self.stats_bytes is not None:
+            stats_bytes = (self.stats_bytes
+                           - sum(estimate_table_bytes(self.db_tasks_stats, db, tb) for db, tb in changed)
+                           + sum(estimate_table_bytes(stats, db, tb) for db, tb in changed))
+        for db, tb in sorted(changed):
+            if self.get_table_model_cache(db, tb) is not None:
+                logging.info(f"discard exist model cache: {db}.{tb}")
+        table_hashes = {k: v for k, v in list(self.table_hashes.items()) if k not in changed}
+        return VidexTaskCache(stats, model_cache_dict=model_cache_dict, stats_bytes=stats_bytes,
+                              model_bytes=model_bytes, response_cache=self.response_cache.fork(changed),
+                              table_hashes=table_hashes)
+
+    def merged_with(self, stats: VidexDBTaskStats) -> 'VidexTaskCache':
+        """
+        A new snapshot with the tables of stats merged in, see derive.
+        """
         if self.db_tasks_stats is None:
-            self.db_tasks_stats = stats
-        else:
-            self.db_tasks_stats.merge_with(stats, inplace=True)
-            # discard model cache if db and table exists
-            for db_name, table_list in self.db_tasks_stats.get_meta_info_keys().items():
-                if db_name not in self.model_cache_dict:
-                    self.model_cache_dict[db_name] = {}
-                for table_name in table_list:
-                    if table_name in self.model_cache_dict[db_name]:
-                        logging.info(f"discard exist model cache: {db_name}.{table_name}")
-                        self.model_cache_dict[db_name][table_name] = None
+            return VidexTaskCache(stats)
+        merged = self.db_tasks_stats.merge_with(stats)
+        if merged is None:
+            logging.warning(f"task meta is not merged, task_id or sample file prefixes differ: "
+                            f"{self.db_tasks_stats.task_id} vs {stats.task_id}")
+            return self
+        changed = {(db, tb) for db, tbs in stats.get_meta_info_keys().items() for tb in tbs}
+        changed.update((db, tb) for db, tbs in stats.get_stats_info_keys().items() for tb in tbs)
+        return self.derive(merged, list(changed))
+
+    def content_hashes(self) -> Dict[str, str]:
+        """
+        db.table -> content hash of all tables of the snapshot, computed once per table
+        """
+        hashes = {}
+        for db, tables in self.db_tasks_stats.get_stats_info_keys().items():
+            for tb in tables:
+                if (h := self.table_hashes.get((db, tb))) is None:
+                    h = self.db_tasks_stats.table_content_hash(db, tb)
+                    if h is None:
+                        continue
+                    self.table_hashes[(db, tb)] = h
+                hashes[f"{db}.{tb}"] = h
+        return hashes
 
     def get_table_model_cache(self, db_name: str, table_name: str) -> Optional[VidexModelBase]:
         db_name = db_name.lower()
         table_name = table_name.lower()
         return self.model_cache_dict.get(db_name, {}).get(table_name)
 
-    def add_table_model_cache(self, db_name: str, table_name: str, table_model: VidexModelBase):
+    def add_table_model_cache(self, db_name: str, table_name: str, table_model: VidexModelBase, nbytes: int = 0):
+        db_name = db_name.lower()
+        table_name = table_name.lower()
+        # setdefault is atomic, models of other tables in the same db may be added concurrently
+        self.model_cache_dict.setdefault(db_name, {})[table_name] = table_model
+        self.model_bytes[(db_name, table_name)] = nbytes
+
+    def total_stats_bytes(self) -> int:
+        """
+        Approximate bytes of db_tasks_stats, walked on first use only, e.g. by a memory budget or /metrics.
+        """
+        if self.stats_bytes is None:
+            self.stats_bytes = estimate_task_stats_bytes(self.db_tasks_stats)
+        return self.stats_bytes
+
+    def total_model_bytes(self) -> int:
+        return sum(list(self.model_bytes.values()))
+
+    def drop_models(self) -> int:
+        """
+        Discard all table models, they are rebuilt from db_tasks_stats on demand.
+
+        Returns:
+            freed bytes
+        """
+        freed = self.total_model_bytes()
+        # rebind instead of clear, readers holding the old dict are not affected
+        self.model_cache_dict = {}
+        self.model_bytes = {}
+        self.response_cache.clear()
+        return freed
+
+    def drop_table_model(self, db_name: str, table_name: str) -> bool:
+        """
+        Discard the model and the memoized responses of one table, they are rebuilt from db_tasks_stats on demand.
+
+        Returns:
+            True if the model was built
+        """
         db_name = db_name.lower()
         table_name = table_name.lower()
-        if db_name not in self.model_cache_dict:
-            self.model_cache_dict[db_name] = {}
-        self.model_cache_dict[db_name][table_name] = table_model
+        self.response_cache.discard_table(db_name, table_name)
+        self.model_bytes.pop((db_name, table_name), None)
+        return self.model_cache_dict.get(db_name, {}).pop(table_name, None) is not None
+
+    def built_models(self) -> List[str]:
+        return [f"{db}.{tb}" for db, tables in list(self.model_cache_dict.items())
+                for tb, model in list(tables.items()) if model is not None]
 
 
 class VidexSingleton:
@@ -163,21 +329,65 @@ class VidexSingleton:
                  load_meta_by_task_id_func: Callable[[str], VidexDBTaskStats] = None,
                  VidexModelClass: Type[VidexModelBase] = VidexModelInnoDB,
                  logging_package=videx_logging,
+                 task_store: Optional[VidexTaskStore] = None,
+                 store_revalidate_interval: float = 1.0,
+                 cache_max_bytes: Optional[int] = None,
+                 max_concurrent_loads: int = 4,
+                 request_timeout: Optional[float] = DEFAULT_REQUEST_TIMEOUT,
+                 max_in_flight: Optional[int] = None,
+                 admission_wait: float = 0.05,
                  **model_kwargs,
                  ):
+        """
+        Args:
+            task_store: if set, task meta is saved to it and loaded from it on cache miss. It's shared by
+                all worker processes in multi-worker mode.
+            store_revalidate_interval: seconds between two version checks of a cached task against task_store
+            cache_max_bytes: approximate memory budget of all cached tasks and models, None means unlimited.
+                When exceeded, table models are discarded first, then the least recently used tasks.
+            max_concurrent_loads: max number of tasks loaded by load_meta_by_task_id_func at the same time,
+                also the number of background threads of prefetch_tasks and warmup_task.
+            request_timeout: deadline (seconds) of an ask request (or a batch). When it expires, expensive
+                estimations fall back to cheap answers, which are not cached. None means no deadline.
+            max_in_flight: max number of ask requests served at the same time, None means unlimited.
+                The others wait at most admission_wait seconds, then get a 503 response at once,
+                and VIDEX-MySQL falls back to its default estimations.
+        """
+        # guards the writes of self.cache and self.non_task_cache, readers are lock-free
         self.lock = threading.RLock()
-        # Double-layered defaultdict
-        # Caches Videx information, holds a maximum of 100,000 records, and retains them for 300 seconds.
-        self.cache: TTLCache[str, VidexTaskCache] = TTLCache(maxsize=1000, ttl=300)
+        # per-task locks for loading task meta, and per-(task, table) locks for building table models,
+        # so that only one thread does the heavy work, and the others wait and reuse the result.
+        self.task_locks = StripedLock()
+        self.model_locks = StripedLock()
+        # single-flight and bounded loading by load_meta_by_task_id_func
+        self.load_flight = SingleFlight()
+        self.load_semaphore = threading.BoundedSemaphore(max_concurrent_loads)
+        self.load_executor = ThreadPoolExecutor(max_workers=max_concurrent_loads, thread_name_prefix='videx_load')
+        # builds table models of warm-up tasks, and keeps the latest warm-up report of each task
+        self.warmup_executor = ThreadPoolExecutor(max_workers=max_concurrent_loads, thread_name_prefix='videx_warmup')
+        self.warmup_reports = LRUCache(maxsize=1000)
+        # Caches Videx information, holds a maximum of 1000 tasks, and retains them for 300 seconds after last access.
+        self.cache: MemoryBudgetedTaskCache = MemoryBudgetedTaskCache(maxsize=1000, ttl=300,
+                                                                      max_bytes=cache_max_bytes)
         # non task cache is regarded as long-term cache, item is evicted only if exceeding cache size.
         self.non_task_cache: VidexTaskCache = VidexTaskCache(db_tasks_stats=None)
         # load meta by task_id
         self.load_meta_by_task_id_func = load_meta_by_task_id_func
         self.VidexModelClass = VidexModelClass
-        self.request_count = 0
+        self.request_counter = AtomicCounter()
+        # strategy of VidexModelClass in metrics, known after the first model is built
+        self.strategy_label: str = VidexModelClass.__name__
         self.model_kwargs = model_kwargs
         self.logging_package = logging_package
         self.logging_package.initial_config()
+        self.task_store = task_store
+        self.store_revalidate_interval = store_revalidate_interval
+        self.request_timeout = request_timeout
+        self.admission = None if max_in_flight is None else AdmissionControl(max_in_flight, admission_wait)
+
+    @property
+    def request_count(self) -> int:
+        return self.request_counter.value
 
     def extract_task_id(self, req_json_item) -> Optional[str]:
         properties = req_json_item.get('properties', {})
@@ -188,94 +398,381 @@ class VidexSingleton:
         else:
             return task_id
 
-    def ask(self, req_json_item: dict, result2str: bool = True, raise_out: bool = False) \
-            -> Tuple[int, str, dict]:
-        if req_json_item.get('properties') is None or not isinstance(req_json_item['properties'], dict):
-            return 502, f"miss 'properties' or properties is not dict", {}
-        properties = req_json_item['properties']
+    def resolve_task_cache(self, task_id: Optional[str], req_json_item: dict) \
+            -> Tuple[Optional[VidexTaskCache], Optional[Tuple[int, str, dict]]]:
+        """
+        Find the task cache of task_id, load it by load_meta_by_task_id_func if not in cache.
 
-        if not {'dbname', 'table_name', 'function'}.issubset(properties.keys()):
-            return 502, f"miss input: target_engine: " \
-                        f"required dbname, table_name, function, but received properites: {properties}", {}
-        target_engine = properties.get('target_engine', "innodb")
-        videx_db = properties['dbname'].lower()
-        table_name = properties['table_name'].lower()
-        func_str = properties['function'].lower()
+        Returns:
+            (task_cache, None) if found, otherwise (None, (code, message, {})) to respond.
+        """
+        videx_db = str(req_json_item.get('properties', {}).get('dbname')).lower()
+        task_cache = self.non_task_cache if task_id is None else self.cache.get(task_id)
+        metrics.cache_access(CACHE_TASK, task_cache is not None and task_cache.db_tasks_stats is not None)
+        if self.task_store is not None:
+            task_cache = self.sync_task_cache_with_store(task_id, task_cache)
 
-        # N.B. videx_options passing chain:
-        # OPTIMIZE_TASK sets the user variable VIDEX_OPTIONS to the VIDEX_MYSQL instance.
-        # VIDEX_MYSQL receives VIDEX_OPTIONS, renames it to videx_options, and forwards it to VIDEX_SERVER.
-        # VIDEX_SERVER receives videx_options and processes it.
-        # videx_options = json.loads(properties.get('videx_options', "{}"))
-        task_id = self.extract_task_id(req_json_item)
-        # use_gt = videx_options.get('use_gt', True)
-
-        if task_id is None:
-            task_cache = self.non_task_cache
-            db_task_stats = task_cache.db_tasks_stats
-        elif task_id in self.cache:
-            task_cache = self.cache.get(task_id)
-            db_task_stats = task_cache.db_tasks_stats
-        elif self.load_meta_by_task_id_func is None:
+        if task_cache is None and self.load_meta_by_task_id_func is None:
             logging.error(f"=== to find {task_id}, not in cache and load_meta_by_task_id_func is None. {req_json_item=}")
-            return 502, f"db task key not in cache and load_func is None: given task_key={task_id}, " \
-                        f"videx_db={videx_db}, we have: {list(self.cache.keys())}", {}
-        else:
-            func_name = get_func_with_parent(self.load_meta_by_task_id_func)
+            return None, (502, f"db task key not in cache and load_func is None: given task_key={task_id}, "
+                               f"videx_db={videx_db}, we have: {list(self.cache.keys())}", {})
+        elif task_cache is None:
+            task_cache = self.load_task(task_id)
+            if task_cache is None:
+                func_name = get_func_with_parent(self.load_meta_by_task_id_func)
+                logging.error(f"=== loading task_meta failed by using func {func_name}. {task_id=} {req_json_item=}")
+                return None, (502, f"load task_meta using func={func_name}, ", {})
+
+        if task_cache is None or task_cache.db_tasks_stats is None:
+            logging.info(f"=== to find {task_id}, not find. {req_json_item=}")
+            return None, (502, f"db task key not found: given task_key={task_id}, "
+                               f"videx_db={videx_db}, we have: {list(self.cache.keys())}", {})
+        return task_cache, None
+
+    def load_task(self, task_id: str) -> Optional[VidexTaskCache]:
+        """
+        Load a task by load_meta_by_task_id_func. It's single-flight: concurrent calls of the same task_id share
+        one load, and at most max_concurrent_loads tasks are loaded at the same time.
+
+        Returns:
+            the loaded task cache, None if load_meta_by_task_id_func returns None
+        """
+        return self.load_flight.do(task_id, lambda: self._load_task(task_id))
+
+    def _load_task(self, task_id: str) -> Optional[VidexTaskCache]:
+        # loaded by the previous flight
+        if (task_cache := self.cache.get(task_id)) is not None:
+            return task_cache
+        func_name = get_func_with_parent(self.load_meta_by_task_id_func)
+        with self.load_semaphore:
             st = time.perf_counter()
             db_task_stats: VidexDBTaskStats = self.load_meta_by_task_id_func(task_id)
             end = time.perf_counter()
-            if db_task_stats is None:
-                logging.error(f"=== loading task_meta failed by using func {func_name}. {task_id=} {req_json_item=}")
-                return 502, f"load task_meta using func={func_name}, ", {}
+        if db_task_stats is None:
+            return None
 
-            task_cache = VidexTaskCache(db_task_stats)
+        task_cache = VidexTaskCache(db_task_stats)
+        if self.task_store is not None:
+            # share with other processes, so that they don't need to load it again
+            task_cache.store_version = self.task_store.save(db_task_stats, task_id)
+            task_cache.store_checked_at = time.monotonic()
+        with self.lock:
             before_keys = list(self.cache.keys())
             self.cache[task_id] = task_cache
+            self.enforce_memory_budget()
             now_keys = list(self.cache.keys())
 
-            db_tables = {db: {tb for tb in v} for db, v in db_task_stats.stats_dict.items()}
-            logging.info(f"=== load task_meta using func={func_name}. use {end - st:.2f}s. "
-                         f"key={db_task_stats.key} db:tables={db_tables} {before_keys=} {now_keys=}")
+        db_tables = {db: {tb for tb in v} for db, v in db_task_stats.stats_dict.items()}
+        logging.info(f"=== load task_meta using func={func_name}. use {end - st:.2f}s. "
+                     f"key={db_task_stats.key} db:tables={db_tables} {before_keys=} {now_keys=}")
+        return task_cache
 
-        if db_task_stats is None:
-            logging.info(f"=== to find {task_id}, not find. {req_json_item=}")
-            return 502, f"db task key not found: given task_key={task_id}, " \
-                        f"videx_db={videx_db}, we have: {list(self.cache.keys())}", {}
+    def prefetch_tasks(self, task_ids: List[str]) -> Dict[str, str]:
+        """
+        Load tasks in background, so that the first requests of a task don't wait for the load.
+
+        Returns:
+            task_id -> "cached" | "loading" (already in flight) | "scheduled" | "unavailable" (no way to load it)
+        """
+        states = {}
+        for task_id in task_ids:
+            if task_id in self.cache:
+                states[task_id] = 'cached'
+            elif self.load_flight.in_flight(task_id):
+                states[task_id] = 'loading'
+            elif self.load_meta_by_task_id_func is None and self.task_store is None:
+                states[task_id] = 'unavailable'
+            else:
+                self.load_executor.submit(self._prefetch_task, task_id)
+                states[task_id] = 'scheduled'
+        return states
+
+    def _prefetch_task(self, task_id: str):
+        try:
+            _, error = self.resolve_task_cache(task_id, {'properties': {}})
+            if error is not None:
+                logging.warning(f"=== prefetch task {task_id} failed: {error[1]}")
+        except Exception as e:
+            logging.error(f"=== prefetch task {task_id} failed: {e}, {traceback.format_exc()}")
+
+    def warmup_task(self, req_dict: dict) -> dict:
+        """
+        Build all table models of a task in background (warmup_executor), so that the first queries of the task
+        don't pay model construction, sample loading and histogram post-init.
+
+        req_dict:
+        {
+            "task_id": "xxx",  # null means the non-task meta
+            "tables": ["db.table", ...],  # default all tables of the task
+            "wait": false,  # true to return after all models are built
+        }
+
+        Returns:
+            the warm-up report: {"task_id", "state": "running" | "done", "seconds", "tables": {db.table: {"seconds",
+            "cached"} or {"error"}}}. It's kept by task and returned by warmup_report.
+        Raises:
+            KeyError: task not found
+            ValueError: invalid tables
+        """
+        task_id = req_dict.get('task_id')
+        if VidexTaskStore.task_key(task_id) == NON_TASK_KEY:
+            task_id = None
+        task_cache, error = self.resolve_task_cache(task_id, {'properties': {}})
+        if error is not None:
+            raise KeyError(f"task not found: {task_id}")
+        all_tables = sorted((db, tb) for db, tbs in task_cache.db_tasks_stats.get_stats_info_keys().items()
+                            for tb in tbs if task_cache.db_tasks_stats.get_table_meta(db, tb) is not None)
+        if req_dict.get('tables'):
+            tables = [tuple(t.lower().split('.', 1)) for t in req_dict['tables']]
+            if any(len(t) != 2 or t not in all_tables for t in tables):
+                raise ValueError(f"warmup tables must be 'db.table' of the task, got {req_dict['tables']}")
+        else:
+            tables = all_tables
+
+        report = {'task_id': task_id, 'state': 'running', 'seconds': None, 'tables': {}}
+        with self.lock:
+            self.warmup_reports[VidexTaskStore.task_key(task_id)] = report
+        st = time.perf_counter()
+        remaining = [len(tables)]
+        remaining_lock = threading.Lock()
+
+        def build(db_name: str, table_name: str):
+            table_st = time.perf_counter()
+            cached = task_cache.get_table_model_cache(db_name, table_name) is not None
+            try:
+                self.get_videx_table_stats(task_cache, db_name, table_name)
+                result = {'seconds': round(time.perf_counter() - table_st, 6), 'cached': cached}
+            except Exception as e:
+                logging.error(f"=== warm up {db_name}.{table_name} of task {task_id} failed: {e}, "
+                              f"{traceback.format_exc()}")
+                result = {'error': str(e)}
+            report['tables'][f"{db_name}.{table_name}"] = result
+            with remaining_lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    report['seconds'] = round(time.perf_counter() - st, 6)
+                    report['state'] = 'done'
+                    logging.info(f"=== warm up task {task_id}: {len(tables)} tables use {report['seconds']:.2f}s")
+
+        if len(tables) == 0:
+            report['seconds'], report['state'] = 0., 'done'
+        futures = [self.warmup_executor.submit(build, db_name, table_name) for db_name, table_name in tables]
+        if req_dict.get('wait'):
+            concurrent.futures.wait(futures)
+        return self.copy_warmup_report(report)
+
+    def warmup_report(self, task_id: Optional[str]) -> Optional[dict]:
+        with self.lock:
+            report = self.warmup_reports.get(VidexTaskStore.task_key(task_id))
+        return None if report is None else self.copy_warmup_report(report)
+
+    @staticmethod
+    def copy_warmup_report(report: dict) -> dict:
+        # tables are being added by the builders
+        return dict(report, tables=dict(report['tables']))
+
+    def sync_task_cache_with_store(self, task_id: Optional[str], task_cache: Optional[VidexTaskCache],
+                                   force: bool = False) -> Optional[VidexTaskCache]:
+        """
+        Reload the task from task_store if it was changed by another process, at most once per
+        store_revalidate_interval unless force is True.
+
+        Returns:
+            the up-to-date task cache. None if the task is neither in memory nor in the store.
+        """
+        now = time.monotonic()
+        if not force and task_cache is not None and now - task_cache.store_checked_at < self.store_revalidate_interval:
+            return task_cache
+        with self.task_locks.lock_for(task_id):
+            # another thread may have synced it while we were waiting
+            task_cache = self.non_task_cache if task_id is None else self.cache.get(task_id)
+            return self._sync_task_cache_with_store(task_id, task_cache, now)
+
+    def _sync_task_cache_with_store(self, task_id: Optional[str], task_cache: Optional[VidexTaskCache],
+                                    now: float) -> Optional[VidexTaskCache]:
+        version = self.task_store.version(task_id)
+        if task_cache is not None and version == task_cache.store_version:
+            task_cache.store_checked_at = now
+            return task_cache
+
+        stats = None
+        if version is not None:
+            try:
+                stats, version = self.task_store.load(task_id)
+            except Exception as e:
+                logging.error(f"=== failed to load task_meta from task store: {task_id=}, keep the one in memory. "
+                              f"{e}, {traceback.format_exc()}")
+                return task_cache
+        if stats is None:
+            if task_cache is not None and task_cache.store_version is None:
+                # only in memory, never stored
+                task_cache.store_checked_at = now
+                return task_cache
+            # removed from the store by another process
+            logging.info(f"=== task {task_id} is removed from task store, drop it from memory")
+            new_cache = None
+        else:
+            logging.info(f"=== load task_meta from task store: {task_id=} {version=}")
+            new_cache = VidexTaskCache(stats, store_version=version, store_checked_at=now)
+
+        with self.lock:
+            if task_id is None:
+                self.non_task_cache = new_cache or VidexTaskCache(db_tasks_stats=None)
+                return self.non_task_cache
+            if new_cache is None:
+                self.cache.pop(task_id, None)
+            else:
+                self.cache[task_id] = new_cache
+                self.enforce_memory_budget()
+        return new_cache
+
+    def enforce_memory_budget(self) -> int:
+        """
+        Discard models and evict tasks if the cached tasks exceed cache_max_bytes.
+
+        Returns:
+            freed bytes
+        """
+        with self.lock:
+            return self.cache.enforce_budget(pinned=[self.non_task_cache])
+
+    def memory_usage(self) -> dict:
+        """
+        Approximate memory of cached tasks: task key -> {'stats_bytes': int, 'model_bytes': int}
+        """
+        usage = {}
+        for key, task_cache in [(NON_TASK_KEY, self.non_task_cache)] + [(k, self.cache.peek(k)) for k in self.cache]:
+            if task_cache is not None:
+                usage[key] = {'stats_bytes': task_cache.total_stats_bytes(), 'model_bytes': task_cache.total_model_bytes()}
+        return usage
+
+    def response_cache_stats(self) -> dict:
+        """
+        hit/miss counters of the response cache: task key -> {'size', 'hits', 'misses', 'hit_ratio'}
+        """
+        stats = {}
+        for key, task_cache in [(NON_TASK_KEY, self.non_task_cache)] + [(k, self.cache.peek(k)) for k in self.cache]:
+            if task_cache is not None:
+                stats[key] = task_cache.response_cache.stats()
+        return stats
+
+    @contextlib.contextmanager
+    def admit(self) -> Iterator[bool]:
+        """
+        with singleton.admit() as admitted:
+            if not admitted:
+                return singleton.shed(req_json_item)
+        """
+        if self.admission is None:
+            yield True
+            return
+        if not self.admission.try_enter():
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self.admission.leave()
+
+    def shed(self, req_json_item: dict) -> Tuple[int, str, dict]:
+        """
+        The response of a request rejected by admission control
+        """
+        properties = req_json_item.get('properties')
+        func_str = properties.get('function') if isinstance(properties, dict) else None
+        metrics.observe_request(videx_funcs.label(func_str), self.strategy_label, 503, 0.)
+        return 503, f"Service Unavailable: {self.admission.max_in_flight} requests in flight", {}
+
+    def ask(self, req_json_item: dict, result2str: bool = True, raise_out: bool = False,
+            task_cache: VidexTaskCache = None, precomputed: dict = None) -> Tuple[int, str, dict]:
+        """
+        See _ask. Requests are counted and timed in metrics, by func and strategy,
+        and served within request_timeout (see videx_deadline).
+        """
+        st = time.perf_counter()
+        code = 500
+        try:
+            with request_deadline(self.request_timeout):
+                code, message, response_data = self._ask(req_json_item, result2str, raise_out, task_cache,
+                                                         precomputed)
+            return code, message, response_data
+        finally:
+            properties = req_json_item.get('properties')
+            func_str = properties.get('function') if isinstance(properties, dict) else None
+            metrics.observe_request(videx_funcs.label(func_str), self.strategy_label, code,
+                                    time.perf_counter() - st)
+
+    def _ask(self, req_json_item: dict, result2str: bool = True, raise_out: bool = False,
+             task_cache: VidexTaskCache = None, precomputed: dict = None) -> Tuple[int, str, dict]:
+        """
+        Args:
+            req_json_item: request from VIDEX-MySQL
+            result2str: convert the values in response into str
+            raise_out: raise the exception of model instead of returning 500
+            task_cache: the resolved task cache. If None, resolve it by the task_id in videx_options.
+            precomputed: the response of the handler, answered by the batch handler (see ask_batch)
+
+        Returns:
+            code, message, response data
+        """
+        if req_json_item.get('properties') is None or not isinstance(req_json_item['properties'], dict):
+            return 502, f"miss 'properties' or properties is not dict", {}
+        properties = req_json_item['properties']
+
+        if not {'dbname', 'table_name', 'function'}.issubset(properties.keys()):
+            return 502, f"miss input: target_engine: " \
+                        f"required dbname, table_name, function, but received properites: {properties}", {}
+        target_engine = properties.get('target_engine', "innodb")
+        videx_db = properties['dbname'].lower()
+        table_name = properties['table_name'].lower()
+        func_str = properties['function'].lower()
+
+        if task_cache is None:
+            # N.B. videx_options passing chain:
+            # OPTIMIZE_TASK sets the user variable VIDEX_OPTIONS to the VIDEX_MYSQL instance.
+            # VIDEX_MYSQL receives VIDEX_OPTIONS, renames it to videx_options, and forwards it to VIDEX_SERVER.
+            # VIDEX_SERVER receives videx_options and processes it.
+            # videx_options = json.loads(properties.get('videx_options', "{}"))
+            task_id = self.extract_task_id(req_json_item)
+            # use_gt = videx_options.get('use_gt', True)
+            with metrics.phase(PHASE_TASK_LOOKUP):
+                task_cache, error = self.resolve_task_cache(task_id, req_json_item)
+            if error is not None:
+                return error
+        db_task_stats = task_cache.db_tasks_stats
 
         success_code, success_msg = 200, "OK"
 
+        # identical requests of the same task meta always get the same response
+        fingerprint = (videx_db, table_name, request_fingerprint(req_json_item, result2str))
+        generation = task_cache.response_cache.generation
+        cached_resp = task_cache.response_cache.get(fingerprint)
+        metrics.cache_access(CACHE_RESPONSE, cached_resp is not None)
+        if cached_resp is not None:
+            return success_code, success_msg, cached_resp
+
         # If an expect request already exists, return immediately.
         # The new version has removed the use of `use_gt`. Control the usage of gt by passing {req_json_item: expect_resp}.
         expect_resp = db_task_stats.get_expect_response(req_json_item, result2str)
         if expect_resp is not None:
+            task_cache.response_cache.put(fingerprint, expect_resp, generation)
             return success_code, success_msg, expect_resp
 
         if db_task_stats.get_table_meta(videx_db, table_name) is None:
             return 404, f"Not Found table_name: {videx_db}.{table_name}", {}
-        func = str2VidexFunc(func_str)
-        if func == VidexFunc.not_supported:
+        func_handler = videx_funcs.get(func_str)
+        if func_handler is None:
             return 400, f"Not Supported function: {func_str}", {}
+        if (invalid := func_handler.validate(req_json_item)) is not None:
+            return 400, f"Invalid request of {func_handler.func_id}: {invalid}", {}
 
         # TODO  For ease of debugging, directly construct the InnoDB model.
         table_model = self.get_videx_table_stats(task_cache, videx_db, table_name)
-        resp = {}
-        single_resp = lambda v: {"value": v}
         # #########################################################
         # ##################### key part ##########################
         # #########################################################
-        # TODO Consider code optimization and encapsulation later.
         try:
-            if func == VidexFunc.scan_time:
-                resp = single_resp(table_model.scan_time(req_json_item))
-            elif func == VidexFunc.get_memory_buffer_size:
-                resp = single_resp(table_model.get_memory_buffer_size(req_json_item))
-            elif func == VidexFunc.records_in_range:
-                resp = single_resp(table_model.records_in_range(req_json_item))
-            elif func == VidexFunc.info_low:
-                resp = table_model.info_low(req_json_item)
-            else:
-                raise NotImplementedError(f"MEEEET func unsupported: {func}")
+            resp = precomputed if precomputed is not None else func_handler.handler(table_model, req_json_item)
         except Exception as e:
             if raise_out:
                 raise
@@ -286,14 +783,98 @@ class VidexSingleton:
             final_resp = {k: str(v) for k, v in resp.items()}
         else:
             final_resp = resp
+        if not is_degraded():
+            task_cache.response_cache.put(fingerprint, final_resp, generation)
         return success_code, success_msg, final_resp
 
+    def ask_batch(self, req_json_items: List[dict], result2str: bool = True) -> List[Tuple[int, str, dict]]:
+        """
+        Ask a batch of requests sharing one task_id. The task is resolved once, and the table models
+        are reused by all items of the same table.
+
+        Returns:
+            a list of (code, message, response data), in the same order of req_json_items
+        """
+        if len(req_json_items) == 0:
+            return []
+        for item in req_json_items:
+            if not isinstance(item.get('properties'), dict):
+                return [self.ask(item, result2str) for item in req_json_items]
+
+        task_id = self.extract_task_id(req_json_items[0])
+        results = []
+        # all items share the deadline of the batch
+        with request_deadline(self.request_timeout):
+            task_cache, error = self.resolve_task_cache(task_id, req_json_items[0])
+            precomputed = [None] * len(req_json_items)
+            if error is None:
+                precomputed = self._precompute_batch(task_id, task_cache, req_json_items)
+            for item, item_precomputed in zip(req_json_items, precomputed):
+                if self.extract_task_id(item) != task_id:
+                    results.append((400, f"all items in a batch must share one task_id, "
+                                         f"expect {task_id}, got {self.extract_task_id(item)}", {}))
+                elif error is not None:
+                    results.append(error)
+                else:
+                    results.append(self.ask(item, result2str, task_cache=task_cache, precomputed=item_precomputed))
+        return results
+
+    def _precompute_batch(self, task_id: str, task_cache: VidexTaskCache,
+                          req_json_items: List[dict]) -> List[Optional[dict]]:
+        """
+        Answer the groups of at least BATCH_VECTORIZE_MIN_ITEMS valid items of the same table and function by the
+        batch handler of the function, e.g. all ranges of an IN list in one histogram search.
+
+        Returns:
+            the handler response of each item, None if the item is left to its own handler
+        """
+        precomputed: List[Optional[dict]] = [None] * len(req_json_items)
+        # (db, table, func_id) -> (handler, [item index])
+        groups: Dict[Tuple[str, str, str], Tuple[VidexFuncHandler, List[int]]] = {}
+        for k, item in enumerate(req_json_items):
+            properties = item['properties']
+            if not {'dbname', 'table_name', 'function'}.issubset(properties.keys()) \
+                    or self.extract_task_id(item) != task_id:
+                continue
+            func_handler = videx_funcs.get(str(properties['function']).lower())
+            if func_handler is None or func_handler.batch_handler is None or func_handler.validate(item) is not None:
+                continue
+            key = (properties['dbname'].lower(), properties['table_name'].lower(), func_handler.func_id)
+            groups.setdefault(key, (func_handler, []))[1].append(k)
+
+        for (videx_db, table_name, func_id), (func_handler, indexes) in groups.items():
+            if len(indexes) < BATCH_VECTORIZE_MIN_ITEMS or \
+                    task_cache.db_tasks_stats.get_table_meta(videx_db, table_name) is None:
+                continue
+            try:
+                table_model = self.get_videx_table_stats(task_cache, videx_db, table_name)
+                responses = func_handler.batch_handler(table_model, [req_json_items[k] for k in indexes])
+            except Exception as e:
+                logging.warning(f"batch {func_id} of {videx_db}.{table_name} failed, ask the items one by one: {e}")
+                continue
+            for k, resp in zip(indexes, responses):
+                precomputed[k] = resp
+        return precomputed
+
     def get_videx_table_stats(self, task_cache: VidexTaskCache, db_name: str, table_name: str) -> VidexModelBase:
         db_task_stats = task_cache.db_tasks_stats
 
         if (res := task_cache.get_table_model_cache(db_name, table_name)) is not None:
+            metrics.cache_access(CACHE_MODEL, True)
             return res
 
+        # single-flight: only one thread builds the model, the others wait and reuse it
+        with self.model_locks.lock_for((id(task_cache), db_name.lower(), table_name.lower())):
+            if (res := task_cache.get_table_model_cache(db_name, table_name)) is not None:
+                metrics.cache_access(CACHE_MODEL, True)
+                return res
+            metrics.cache_access(CACHE_MODEL, False)
+            with metrics.phase(PHASE_MODEL_BUILD):
+                return self._build_table_model(task_cache, db_name, table_name)
+
+    def _build_table_model(self, task_cache: VidexTaskCache, db_name: str, table_name: str) -> VidexModelBase:
+        db_task_stats = task_cache.db_tasks_stats
+
         if (table_stats_info := db_task_stats.get_table_stats_info(db_name, table_name)) is None:
             raise ValueError(f"given db_stats_info have not {db_name=} {table_name=}, only: {db_task_stats.get_stats_info_keys()}")
 
@@ -320,9 +901,157 @@ class VidexSingleton:
             sample_data=table_stats_info.sample_data
         )
         table_model = self.VidexModelClass(table_stats, **self.model_kwargs)
-        task_cache.add_table_model_cache(db_name, table_name, table_model)
+        self.strategy_label = table_model.strategy.value
+        # histograms and sample frames referenced by the model are accounted in stats_bytes if they are shared
+        shared = [table_stats_info.sample_data, *(table_stats_info.histogram_dict or {}).values()]
+        task_cache.add_table_model_cache(db_name, table_name, table_model,
+                                         nbytes=estimate_model_bytes(table_model, shared))
+        if self.cache.max_bytes is not None:
+            self.enforce_memory_budget()
         return table_model
 
+    def patch_task_meta(self, task_id: Optional[str], patch_func: Callable[[VidexDBTaskStats], List[str]],
+                        tables: List[Tuple[str, str]] = None) -> dict:
+        """
+        Apply a small patch to the meta of a cached task, and discard only the affected models.
+        The patch is applied to a shallow copy of the task meta, and the new snapshot is swapped in.
+        patch_func must swap in new objects instead of mutating the shared ones (see patch_table_stats).
+
+        Args:
+            patch_func: patches the (copied) task meta in place, returns names of the patched fields
+            tables: (db, table) affected by the patch, None means all tables of the task
+
+        Returns:
+            {"patched": [field], "models": [db.table of the discarded models]}
+        """
+        if VidexTaskStore.task_key(task_id) == NON_TASK_KEY:
+            task_id = None
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(self.task_locks.lock_for(task_id))
+            if self.task_store is not None:
+                # other processes may have patched it, patch the latest one in store
+                stack.enter_context(self.task_store.locked(task_id))
+                current = self.non_task_cache if task_id is None else self.cache.get(task_id)
+                task_cache = self._sync_task_cache_with_store(task_id, current, time.monotonic())
+            else:
+                task_cache = self.non_task_cache if task_id is None else self.cache.get(task_id)
+            if task_cache is None or task_cache.db_tasks_stats is None:
+                raise KeyError(f"task not found: {task_id}")
+
+            new_stats = task_cache.db_tasks_stats.shallow_copy()
+            patched = patch_func(new_stats)
+            if tables is None:
+                dropped = task_cache.built_models()
+            else:
+                dropped = [f"{db.lower()}.{tb.lower()}" for db, tb in tables
+                           if task_cache.get_table_model_cache(db, tb) is not None]
+            new_cache = task_cache.derive(new_stats, tables)
+            if self.task_store is not None:
+                new_cache.store_version = self.task_store.save(new_stats, task_id)
+                new_cache.store_checked_at = time.monotonic()
+            with self.lock:
+                if task_id is None:
+                    self.non_task_cache = new_cache
+                else:
+                    self.cache[task_id] = new_cache
+        self.enforce_memory_budget()
+        logging.info(f"=== patch task_meta {task_id=} {patched=} discarded models={dropped}")
+        return {'patched': patched, 'models': dropped}
+
+    def task_content_hashes(self, req_dict: dict) -> dict:
+        """
+        Content hashes of a task, so that a client uploads only the tables that differ (see merge_task_stats).
+
+        req_dict = {"task_id": task_id}  # None means the non-task meta
+
+        Returns:
+            {"task_id", "header": hash of db_config and sample_file_info, "tables": {db.table: hash}}
+        Raises:
+            KeyError: task not found
+        """
+        task_id = req_dict.get('task_id')
+        if VidexTaskStore.task_key(task_id) == NON_TASK_KEY:
+            task_id = None
+        task_cache, error = self.resolve_task_cache(task_id, {'properties': {}})
+        if error is not None:
+            raise KeyError(f"task not found: {task_id}")
+        return {'task_id': task_id, 'header': task_cache.db_tasks_stats.header_content_hash(),
+                'tables': task_cache.content_hashes()}
+
+    def merge_task_stats(self, videx_request: VidexDBTaskStats, drop_tables: List[str] = None) -> dict:
+        """
+        Merge the tables of videx_request into the task, and remove drop_tables ("db.table") from it.
+        Only the models of the merged and removed tables are discarded. The non-task meta is created if it's empty.
+
+        Returns:
+            {"patched": ["tables"], "models": [db.table of the discarded models], "dropped": [db.table]}
+        Raises:
+            KeyError: task not found, the client should upload the whole task instead
+            ValueError: invalid drop_tables, or sample files differ
+        """
+        task_id = None if videx_request.key_is_none() else videx_request.task_id
+        drop = [tuple(t.lower().split('.', 1)) for t in drop_tables or []]
+        if any(len(t) != 2 for t in drop):
+            raise ValueError(f"drop_tables must be 'db.table', got {drop_tables}")
+        changed = {(db, tb) for db, tbs in videx_request.get_stats_info_keys().items() for tb in tbs}
+        changed.update((db, tb) for db, tbs in videx_request.get_meta_info_keys().items() for tb in tbs)
+        dropped = []
+
+        def merge(stats: VidexDBTaskStats) -> List[str]:
+            # stats is a shallow copy, merged in place
+            if stats.merge_with(videx_request, inplace=True) is None:
+                raise ValueError(f"task meta is not merged, sample file prefixes differ: {task_id}")
+            dropped.extend(stats.drop_tables(drop))
+            return ['tables']
+
+        if task_id is not None and self.task_store is None and task_id not in self.cache \
+                and self.load_meta_by_task_id_func is not None:
+            # evicted since the client got its hashes
+            self.load_task(task_id)
+        try:
+            result = self.patch_task_meta(task_id, merge, tables=sorted(changed | set(drop)))
+        except KeyError:
+            if task_id is not None:
+                raise
+            self.add_task_stats(videx_request)
+            result = {'patched': ['tables'], 'models': []}
+        return {**result, 'dropped': dropped}
+
+    def update_table_stats(self, req_dict: dict) -> dict:
+        """
+        Patch the stats of one table, e.g. after creating an index in an index-advisor loop.
+
+        req_dict = {
+            "task_id": task_id,  # None means the non-task meta
+            "dbname": "db",
+            "table_name": "table",
+            # all the followings are optional
+            "histograms": {col: histogram dict or None},  # None removes the histogram
+            "ndvs_single": {col: ndv},
+            "ndvs_multi_col_gt": {...},  # merged into the ground-truth multi-column ndvs
+            "gt_rec_in_ranges": [...],  # replaces the ground-truth records_in_range
+            "gt_req_resp": {...},  # merged into the ground-truth request -> response
+        }
+        """
+        db_name, table_name = req_dict['dbname'], req_dict['table_name']
+        patch = {k: req_dict.get(k) for k in ('histograms', 'ndvs_single', 'ndvs_multi_col_gt',
+                                              'gt_rec_in_ranges', 'gt_req_resp')}
+        return self.patch_task_meta(req_dict.get('task_id'),
+                                    lambda stats: stats.patch_table_stats(db_name, table_name, **patch),
+                                    tables=[(db_name, table_name)])
+
+    def set_task_variables(self, req_dict: dict) -> dict:
+        """
+        Set variables of a task (db_config), all models of the task are discarded.
+
+        req_dict = {
+            "task_id": task_id,  # None means the non-task meta
+            "variables": {"optimizer_switch": "mrr=on,mrr_cost_based=off", "sort_buffer_size": 262144},
+        }
+        """
+        variables = req_dict.get('variables') or {}
+        return self.patch_task_meta(req_dict.get('task_id'), lambda stats: stats.set_variables(variables))
+
     def add_task_meta_from_local_files(self, task_id, raw_db, videx_db,
                                        stats_file: Union[str, dict],
                                        hist_file: Union[str, dict],
@@ -384,8 +1113,12 @@ class VidexSingleton:
         Returns:
 
         """
-        videx_request: VidexDBTaskStats = VidexDBTaskStats.from_dict(req_dict)
+        self.add_task_stats(VidexDBTaskStats.from_dict(req_dict))
 
+    def add_task_stats(self, videx_request: VidexDBTaskStats):
+        """
+        Add the parsed task meta, see add_task_meta.
+        """
         db_tables = {db: {tb for tb in v} for db, v in videx_request.stats_dict.items()}
 
         if videx_request.key_is_none():
@@ -393,36 +1126,119 @@ class VidexSingleton:
             if self.non_task_cache.db_tasks_stats is not None:
                 before_meta_keys = self.non_task_cache.db_tasks_stats.get_meta_info_keys()
 
-            self.non_task_cache.add_db_tasks_stats(videx_request)
+            # N.B. lock order: task lock -> task store lock -> self.lock
+            # the merged snapshot is swapped in, readers of the current one are not affected
+            if self.task_store is None:
+                with self.lock:
+                    self.non_task_cache = self.non_task_cache.merged_with(videx_request)
+            else:
+                # other processes may have added non-task meta, merge with the latest one in store
+                with self.task_store.locked(None), self.lock:
+                    current = self._sync_task_cache_with_store(None, self.non_task_cache, time.monotonic())
+                    merged = current.merged_with(videx_request)
+                    merged.store_version = self.task_store.save(merged.db_tasks_stats)
+                    merged.store_checked_at = time.monotonic()
+                    self.non_task_cache = merged
+            self.enforce_memory_budget()
 
             after_meta_keys = self.non_task_cache.db_tasks_stats.get_meta_info_keys()
             logging.info(f"=== load NON-TASK-ID task_meta. "
                          f"New db:tables={db_tables} {before_meta_keys=} {after_meta_keys=}")
             return
 
-        before_keys = list(self.cache.keys())
-        self.cache[videx_request.key] = VidexTaskCache(videx_request)
-        now_keys = list(self.cache.keys())
-        # 只有这里可能要加锁
+        task_cache = VidexTaskCache(videx_request)
+        if self.task_store is not None:
+            task_cache.store_version = self.task_store.save(videx_request)
+            task_cache.store_checked_at = time.monotonic()
+        with self.lock:
+            before_keys = list(self.cache.keys())
+            self.cache[videx_request.key] = task_cache
+            self.enforce_memory_budget()
+            now_keys = list(self.cache.keys())
         logging.info(f"=== load task_meta for key={videx_request.key} db:tables={db_tables} {before_keys=} {now_keys=}")
 
 
-    def clear_cache(self, req_dict):
-        key_list = req_dict.get('key_list', [])
-        before_keys = list(self.cache.keys())
-        if key_list is None or len(key_list) == 0:
-            self.cache.clear()
-            self.non_task_cache = VidexTaskCache(db_tasks_stats=None)
-            logging.info("all task caches cleared")
-        else:
-            for key in key_list:
-                if key in self.cache:
-                    self.cache.pop(key)
+    def preload_from_store(self) -> List[str]:
+        """
+        Load all tasks in task_store into memory, so that a restarted server is hot immediately.
 
-        logging.info(f"cache is cleared: to clear: {key_list} "
-                     f"before={list(before_keys)} "
-                     f"now={list(self.cache.keys())} ")
+        Returns:
+            keys of the loaded tasks
+        """
+        loaded = []
+        for key in self.task_store.list_task_keys():
+            task_id = None if key == NON_TASK_KEY else key
+            task_cache = self.sync_task_cache_with_store(task_id, None, force=True)
+            if task_cache is not None and task_cache.db_tasks_stats is not None:
+                loaded.append(key)
+        logging.info(f"=== preload {len(loaded)} tasks from task store {self.task_store.store_dir}: {loaded}")
+        return loaded
+
+    def clear_cache(self, req_dict) -> dict:
+        """
+        Targeted invalidation of cached tasks.
 
+        req_dict = {
+            "key_list": [task_id, ...],  # empty or None means all tasks. None, "None" or "" means the non-task cache
+            "scope": "task",  # "task": evict the whole tasks from memory;
+                              # "table": discard the models and responses of the given tables, keep raw stats;
+                              # "model": discard all models and responses of the tasks, keep raw stats.
+            "tables": ["db.table", ...],  # required if scope is "table"
+            "purge_store": False,  # scope "task" only, also delete the tasks from task_store.
+        }
+        Tasks in task_store are kept (and lazily loaded again) unless purge_store is True.
+
+        Returns:
+            what was evicted: {"tasks": [task key], "models": [task key/db.table], "purged": [task key]}
+        """
+        key_list = req_dict.get('key_list') or []
+        scope = req_dict.get('scope') or 'task'
+        tables = [tuple(t.lower().split('.', 1)) for t in (req_dict.get('tables') or [])]
+        purge_store = req_dict.get('purge_store', False) and self.task_store is not None
+        if scope not in ('task', 'table', 'model'):
+            raise ValueError(f"unsupported clear_cache scope: {scope}, expect task, table or model")
+        if scope == 'table' and (not tables or any(len(t) != 2 for t in tables)):
+            raise ValueError(f"clear_cache scope table requires tables as 'db.table', got {req_dict.get('tables')}")
+        if purge_store and scope != 'task':
+            raise ValueError(f"purge_store is only allowed in scope task, got {scope=}")
+        evicted = {'tasks': [], 'models': [], 'purged': []}
+
+        with self.lock:
+            before_keys = list(self.cache.keys())
+            if len(key_list) == 0:
+                task_keys = [NON_TASK_KEY] + before_keys
+            else:
+                task_keys = [NON_TASK_KEY if VidexTaskStore.task_key(k) == NON_TASK_KEY else k for k in key_list]
+
+            for key in task_keys:
+                task_cache = self.non_task_cache if key == NON_TASK_KEY else self.cache.peek(key)
+                if scope == 'task':
+                    if key == NON_TASK_KEY:
+                        if self.non_task_cache.db_tasks_stats is not None:
+                            evicted['tasks'].append(key)
+                        self.non_task_cache = VidexTaskCache(db_tasks_stats=None)
+                    elif task_cache is not None:
+                        self.cache.pop(key, None)
+                        evicted['tasks'].append(key)
+                    if purge_store and self.task_store.delete(None if key == NON_TASK_KEY else key):
+                        evicted['purged'].append(key)
+                elif task_cache is None:
+                    continue
+                elif scope == 'model':
+                    evicted['models'].extend(f"{key}/{t}" for t in task_cache.built_models())
+                    task_cache.drop_models()
+                else:
+                    for db_name, table_name in tables:
+                        if task_cache.drop_table_model(db_name, table_name):
+                            evicted['models'].append(f"{key}/{db_name}.{table_name}")
+
+        logging.info(f"cache is cleared: to clear: {key_list} {scope=} tables={req_dict.get('tables')} "
+                     f"{evicted=} before={list(before_keys)} now={list(self.cache.keys())}")
+        return evicted
+
+
+# the singleton used by the routes, built by init_videx_singleton
+videx_meta_singleton: Optional[VidexSingleton] = None
 
 # request_count = 0
 # resp_expect_dict = {}
@@ -430,27 +1246,159 @@ class VidexSingleton:
 
 @app.before_request
 def before_request():
+    if request.path == '/create_task_meta_stream':
+        # decompressed incrementally by the route
+        return None
     if 'Content-Encoding' in request.headers and request.headers['Content-Encoding'] == 'gzip':
-        decompressed_data = gzip.decompress(request.get_data(cache=False))
+        try:
+            decompressed_data = decompress_bounded(request.get_data(cache=False),
+                                                   app.config['VIDEX_MAX_DECOMPRESSED_BYTES'])
+        except PayloadTooLargeException as e:
+            return jsonify(code=413, message=str(e), data={}), 413
 
         # update the request header and data
         request._cached_data = decompressed_data
         # del request.headers['Content-Encoding']
 
 
+def read_payload(model) -> Union[dict, list]:
+    """
+    Request body decoded by Content-Type (json or msgpack), and validated by the restx model,
+    which is the schema of both formats.
+    Routes using it expect the model with validate=False, since restx only validates json bodies.
+    """
+    if request.mimetype in MSGPACK_MIMETYPES:
+        try:
+            payload = msgpack.unpackb(request.get_data(), raw=False, strict_map_key=False)
+        except (ValueError, msgpack.UnpackException) as e:
+            abort(400, message=f"invalid msgpack body: {e}")
+    else:
+        payload = request.get_json()
+    model.validate(payload, api.refresolver, api.format_checker)
+    return payload
+
+
+def negotiated_response(code: int, message: str, data) -> FlaskResponse:
+    """
+    jsonify(code, message, data), or its msgpack encoding if the client accepts msgpack rather than json
+    """
+    if request.accept_mimetypes.best_match(('application/json', MSGPACK_MIMETYPE)) == MSGPACK_MIMETYPE:
+        return FlaskResponse(msgpack.packb({'code': code, 'message': message, 'data': data}),
+                             mimetype=MSGPACK_MIMETYPE)
+    return jsonify(code=code, message=message, data=data)
+
+
+def warmup_after_create(task_id: Optional[str]) -> dict:
+    """
+    Warm up the created task if asked by the query arg `warmup=1`.
+
+    Returns:
+        response data, with the warm-up report if warmed up
+    """
+    if request.args.get('warmup') not in ('1', 'true'):
+        return {}
+    return {'warmup': videx_meta_singleton.warmup_task({'task_id': task_id})}
+
+
 @ns.route('/create_task_meta')
 class CreateTaskMeta(Resource):
-    @ns.doc('Create Task Meta')
-    @ns.expect(task_meta_model)
+    @ns.doc('Create Task Meta', description=f'Body is json or msgpack (Content-Type: {MSGPACK_MIMETYPE})',
+            params={'warmup': '1 to build all table models of the task in background, see /warmup_task'})
+    @ns.expect(task_meta_model, validate=False)
     @ns.response(200, 'Success', response_model)
     @ns.response(400, 'Validation Error')
     def post(self):
-        req_json_item = api.payload
+        req_json_item = read_payload(task_meta_model)
         global videx_meta_singleton
         videx_meta_singleton.add_task_meta(req_json_item)
     
-        code, message, response_data = 200, "OK", {}
-        return jsonify(code=code, message=message, data=response_data)
+        code, message, response_data = 200, "OK", warmup_after_create(req_json_item.get('task_id'))
+        return negotiated_response(code=code, message=message, data=response_data)
+
+
+@ns.route('/create_task_meta_stream')
+class CreateTaskMetaStream(Resource):
+    @ns.doc('Create Task Meta from a stream',
+            description='Body is ndjson (optionally gzip): a header line {"task_id", "db_config", '
+                        '"sample_file_info"}, then one line per table {"dbname", "table_name", "meta", "stats"}. '
+                        'With "merge": true and "drop_tables" in the header, the tables are merged into the task. '
+                        'See videx_ingest.',
+            params={'warmup': '1 to build all table models of the task in background, see /warmup_task'})
+    @ns.response(200, 'Success', response_model)
+    @ns.response(400, 'Malformed Stream')
+    @ns.response(413, 'Payload Too Large')
+    def post(self):
+        gzip_encoded = request.headers.get('Content-Encoding') == 'gzip'
+        st = time.perf_counter()
+        try:
+            chunks = iter_decompressed_chunks(request.stream, gzip_encoded,
+                                              max_bytes=app.config['VIDEX_MAX_DECOMPRESSED_BYTES'])
+            lines = iter_lines(chunks)
+            header = read_task_meta_header(lines)
+            task_stats = parse_task_meta_tables(header, lines)
+        except PayloadTooLargeException as e:
+            # same as before_request for the other routes
+            return {'code': 413, 'message': str(e), 'data': {}}, 413
+        except (RequestFormatException, ValueError, zlib.error) as e:
+            return {'code': 400, 'message': str(e), 'data': {}}, 400
+        parse_time = time.perf_counter() - st
+        data = {}
+        if header.get('merge'):
+            try:
+                data = videx_meta_singleton.merge_task_stats(task_stats, header.get('drop_tables'))
+            except KeyError as e:
+                return jsonify(code=404, message=f"Not Found: {e.args[0]}", data={})
+            except ValueError as e:
+                return jsonify(code=400, message=str(e), data={})
+        else:
+            videx_meta_singleton.add_task_stats(task_stats)
+
+        n_tables = sum(len(tables) for tables in task_stats.stats_dict.values())
+        logging.info(f"=== create task meta from stream: task_id={task_stats.task_id} {n_tables=} "
+                     f"merge={bool(header.get('merge'))} parse use {parse_time:.2f}s")
+        return jsonify(code=200, message="OK",
+                       data={'tables': n_tables, **data, **warmup_after_create(task_stats.task_id)})
+
+
+@ns.route('/task_content_hashes')
+class TaskContentHashes(Resource):
+    @ns.doc('Task Content Hashes', description='Content hashes of the tables of a task, so that a client uploads '
+                                               'only the changed tables by a delta stream, see VidexClient',
+            params={'task_id': 'task id, default is the non-task meta'})
+    @ns.response(200, 'Success', response_model)
+    def get(self):
+        return patch_task_meta_response(videx_meta_singleton.task_content_hashes,
+                                        {'task_id': request.args.get('task_id') or None})
+
+
+@ns.route('/warmup_task')
+class WarmupTask(Resource):
+    @ns.doc('Warm up Task', description='Build all table models of a task in background. '
+                                        'data is the warm-up report with build seconds of each table')
+    @ns.expect(warmup_task_model)
+    @ns.response(200, 'Success', response_model)
+    def post(self):
+        return patch_task_meta_response(videx_meta_singleton.warmup_task, request.get_json())
+
+    @ns.doc('Warm-up Report', params={'task_id': 'task id, default is the non-task meta'})
+    @ns.response(200, 'Success', response_model)
+    def get(self):
+        task_id = request.args.get('task_id') or None
+        report = videx_meta_singleton.warmup_report(task_id)
+        if report is None:
+            return jsonify(code=404, message=f"no warm-up of task {task_id}", data={})
+        return jsonify(code=200, message="OK", data=report)
+
+
+@ns.route('/prefetch_task')
+class PrefetchTask(Resource):
+    @ns.doc('Prefetch Task', description='Load tasks in background by load_meta_by_task_id_func or the task store. '
+                                         'data is task_id -> cached | loading | scheduled | unavailable')
+    @ns.expect(prefetch_task_model)
+    @ns.response(200, 'Success', response_model)
+    def post(self):
+        task_ids = request.get_json().get('task_ids') or []
+        return jsonify(code=200, message="OK", data=videx_meta_singleton.prefetch_tasks(task_ids))
 
 
 @ns.route('/clear_cache')
@@ -460,9 +1408,10 @@ class ClearCache(Resource):
     @ns.response(200, 'Success', response_model)
     def post(self):
         global videx_meta_singleton
-        videx_meta_singleton.clear_cache({})
-
-        code, message, response_data = 200, "OK", {}
+        try:
+            code, message, response_data = 200, "OK", videx_meta_singleton.clear_cache(request.get_json() or {})
+        except ValueError as e:
+            code, message, response_data = 400, str(e), {}
         return jsonify(code=code, message=message, data=response_data)
 
 
@@ -475,76 +1424,259 @@ class UpdateGTStats(Resource):
     def post(self):
         # 提供 gt 结果，用于测试 videx-py 的其他环节是否正确。这些 gt 可能由于算法无法完美贴合 innodb（多列 ndv、多列 rec_in_ranges），
         # 也可能是由于新建索引后一些统计量变化。
-        #
-        # 传入格式为：
-        #     req_dict = {
-        #         "task_id": task_id,
-        #         "gt_stats_file": load_json_from_file(expect_meta_files[0]),
-        #         "gt_ndv_mulcol_file": load_json_from_file(expect_meta_files[3]),
-        #         "gt_rec_in_ranges": gt_rec_in_ranges,  # 可能为空
-        #         "gt_req_resp": gt_req_resp,
-        #     }
-        # 注意，收集最耗时的 "hist_file", "ndv_single_file" 反倒不会因为建删索引而变化，因此 update_gt_stats 不需要传入这些
-        #
-        # Returns:
-        #     创建成功与否
-        raise NotImplementedError
+        # 注意，收集最耗时的 "hist_file", "ndv_single_file" 反倒不会因为建删索引而变化，因此通常只需传入 gt 相关的增量。
+        # 仅 patch 一张表的统计量，且只丢弃该表的 model，见 VidexSingleton.update_table_stats。
+        return patch_task_meta_response(videx_meta_singleton.update_table_stats, request.get_json())
 
 
 @ns.route('/set_task_variables')
 class SetTaskVariables(Resource):
     @ns.doc('set task variables')
+    @ns.expect(set_task_variables_model)
     @ns.response(200, 'Success', response_model)
     def post(self):
-        # 主要是指定某个 task 是否启用 gt 数据
-        raise NotImplementedError
+        # 设置某个 task 的变量（db_config），丢弃该 task 的所有 model
+        return patch_task_meta_response(videx_meta_singleton.set_task_variables, request.get_json())
+
+
+def patch_task_meta_response(patch_func: Callable[[dict], dict], req_dict: dict):
+    try:
+        code, message, response_data = 200, "OK", patch_func(req_dict)
+    except KeyError as e:
+        code, message, response_data = 404, f"Not Found: {e.args[0]}", {}
+    except ValueError as e:
+        code, message, response_data = 400, str(e), {}
+    return jsonify(code=code, message=message, data=response_data)
+
+
+def log_ask_summary(req_idx: int, task_id: Optional[str], req_json_item: dict, code: int, message: str,
+                    response_data: dict, elapsed_time: Optional[float], full_payload: bool = False):
+    """
+    Log a one-line summary of an ask request: func, task, table, index, latency and result.
+    Successful requests are sampled by videx_logging.request_log_policy, errors are always logged with payload.
+    """
+    is_error = code != 200
+    if not videx_logging.request_log_policy.sampled(req_idx, is_error):
+        return
+    level = logging.ERROR if is_error else logging.INFO
+    if not logging.getLogger().isEnabledFor(level):
+        return
+    properties = req_json_item.get('properties')
+    if not isinstance(properties, dict):
+        properties = {}
+    index_name = '-'
+    for item in req_json_item.get('data') or []:
+        if isinstance(item, dict) and 'index_name' in (item.get('properties') or {}):
+            index_name = item['properties']['index_name']
+            break
+    if is_error:
+        result = message
+    elif 'value' in response_data and len(response_data) == 1:
+        result = response_data['value']
+    else:
+        result = f"{len(response_data)} items"
+    latency = '-' if elapsed_time is None else f"{elapsed_time * 1000:.2f}ms"
+    logging.log(level, "[%s] == [code=%s] func=%s task=%s table=%s.%s index=%s use %s result=%s",
+                req_idx, code, videx_funcs.label(properties.get('function')), task_id,
+                properties.get('dbname'), properties.get('table_name'), index_name, latency, result)
+    if is_error or full_payload:
+        logging.log(level, "[%s] == request data: %s response data: %s", req_idx,
+                    videx_logging.LazyJsonDumps(req_json_item), videx_logging.LazyJsonDumps(response_data))
 
 
 @ns.route('/ask_videx')
 class AskVidex(Resource):
-    @ns.doc('Ask VIDEX')
-    @ns.expect(ask_videx_model)
+    @ns.doc('Ask VIDEX', description=f'Body and response are json, or msgpack by Content-Type and Accept: '
+                                     f'{MSGPACK_MIMETYPE}')
+    @ns.expect(ask_videx_model, validate=False)
     @ns.response(200, 'Success', response_model)
     @ns.response(400, 'Validation Error')
     @ns.response(404, 'Table Not Found')
     @ns.response(502, 'Bad Gateway')
     def post(self):
-        req_json_item = api.payload
+        req_json_item = read_payload(ask_videx_model)
         global videx_meta_singleton
         # global request_count
         # global resp_expect_dict
         
         # set task id
-        req_idx = videx_meta_singleton.request_count
+        req_idx = videx_meta_singleton.request_counter.incr()
         task_id = videx_meta_singleton.extract_task_id(req_json_item)
-        videx_meta_singleton.logging_package.set_thread_trace_id(f"<<{task_id}#{req_idx}>>")
-        videx_meta_singleton.request_count += 1
-        logging.info(f"[{req_idx}] ==== receive data, {json.dumps(req_json_item)}")
+        trace_id = f"<<{task_id}#{req_idx}>>"
+        videx_meta_singleton.logging_package.set_thread_trace_id(trace_id)
+        full_payload = videx_logging.request_log_policy.full_payload(task_id, trace_id)
+        if full_payload:
+            logging.info("[%s] ==== receive data, %s", req_idx, videx_logging.LazyJsonDumps(req_json_item))
 
         st = time.perf_counter()
-        code, message, response_data = videx_meta_singleton.ask(req_json_item)
+        with videx_meta_singleton.admit() as admitted:
+            if admitted:
+                code, message, response_data = videx_meta_singleton.ask(req_json_item)
+            else:
+                code, message, response_data = videx_meta_singleton.shed(req_json_item)
         elapsed_time = time.perf_counter() - st
-        
-        if code == 200:
-            logging.info(f"[{req_idx}] == [{code=}] use {elapsed_time:.2f}s response data: {json.dumps(response_data)}")
-        else:
-            logging.error(f"[{req_idx}] == [{code=}] use {elapsed_time:.2f}s {message=} "
-                          f"response data: ={json.dumps(response_data)}")
-        return jsonify(code=code, message=message, data=response_data)
+
+        log_ask_summary(req_idx, task_id, req_json_item, code, message, response_data, elapsed_time, full_payload)
+        return negotiated_response(code=code, message=message, data=response_data)
+
+
+@ns.route('/ask_videx_batch')
+class AskVidexBatch(Resource):
+    @ns.doc('Ask VIDEX in batch', description=f'Body and response are json, or msgpack by Content-Type and Accept: '
+                                              f'{MSGPACK_MIMETYPE}')
+    @ns.expect(ask_videx_batch_model, validate=False)
+    @ns.response(200, 'Success, data is the list of {code, message, data} in the same order of items', response_model)
+    @ns.response(400, 'Validation Error')
+    def post(self):
+        req_json_items = read_payload(ask_videx_batch_model)['items']
+        global videx_meta_singleton
+
+        req_idx = videx_meta_singleton.request_counter.incr()
+        task_id = videx_meta_singleton.extract_task_id(req_json_items[0]) if len(req_json_items) > 0 else None
+        trace_id = f"<<{task_id}#{req_idx}>>"
+        videx_meta_singleton.logging_package.set_thread_trace_id(trace_id)
+        full_payload = videx_logging.request_log_policy.full_payload(task_id, trace_id)
+
+        st = time.perf_counter()
+        with videx_meta_singleton.admit() as admitted:
+            if admitted:
+                results = videx_meta_singleton.ask_batch(req_json_items)
+            else:
+                results = [videx_meta_singleton.shed(item) for item in req_json_items]
+        elapsed_time = time.perf_counter() - st
+
+        n_error = sum(1 for code, _, _ in results if code != 200)
+        if videx_logging.request_log_policy.sampled(req_idx):
+            logging.info("[%s] == batch of %d items, %d errors, use %.2fms",
+                         req_idx, len(results), n_error, elapsed_time * 1000)
+        if n_error > 0 or full_payload:
+            for (code, message, response_data), item in zip(results, req_json_items):
+                if code != 200 or full_payload:
+                    log_ask_summary(req_idx, task_id, item, code, message, response_data, None, full_payload)
+        response_data = [{'code': code, 'message': message, 'data': data} for code, message, data in results]
+        return negotiated_response(code=200, message="OK", data=response_data)
+
+
+GET_STATS_PAGE_ARGS = ('task_id', 'db', 'table', 'offset', 'limit', 'fields', 'exclude', 'meta', 'stream', 'gzip')
+
+
+def iter_table_stats_json(db_task_stats: VidexDBTaskStats, tables: List[Tuple[str, str]],
+                          include: Optional[set] = None, exclude: Optional[set] = None,
+                          with_meta: bool = True) -> Iterator[bytes]:
+    """
+    Serialize tables one by one: {"dbname", "table_name", "meta", "stats"}, joined by ','.
+
+    Args:
+        include: fields of TableStatisticsInfo to keep, None means all
+        exclude: fields of TableStatisticsInfo to skip, e.g. histogram_dict, extra_info
+    """
+    sep = b''
+    for db_name, table_name in tables:
+        info = db_task_stats.get_table_stats_info(db_name, table_name)
+        meta = db_task_stats.get_table_meta(db_name, table_name)
+        if info is None:
+            continue
+        parts = [b'{"dbname":', json.dumps(db_name).encode('utf-8'),
+                 b',"table_name":', json.dumps(table_name).encode('utf-8')]
+        if with_meta:
+            parts += [b',"meta":', b'null' if meta is None else meta.to_json().encode('utf-8')]
+        parts += [b',"stats":', info.model_dump_json(include=include, exclude=exclude).encode('utf-8'), b'}']
+        yield sep + b''.join(parts)
+        sep = b','
 
 
 @ns.route('/videx/visualization/get_stats')
 class GetStats(Resource):
-    @ns.doc('get stats')
+    @ns.doc('get stats', params={
+        'task_id': 'task id, default is the non-task meta',
+        'db': 'only tables of this db',
+        'table': 'only this table',
+        'offset': 'pagination by table (sorted by db, table), default 0',
+        'limit': 'max number of tables, default all',
+        'fields': 'comma separated fields of table stats to return, e.g. ndv_dict,num_of_rows',
+        'exclude': 'comma separated fields of table stats to skip, e.g. histogram_dict,extra_info',
+        'meta': '0 to skip table meta',
+        'stream': '1 to stream the response table by table (chunked)',
+        'gzip': '1 to gzip the streamed response',
+    })
     @ns.response(200, 'Success', response_model)
     def get(self):
-        # 返回 videx_meta_singleton 当前的缓存大小。
-        non_task_cache: VidexTaskCache = videx_meta_singleton.non_task_cache
-        data_dict = {}
-        if non_task_cache is not None and non_task_cache.db_tasks_stats is not None:
-            data_dict = json.loads(non_task_cache.db_tasks_stats.to_json())
-        code, message, response_data = 200, "OK", {'stats': data_dict}
-        return jsonify(code=code, message=message, data=response_data)
+        args = request.args
+        if not any(k in args for k in GET_STATS_PAGE_ARGS):
+            # 返回 non-task 缓存的全部统计量（兼容旧格式）
+            non_task_cache: VidexTaskCache = videx_meta_singleton.non_task_cache
+            data_dict = {}
+            if non_task_cache is not None and non_task_cache.db_tasks_stats is not None:
+                data_dict = json.loads(non_task_cache.db_tasks_stats.to_json())
+            code, message, response_data = 200, "OK", {'stats': data_dict}
+            return jsonify(code=code, message=message, data=response_data)
+
+        task_id = args.get('task_id') or None
+        if VidexTaskStore.task_key(task_id) == NON_TASK_KEY:
+            task_id, task_cache = None, videx_meta_singleton.non_task_cache
+        else:
+            # peek, the dashboard doesn't keep a task alive
+            task_cache = videx_meta_singleton.cache.peek(task_id)
+        if task_cache is None or task_cache.db_tasks_stats is None:
+            return jsonify(code=404, message=f"task not found: {task_id}", data={})
+        try:
+            offset = int(args.get('offset', 0))
+            limit = int(args['limit']) if 'limit' in args else None
+        except ValueError as e:
+            return jsonify(code=400, message=f"invalid offset or limit: {e}", data={})
+        if offset < 0 or (limit is not None and limit < 0):
+            return jsonify(code=400, message=f"invalid offset or limit: {offset=} {limit=}, must be >= 0", data={})
+        include = set(args['fields'].split(',')) if args.get('fields') else None
+        exclude = set(args['exclude'].split(',')) if args.get('exclude') else None
+
+        db_task_stats = task_cache.db_tasks_stats
+        db_filter, table_filter = args.get('db', '').lower(), args.get('table', '').lower()
+        tables = sorted((db, tb) for db, tbs in db_task_stats.get_stats_info_keys().items() for tb in tbs
+                        if (not db_filter or db == db_filter) and (not table_filter or tb == table_filter))
+        page = tables[offset:] if limit is None else tables[offset:offset + limit]
+        head = json.dumps({'task_id': task_id, 'total': len(tables), 'offset': offset, 'limit': limit})
+        body_parts = iter_table_stats_json(db_task_stats, page, include, exclude, with_meta=args.get('meta') != '0')
+
+        def iter_body():
+            yield b'{"code":200,"message":"OK","data":' + head[:-1].encode('utf-8') + b',"tables":['
+            yield from body_parts
+            yield b']}}'
+
+        if args.get('stream') != '1':
+            return FlaskResponse(b''.join(iter_body()), mimetype='application/json')
+        headers = {}
+        body = iter_body()
+        if args.get('gzip') == '1':
+            body = iter_gzip(body)
+            headers['Content-Encoding'] = 'gzip'
+        return FlaskResponse(stream_with_context(body), mimetype='application/json', headers=headers)
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """
+    Metrics of this process in Prometheus text format.
+    """
+    gauges = []
+    if videx_meta_singleton is not None:
+        usage = videx_meta_singleton.memory_usage()
+        gauges = [
+            ('videx_requests_received', 'Number of ask requests received by the routes.',
+             videx_meta_singleton.request_count),
+            ('videx_cached_tasks', 'Number of tasks in the task cache.', len(videx_meta_singleton.cache)),
+            ('videx_cached_stats_bytes', 'Approximate bytes of cached task meta.',
+             sum(u['stats_bytes'] for u in usage.values())),
+            ('videx_cached_model_bytes', 'Approximate bytes of cached models.',
+             sum(u['model_bytes'] for u in usage.values())),
+        ]
+        if (admission := videx_meta_singleton.admission) is not None:
+            gauges += [
+                ('videx_requests_in_flight', 'Number of ask requests being served.', admission.in_flight),
+                ('videx_requests_shed', 'Number of ask requests rejected by admission control.',
+                 admission.rejected.value),
+            ]
+    return FlaskResponse(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
 
 @ns.route('/videx/visualization/status')
 class Status(Resource):
@@ -552,30 +1684,112 @@ class Status(Resource):
     @ns.response(200, 'Success', response_model)
     def get(self):
         # 返回 videx_meta_singleton 当前的缓存大小。
-        code, message, response_data = 200, "OK", {'cache': dict(videx_meta_singleton.cache)}
+        code, message, response_data = 200, "OK", {'cache': list(videx_meta_singleton.cache),
+                                                 'memory': videx_meta_singleton.memory_usage(),
+                                                 'response_cache': videx_meta_singleton.response_cache_stats()}
         return jsonify(code=code, message=message, data=response_data)
 
 
-def post_add_videx_meta(req: VidexDBTaskStats, videx_server_ip_port: str, use_gzip: bool):
+def post_add_videx_meta(req: VidexDBTaskStats, videx_server_ip_port: str, use_gzip: bool,
+                        use_msgpack: bool = False, warmup: bool = False):
+    """
+    Post task meta in one body, without retry. See VidexClient for retries and streamed upload of big tasks.
+
+    Args:
+        warmup: build all table models of the task in background after it's created
+        use_msgpack: send the task meta in msgpack instead of json, which is smaller and faster to decode.
+            It falls back to json if the meta has numbers out of the range of msgpack.
+    """
     # 1. 将 src_meta 导入videx-py
-    json_data = req.to_json().encode('utf-8')
-    if use_gzip:
-        # 转换 JSON 数据为字符串，并用 UTF-8 编码为 bytes
-        json_data = gzip.compress(json_data)  # 使用 gzip 进行压缩
-        headers = {'Content-Encoding': 'gzip', 'Content-Type': 'application/json'}
-    else:
-        headers = {'Content-Type': 'application/json'}
-    # send request
-    logging.info(f"post videx metadata to {videx_server_ip_port}")
-    return requests.post(f'http://{videx_server_ip_port}/create_task_meta', data=json_data, headers=headers)
+    with VidexClient(videx_server_ip_port, retries=0, timeout=None) as client:
+        return client.create_task_meta(req, use_gzip=use_gzip, use_msgpack=use_msgpack, warmup=warmup)
+
+
+def post_add_videx_meta_stream(req: VidexDBTaskStats, videx_server_ip_port: str, use_gzip: bool = True,
+                               warmup: bool = False):
+    """
+    Post task meta table by table to /create_task_meta_stream (chunked transfer), so that neither the client nor
+    the server holds the whole serialized payload in memory. See VidexClient for retries and upload progress.
+
+    Args:
+        warmup: build all table models of the task in background after it's created
+    """
+    with VidexClient(videx_server_ip_port, retries=0, timeout=None) as client:
+        return client.create_task_meta_stream(req, use_gzip=use_gzip, warmup=warmup)
+
+
+DDL_ENGINE_PATTERN = re.compile(r"ENGINE=\w+")
+DDL_SECONDARY_ENGINE_PATTERN = re.compile(r"SECONDARY_ENGINE=(\w+)")
+# the table name of CREATE TABLE, with its optional db qualifier
+DDL_CREATE_TABLE_PATTERN = re.compile(r"^(\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?)(?:(?:`[^`]+`|\w+)\.)?(?=`|\w)",
+                                      re.IGNORECASE)
+
+
+# the parent table of FOREIGN KEY ... REFERENCES, with its optional db qualifier
+DDL_REFERENCES_PATTERN = re.compile(r"(\bREFERENCES\s+)(?:(`[^`]+`|\w+)\.)?(`[^`]+`|\w+)", re.IGNORECASE)
+
+
+def ddl_referenced_tables(ddl: str, default_db: str) -> List[Tuple[str, str]]:
+    """
+    (db, table) of the parent tables of the foreign keys of a CREATE TABLE DDL, lower case.
+    """
+    return [((db or default_db).strip('`').lower(), table.strip('`').lower())
+            for _, db, table in DDL_REFERENCES_PATTERN.findall(ddl)]
+
+
+def rewrite_create_table_ddl(ddl: str, new_engine: str, target_db: str = None) -> str:
+    """
+    Rewrite the engine of a CREATE TABLE DDL, and qualify the table and the parent tables of its foreign keys
+    with target_db if given, so that the DDL can be executed on any connection whatever its default db is.
+    """
+    # remove secondary index
+    match = DDL_SECONDARY_ENGINE_PATTERN.search(ddl)
+    if match:
+        logging.warning(f"find SECONDARY_ENGINE={match.group(1)}, remove it from CREATE TABLE DDL")
+        ddl = DDL_SECONDARY_ENGINE_PATTERN.sub('', ddl)
+    ddl = DDL_ENGINE_PATTERN.sub(f"ENGINE={new_engine}", ddl)
+    if target_db is not None:
+        ddl, n = DDL_CREATE_TABLE_PATTERN.subn(lambda m: f"{m.group(1)}`{target_db}`.", ddl, count=1)
+        if n == 0:
+            raise ValueError(f"not a CREATE TABLE DDL: {ddl[:100]}")
+        # SHOW CREATE TABLE omits the db of a parent table in the same db
+        ddl = DDL_REFERENCES_PATTERN.sub(
+            lambda m: m.group(0) if m.group(2) else f"{m.group(1)}`{target_db}`.{m.group(3)}", ddl)
+    return ddl
+
+
+def order_by_foreign_keys(tables: List[Tuple[str, str, str]]) -> List[Tuple[str, str, str]]:
+    """
+    Order (db, table, ddl) so that a parent table is created before its children. Tables in a cycle of foreign
+    keys keep their original order.
+    """
+    keys = [(db.lower(), table.lower()) for db, table, _ in tables]
+    parents = {key: (set(ddl_referenced_tables(ddl, key[0])) & set(keys)) - {key}
+               for key, (_, _, ddl) in zip(keys, tables)}
+    ordered, created = [], set()
+    pending = list(zip(keys, tables))
+    while pending:
+        ready = [(key, table) for key, table in pending if parents[key] <= created]
+        if not ready:
+            # a cycle, the remaining tables fail unless foreign_key_checks is off
+            ready = pending
+        ordered += [table for _, table in ready]
+        created |= {key for key, _ in ready}
+        pending = [(key, table) for key, table in pending if key not in created]
+    return ordered
 
 
 def create_videx_env_multi_db(videx_env: Env,
                               meta_dict: dict,
                               new_engine: str = 'VIDEX',
-                              ):
+                              max_workers: int = 8,
+                              ) -> dict:
     """
     Specify a target database (`target_db`), retrieve metadata, and create it on the `videx_db` within the `videx_env`.
+    Databases, and then tables, are created by a pool of max_workers threads, each statement on a connection of
+    the pool of `videx_env`. Tables with foreign keys are created after the others, one by one with parent tables
+    first, since VIDEX checks foreign keys at CREATE TABLE.
+    A failed database or table is reported instead of aborting the others.
 
      Args:
         meta_dict: Dictionary containing metadata.
@@ -588,58 +1802,186 @@ def create_videx_env_multi_db(videx_env: Env,
             Element is a tuple of three: request json, response json, turn_on (whether to enable).
             If a request matches an enabled element, it returns directly.
         new_engine: Name of the engine to be created.
+        max_workers: number of DDLs executed at the same time, no more than the connection pool size of videx_env.
+            1 means executing them one by one in the calling thread.
     Returns:
-
+        dict: {"seconds": total seconds, "databases": {db: {"seconds"} or {"error"}},
+               "tables": {"db.table": {"seconds"} or {"error"}}, "failed": ["db" or "db.table"]}
     """
-    # Create a test database named after `target_db` in videx-db and save the table schema.
-    for target_db, table_dict in meta_dict.items():
-        videx_env.execute(f"DROP DATABASE IF EXISTS `{target_db}`")
-        videx_env.execute(f"CREATE DATABASE `{target_db}`")
+    st = time.perf_counter()
 
-        # `videx_env` might need to create tables in multiple databases;
-        # since DDL does not include db_name, switching is required.
-        # However, it should revert to the default_db after execution.
-        videx_default_db = videx_env.default_db
+    def timed(job: Tuple[str, Callable[[], None]]) -> dict:
+        name, func = job
+        t = time.perf_counter()
         try:
-            videx_env.set_default_db(target_db)
-            for table in table_dict.values():
-                create_table_ddl = re.sub(r"ENGINE=\w+", "ENGINE={}".format(new_engine), table.ddl)
-                # remove secondary index
-                match = re.search(r'SECONDARY_ENGINE=(\w+)', create_table_ddl)
-                if match:
-                    value = match.group(1)
-                    logging.warning(f"find SECONDARY_ENGINE={value}, remove it from CREATE TABLE DDL")
-                    create_table_ddl = re.sub(r'SECONDARY_ENGINE=\w+', '', create_table_ddl)
-                videx_env.execute(create_table_ddl)
-        finally:
-            videx_env.set_default_db(videx_default_db)
+            func()
+        except Exception as e:
+            logging.error(f"failed to create {name} in videx env: {e}")
+            return {'error': str(e)}
+        return {'seconds': round(time.perf_counter() - t, 6)}
+
+    def run(jobs: List[Tuple[str, Callable[[], None]]]) -> Dict[str, dict]:
+        if max_workers <= 1 or len(jobs) <= 1:
+            return {name: timed((name, func)) for name, func in jobs}
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs)), thread_name_prefix='videx_ddl') as executor:
+            return dict(zip([name for name, _ in jobs], executor.map(timed, jobs)))
+
+    def create_db(target_db: str):
+        videx_env.execute(f"DROP DATABASE IF EXISTS `{target_db}`")
+        videx_env.execute(f"CREATE DATABASE `{target_db}`")
 
+    def create_table(target_db: str, ddl: str):
+        videx_env.execute(rewrite_create_table_ddl(ddl, new_engine, target_db))
 
-def post_to_clear_videx_server_cache(videx_server: str, task_ids: List[str]) -> Response:
+    # Create a test database named after `target_db` in videx-db and save the table schema.
+    # DDLs are qualified by db instead of switching the default db of `videx_env`, which is shared by the workers.
+    databases = run([(target_db, functools.partial(create_db, target_db)) for target_db in meta_dict])
+    table_jobs, fk_tables = [], []
+    for target_db, table_dict in meta_dict.items():
+        if 'error' in databases[target_db]:
+            continue
+        for table_name, table in table_dict.items():
+            if DDL_REFERENCES_PATTERN.search(table.ddl):
+                fk_tables.append((target_db, table_name, table.ddl))
+            else:
+                table_jobs.append((f"{target_db}.{table_name}",
+                                   functools.partial(create_table, target_db, table.ddl)))
+    tables = run(table_jobs)
+    for target_db, table_name, ddl in order_by_foreign_keys(fk_tables):
+        tables[f"{target_db}.{table_name}"] = timed((f"{target_db}.{table_name}",
+                                                    functools.partial(create_table, target_db, ddl)))
+
+    failed = [name for results in (databases, tables) for name, result in results.items() if 'error' in result]
+    seconds = time.perf_counter() - st
+    logging.info(f"created {sum('error' not in r for r in tables.values())} tables in {len(databases)} databases "
+                 f"in {seconds:.2f}s, failed: {failed}")
+    return {'seconds': round(seconds, 6), 'databases': databases, 'tables': tables, 'failed': failed}
+
+
+def post_to_clear_videx_server_cache(videx_server: str, task_ids: List[str], scope: str = 'task',
+                                     tables: List[str] = None, purge_store: bool = False) -> Response:
     """Send a request to the specified server to clear the specified task IDs.
 
     Args:
         videx_server (str): ip:port
-        task_ids (List[str]): list of task id
+        task_ids (List[str]): list of task id, empty means all tasks
+        scope (str): "task" evicts the tasks, "table" discards the models of `tables`,
+            "model" discards all models of the tasks. Raw stats are kept in scope table and model.
+        tables (List[str]): list of "db.table", required by scope table
+        purge_store (bool): also delete the tasks from the task store of the server
 
     Returns:
-        _type_: _description_
+        Response: data of the response json reports what was evicted
     """
+    req = {"key_list": task_ids, "scope": scope, "purge_store": purge_store}
+    if tables is not None:
+        req["tables"] = tables
     resp = requests.post(f'http://{videx_server}/clear_cache',
-                         data=json.dumps({"key_list": task_ids}).encode('utf-8'),
+                         data=json.dumps(req).encode('utf-8'),
                          headers={'Content-Type': 'application/json'})
     return resp
 
 
+def post_update_videx_table_stats(videx_server: str, task_id: Optional[str], dbname: str, table_name: str,
+                                  **patch) -> Response:
+    """Send a small patch of one table's stats to the server, instead of re-posting the whole task meta.
+
+    Args:
+        videx_server (str): ip:port
+        patch: histograms, ndvs_single, ndvs_multi_col_gt, gt_rec_in_ranges, gt_req_resp,
+            see VidexSingleton.update_table_stats
+
+    Returns:
+        Response: data of the response json reports the patched fields and the discarded models
+    """
+    req = {"task_id": task_id, "dbname": dbname, "table_name": table_name, **patch}
+    return requests.post(f'http://{videx_server}/update_gt_stats',
+                         data=json.dumps(req).encode('utf-8'),
+                         headers={'Content-Type': 'application/json'})
+
+
+def post_set_videx_task_variables(videx_server: str, task_id: Optional[str], variables: Dict[str, str]) -> Response:
+    """Send variables of a task to the server, see VidexSingleton.set_task_variables.
+    """
+    return requests.post(f'http://{videx_server}/set_task_variables',
+                         data=json.dumps({"task_id": task_id, "variables": variables}).encode('utf-8'),
+                         headers={'Content-Type': 'application/json'})
+
+
+def init_videx_singleton(preload_store: bool = False, **kwargs) -> VidexSingleton:
+    """
+    Build the global VidexSingleton used by the routes. kwargs are passed to VidexSingleton.
+
+    Args:
+        preload_store: load all tasks in the task store into memory
+    """
+    global videx_meta_singleton
+    videx_meta_singleton = VidexSingleton(**kwargs)
+    if preload_store and videx_meta_singleton.task_store is not None:
+        videx_meta_singleton.preload_from_store()
+    return videx_meta_singleton
+
+
+# gunicorn listens on this port if the bind address has no port
+GUNICORN_DEFAULT_PORT = 8000
+
+
+def videx_server_address(bind: str) -> Optional[str]:
+    """
+    ip:port for @VIDEX_SERVER of VIDEX-MySQL from a bind address, e.g. "0.0.0.0:5001" -> "<local ip>:5001".
+    None for a unix socket, which VIDEX-MySQL cannot connect to.
+    """
+    if bind.startswith('unix:'):
+        return None
+    host, sep, port = bind.rpartition(':')
+    if not sep or not port.isdigit():
+        host, port = bind, str(GUNICORN_DEFAULT_PORT)
+    if host in ('', '0.0.0.0', '::', '[::]'):
+        host = get_local_ip()
+    return f"{host}:{port}"
+
+
 def startup_videx_server(
         port=5001,
         VidexModelClass: Type[VidexModelBase] = VidexModelInnoDB,
         load_meta_by_task_id_func: Callable[[str], VidexDBTaskStats] = None,
         start_ip="0.0.0.0", debug=False,
         logging_package=videx_logging,
+        workers: int = None,
+        threads: int = 1,
+        bind: str = None,
+        preload: bool = False,
+        task_store_dir: str = None,
+        preload_dir: str = None,
+        memory_budget_mb: float = None,
+        max_body_mb: float = None,
+        max_concurrent_loads: int = 4,
+        request_timeout: Optional[float] = DEFAULT_REQUEST_TIMEOUT,
+        max_in_flight: int = None,
         **model_kwargs,
 ):
     """
+    Start VIDEX statistic server. By default, it's served by the flask development server in one process.
+    If workers or bind is given, it's served by gunicorn with multiple worker processes (see videx_gunicorn).
+
+    Args:
+        workers: number of gunicorn worker processes
+        threads: number of threads in each gunicorn worker
+        bind: gunicorn bind address, "ip:port" or "unix:/path/to/videx.sock". Default is f"{start_ip}:{port}"
+        preload: load the app in gunicorn master before forking workers
+        task_store_dir: directory of the task store, which keeps task meta consistent across workers.
+            If not given in multi-worker mode, a temporary directory is used and removed at shutdown.
+        preload_dir: task store directory whose tasks are loaded into memory at startup (warm start).
+            It's used as task_store_dir if task_store_dir is not given.
+        memory_budget_mb: approximate memory budget of cached tasks and models of the whole server,
+            divided equally among gunicorn workers. None means unlimited.
+        max_body_mb: limit of the decompressed size of a request body, e.g. a gzip task meta.
+            Default is DEFAULT_MAX_DECOMPRESSED_BYTES.
+        max_concurrent_loads: max number of tasks loaded by load_meta_by_task_id_func at the same time in a worker.
+        request_timeout: deadline (seconds) of an ask request, after which cheap fallback estimations are used.
+        max_in_flight: max number of ask requests served at the same time in a worker, the others get 503 at once.
+            None means unlimited.
+
     curl --location --request POST 'http://127.0.0.1:5000/ask_videx' \
     --header 'Content-Type: application/json' \
     --data-raw '{
@@ -670,22 +2012,62 @@ def startup_videx_server(
     --header 'Content-Type: application/json' \
     --data-raw '{"item_type":"videx_request","properties":{"dbname":"tpcc","function":"virtual ha_rows ha_innobase::records_in_range(uint, key_range*, key_range*)","table_name":"ITEM","target_storage_engine":"INNODB"},"data":[{"item_type":"min_key","properties":{"index_name":"idx_I_IM_ID_I_PRICE","length":"7","operator":">"},"data":[{"item_type":"column_and_bound","properties":{"column":"I_IM_ID","value":"3"},"data":[]},{"item_type":"column_and_bound","properties":{"column":"I_PRICE","value":"2.00"},"data":[]}]},{"item_type":"max_key","properties":{"index_name":"idx_I_IM_ID_I_PRICE","length":"7","operator":">"},"data":[{"item_type":"column_and_bound","properties":{"column":"I_IM_ID","value":"3"},"data":[]},{"item_type":"column_and_bound","properties":{"column":"I_PRICE","value":"4.00"},"data":[]}]}]}'
     """
-    global videx_meta_singleton
-    videx_meta_singleton = VidexSingleton(
+    if preload_dir is not None:
+        if task_store_dir is not None and os.path.abspath(task_store_dir) != os.path.abspath(preload_dir):
+            raise ValueError(f"preload_dir must be the task store dir, but got {preload_dir=} {task_store_dir=}")
+        task_store_dir = preload_dir
+    temp_store_dir, master_pid = None, os.getpid()
+    if workers is not None and workers > 1 and task_store_dir is None:
+        task_store_dir = temp_store_dir = tempfile.mkdtemp(prefix='videx_task_store_')
+    task_store = VidexTaskStore(task_store_dir) if task_store_dir else None
+    if max_body_mb is not None:
+        app.config['VIDEX_MAX_DECOMPRESSED_BYTES'] = int(max_body_mb * 1024 ** 2)
+    cache_max_bytes = None
+    if memory_budget_mb is not None:
+        cache_max_bytes = int(memory_budget_mb * 1024 ** 2 / max(workers or 1, 1))
+    singleton_kwargs = dict(
+        preload_store=preload_dir is not None,
         VidexModelClass=VidexModelClass,
         load_meta_by_task_id_func=load_meta_by_task_id_func,
         logging_package=logging_package,
+        task_store=task_store,
+        cache_max_bytes=cache_max_bytes,
+        max_concurrent_loads=max_concurrent_loads,
+        request_timeout=request_timeout,
+        max_in_flight=max_in_flight,
         **model_kwargs,
     )
+    use_gunicorn = workers is not None or bind is not None
+    if use_gunicorn:
+        logging_package.initial_config()
+    else:
+        init_videx_singleton(**singleton_kwargs)
+
+    bind = (bind or f"{start_ip}:{port}") if use_gunicorn else f"{start_ip}:{port}"
+    server_address = videx_server_address(bind)
+    if server_address is None:
+        usage = f"It's served on {bind}, please connect by an ip:port bind, e.g. through a proxy.\n"
+    else:
+        usage = (f"To use VIDEX, please set the following variables before explaining your SQL:\n"
+                 f"SET @VIDEX_SERVER='{server_address}';\n")
 
     # Start the service.
     logging.info(f"\n{'- ' * 30}\n"
                  f"VIDEX statistic server has been started.\n"
-                 f"Current ModelClass: {videx_meta_singleton.VidexModelClass.__name__}\n"
-                 f"To use VIDEX, please set the following variables before explaining your SQL:\n"
-                 f"SET @VIDEX_SERVER='{get_local_ip()}:{port}';\n"
+                 f"Current ModelClass: {VidexModelClass.__name__}\n"
+                 f"Task store: {task_store_dir}{' (temporary, removed at shutdown)' if temp_store_dir else ''}\n"
+                 f"{usage}"
                  f"{'- ' * 30}\n"
                  )
 
-    app.run(debug=debug, threaded=True, host=start_ip, port=port, use_reloader=False)
-
+    try:
+        if use_gunicorn:
+            from sub_platforms.sql_opt.videx.videx_gunicorn import run_videx_gunicorn_server
+            run_videx_gunicorn_server(app, functools.partial(init_videx_singleton, **singleton_kwargs),
+                                      bind=bind, workers=workers or 1, threads=threads, preload=preload)
+        else:
+            app.run(debug=debug, threaded=True, host=start_ip, port=port, use_reloader=False)
+    finally:
+        # gunicorn workers are forked here and exit by SystemExit, only the master removes the store
+        if temp_store_dir is not None and os.getpid() == master_pid:
+            shutil.rmtree(temp_store_dir, ignore_errors=True)
@@ -0,0 +1,129 @@
+"""
+Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+SPDX-License-Identifier: MIT
+"""
+import contextlib
+import fcntl
+import gzip
+import json
+import os
+import tempfile
+import time
+from typing import Optional, Tuple, List
+from urllib.parse import quote, unquote
+
+from sub_platforms.sql_opt.videx.videx_metadata import VidexDBTaskStats
+
+# the key of task meta without task_id (non-task cache)
+NON_TASK_KEY = '__non_task__'
+TASK_FILE_SUFFIX = '.json.gz'
+# format version of the snapshot file, increase it if the format is changed incompatibly
+SNAPSHOT_FORMAT_VERSION = 1
+
+# version of a stored task, changes every time the task is saved: (st_mtime_ns, st_ino)
+StoreVersion = Tuple[int, int]
+
+
+class VidexTaskStore:
+    """
+    A directory of per-task snapshots, one gzip file for each task. A snapshot file is a header line
+    (format version, task_id, saved time) followed by the task meta json.
+
+    It's used to warm start the server, and can be shared by multiple server processes (e.g. gunicorn workers)
+    to keep task meta consistent: a snapshot is written by replacing the file atomically, and readers compare
+    the version of the file to find out if their in-memory task is stale.
+    Evicting a task from memory doesn't delete its snapshot, use delete() explicitly.
+
+    N.B. sample_data (pd.DataFrame) in TableStatisticsInfo is excluded from the snapshot.
+    """
+
+    def __init__(self, store_dir: str, compress_level: int = 6):
+        self.store_dir = store_dir
+        self.compress_level = compress_level
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    @staticmethod
+    def task_key(task_id: Optional[str]) -> str:
+        if task_id is None or task_id == 'None' or task_id == '':
+            return NON_TASK_KEY
+        return task_id
+
+    def path_of(self, task_id: Optional[str]) -> str:
+        return os.path.join(self.store_dir, quote(self.task_key(task_id), safe='') + TASK_FILE_SUFFIX)
+
+    def list_task_keys(self) -> List[str]:
+        return [unquote(name[:-len(TASK_FILE_SUFFIX)]) for name in sorted(os.listdir(self.store_dir))
+                if name.endswith(TASK_FILE_SUFFIX)]
+
+    def version(self, task_id: Optional[str]) -> Optional[StoreVersion]:
+        try:
+            st = os.stat(self.path_of(task_id))
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_ino
+
+    def save(self, stats: VidexDBTaskStats, task_id: str = None) -> StoreVersion:
+        """
+        Args:
+            stats: task meta to save
+            task_id: key of the task, use stats.task_id by default
+        """
+        task_id = task_id or stats.task_id
+        path = self.path_of(task_id)
+        fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix='.tmp')
+        try:
+            header = {'format_version': SNAPSHOT_FORMAT_VERSION, 'task_id': task_id, 'saved_at': time.time()}
+            with os.fdopen(fd, 'wb') as f, gzip.GzipFile(fileobj=f, mode='wb', compresslevel=self.compress_level) as gz:
+                gz.write(json.dumps(header).encode('utf-8'))
+                gz.write(b'\n')
+                gz.write(stats.to_json().encode('utf-8'))
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return self.version(task_id)
+
+    def load(self, task_id: Optional[str]) -> Tuple[Optional[VidexDBTaskStats], Optional[StoreVersion]]:
+        """
+        Returns:
+            (task stats, version), or (None, None) if the task is not in the store
+        """
+        path = self.path_of(task_id)
+        try:
+            with open(path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                raw = f.read()
+        except FileNotFoundError:
+            return None, None
+        header_line, _, body = gzip.decompress(raw).partition(b'\n')
+        header = json.loads(header_line)
+        if header.get('format_version') != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"unsupported task snapshot format version: {header.get('format_version')}, "
+                             f"expect {SNAPSHOT_FORMAT_VERSION}. {path=}")
+        stats = VidexDBTaskStats.from_json(body)
+        return stats, (st.st_mtime_ns, st.st_ino)
+
+    def delete(self, task_id: Optional[str]) -> bool:
+        try:
+            os.remove(self.path_of(task_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def clear(self):
+        for key in self.list_task_keys():
+            self.delete(key)
+
+    @contextlib.contextmanager
+    def locked(self, task_id: Optional[str]):
+        """
+        Inter-process lock of one task, used for read-merge-write of a task (e.g. non-task meta).
+        """
+        lock_path = self.path_of(task_id) + '.lock'
+        with open(lock_path, 'a') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
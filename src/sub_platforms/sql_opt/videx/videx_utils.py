@@ -11,7 +11,7 @@ import re
 import socket
 from collections import defaultdict
 from dataclasses import dataclass, field
-from datetime import datetime
+from datetime import datetime, timedelta
 from enum import Enum
 from typing import List, Dict, Union, Tuple, Set, Optional
 
@@ -814,6 +814,18 @@ def reformat_datetime_str(datetime_input: Union[str, int], fmt='%Y-%m-%d %H:%M:%
     return datetime.strftime(parse_datetime(datetime_input), fmt)
 
 
+ISO_DATETIME_PATTERN = re.compile(r"(\d{4})-(\d{2})-(\d{2})(?:[ T](\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?)?")
+EPOCH = datetime(1970, 1, 1)
+MICROSECONDS_PER_DAY = 86_400_000_000
+
+
+def datetime_to_epoch_us(dt: datetime) -> int:
+    """
+    microseconds since 1970-01-01 of a naive datetime
+    """
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
 def parse_datetime(datetime_input: Union[str, int]) -> datetime:
     """
     Convert a string or an integer to a datetime object. It can handle MySQL date and datetime formats,
@@ -828,6 +840,15 @@ def parse_datetime(datetime_input: Union[str, int]) -> datetime:
     if isinstance(datetime_input, str):
         datetime_str = datetime_input.strip('\'"')
 
+        # fast path of the zero-padded ISO formats, which are the same as the strptime formats below
+        if (m := ISO_DATETIME_PATTERN.fullmatch(datetime_str)) is not None:
+            year, month, day, hour, minute, second, fraction = m.groups()
+            try:
+                return datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0),
+                                int(fraction.ljust(6, '0')) if fraction else 0)
+            except ValueError:
+                pass
+
         try:
             datetime_int = int(datetime_str)
             return parse_timestamp(datetime_int)
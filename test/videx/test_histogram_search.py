@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+SPDX-License-Identifier: MIT
+"""
+import datetime
+import random
+import re
+from decimal import Decimal
+import unittest
+
+import numpy as np
+import pandas as pd
+from pydantic import ValidationError
+
+from sub_platforms.sql_opt.databases.mysql.mysql_command import MySQLVersion
+from sub_platforms.sql_opt.meta import Column, Table
+from sub_platforms.sql_opt.videx.videx_histogram import HistogramBucket, HistogramStats, HistogramBuckets, \
+    generate_table_histograms_by_sample, build_histogram_from_column_sample
+from sub_platforms.sql_opt.videx.videx_memory import approx_sizeof, estimate_histogram_bytes
+from sub_platforms.sql_opt.videx.videx_utils import BTreeKeySide
+
+
+def _build_int_histogram(database_type: str, n_buckets: int = 50, seed: int = 0) -> HistogramStats:
+    rnd = random.Random(seed)
+    buckets = []
+    lo, cum = 0, 0
+    for i in range(n_buckets):
+        # random gaps and single-value buckets
+        lo += rnd.choice([0, 1, 3])
+        hi = lo + rnd.choice([0, 0, 2, 10])
+        cum += rnd.randint(1, 10)
+        buckets.append(dict(min_value=lo, max_value=hi, cum_freq=cum, row_count=max(1, hi - lo + 1)))
+        lo = hi + 1
+    for b in buckets:
+        b['cum_freq'] = b['cum_freq'] / cum * 0.9
+    return HistogramStats(buckets=[HistogramBucket(**b) for b in buckets], data_type='int', histogram_type='equi-height',
+                          null_values=0.1, database_type=database_type)
+
+
+class TestHistogramBinarySearch(unittest.TestCase):
+    """
+    binary search must return exactly what the linear scan returns
+    """
+
+    def _assert_same_as_linear(self, hist: HistogramStats, values):
+        for v in values:
+            for side in [BTreeKeySide.left, BTreeKeySide.right]:
+                fast = hist.find_nearest_key_pos(v, side)
+                hist._bounds_sorted = False
+                try:
+                    slow = hist.find_nearest_key_pos(v, side)
+                finally:
+                    hist._bounds_sorted = True
+                self.assertEqual(fast, slow, f"{v=}, {side=}")
+
+    def test_int_mysql(self):
+        hist = _build_int_histogram('mysql')
+        self.assertTrue(hist._bounds_sorted)
+        self._assert_same_as_linear(hist, list(range(-2, hist.buckets[-1].max_value + 3)))
+
+    def test_int_mariadb(self):
+        # the gap values make both the scan and the search fail in MariaDB mode, skip them
+        hist = _build_int_histogram('mariadb', seed=1)
+        values = [v for v in range(-2, hist.buckets[-1].max_value + 3)
+                  if v < hist.buckets[0].min_value or v > hist.buckets[-1].max_value
+                  or hist._search_bucket_linear(v)[0] is not None]
+        self._assert_same_as_linear(hist, values)
+
+    def test_string_singleton(self):
+        hist = HistogramStats(buckets=[
+            HistogramBucket(min_value='b', max_value='b', cum_freq=0.2, row_count=1),
+            HistogramBucket(min_value='d', max_value='d', cum_freq=0.5, row_count=1),
+            HistogramBucket(min_value='f', max_value='f', cum_freq=1, row_count=1),
+        ], data_type='varchar', histogram_type='singleton')
+        self._assert_same_as_linear(hist, ['a', 'b', 'c', 'd', 'e', 'f', 'g'])
+
+    def test_string_offset(self):
+        hist = HistogramStats(buckets=[
+            HistogramBucket(min_value='a', max_value='c', cum_freq=0.5, row_count=3),
+            HistogramBucket(min_value='e', max_value='g', cum_freq=1, row_count=3),
+        ], data_type='varchar', histogram_type='equi-height')
+        self._assert_same_as_linear(hist, ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h'])
+        # value in the middle of a bucket takes 0.5
+        self.assertAlmostEqual(hist.find_nearest_key_pos('b', BTreeKeySide.left), 0.25)
+
+
+class TestHistogramBatchSearch(unittest.TestCase):
+    """
+    the vectorized search must return exactly what find_nearest_key_pos returns
+    """
+
+    def _assert_same_as_scalar(self, hist: HistogramStats, values):
+        sides = [BTreeKeySide.left, BTreeKeySide.right] * len(values)
+        values = [v for v in values for _ in range(2)]
+        batch = hist.find_nearest_key_pos_batch(values, sides)
+        for v, side, pos in zip(values, sides, batch.tolist()):
+            self.assertEqual(pos, hist.find_nearest_key_pos(v, side), f"{v=}, {side=}")
+
+    def test_int(self):
+        hist = _build_int_histogram('mysql')
+        self.assertIsNotNone(hist._np_bounds)
+        values = [str(v) for v in range(-2, hist.buckets[-1].max_value + 3)] + [None, '7.0']
+        self._assert_same_as_scalar(hist, values)
+
+    def test_float(self):
+        rnd = random.Random(2)
+        bounds = sorted(rnd.uniform(-100, 100) for _ in range(40))
+        hist = HistogramStats(buckets=[
+            HistogramBucket(min_value=bounds[i], max_value=bounds[i + 1], cum_freq=(i // 2 + 1) / 20, row_count=5)
+            for i in range(0, 40, 2)], data_type='double', histogram_type='equi-height', null_values=0)
+        values = [str(rnd.uniform(-120, 120)) for _ in range(300)] + [str(b) for b in bounds]
+        self._assert_same_as_scalar(hist, values)
+
+    def test_not_numeric(self):
+        hist = HistogramStats(buckets=[
+            HistogramBucket(min_value='a', max_value='c', cum_freq=0.5, row_count=3),
+            HistogramBucket(min_value='e', max_value='g', cum_freq=1, row_count=3),
+        ], data_type='varchar', histogram_type='equi-height')
+        self.assertIsNone(hist._np_bounds)
+        self._assert_same_as_scalar(hist, ['a', 'b', 'd', 'h'])
+
+    def test_range_key_pos(self):
+        hist = _build_int_histogram('mysql')
+        min_pos, max_pos = hist.find_range_key_pos(['3', None, '5'], [BTreeKeySide.left, None, BTreeKeySide.right],
+                                                   ['3', '8', None], [BTreeKeySide.right, BTreeKeySide.left, None])
+        self.assertEqual(min_pos.tolist(), [hist.find_nearest_key_pos('3', BTreeKeySide.left), 0,
+                                            hist.find_nearest_key_pos('5', BTreeKeySide.right)])
+        self.assertEqual(max_pos.tolist(), [hist.find_nearest_key_pos('3', BTreeKeySide.right),
+                                            hist.find_nearest_key_pos('8', BTreeKeySide.left), 1])
+
+
+class TestTemporalHistogram(unittest.TestCase):
+    """
+    epoch bounds must give exactly what the datetime strings give
+    """
+
+    def _assert_same_as_strings(self, hist: HistogramStats, values):
+        self.assertTrue(hist._epoch_bounds)
+        fast = [hist.find_nearest_key_pos(v, side) for v in values for side in [BTreeKeySide.left, BTreeKeySide.right]]
+        hist._min_values = [b.min_value for b in hist.buckets]
+        hist._max_values = [b.max_value for b in hist.buckets]
+        hist._epoch_bounds = False
+        slow = [hist.find_nearest_key_pos(v, side) for v in values for side in [BTreeKeySide.left, BTreeKeySide.right]]
+        self.assertEqual(fast, slow)
+
+    def test_date(self):
+        hist = HistogramStats(buckets=[
+            HistogramBucket(min_value='1992-01-02', max_value='1993-06-30', cum_freq=0.3, row_count=500),
+            HistogramBucket(min_value='1993-07-02', max_value='1993-07-02', cum_freq=0.4, row_count=1),
+            HistogramBucket(min_value='1993-07-05', max_value='1998-12-01', cum_freq=1, row_count=1900),
+        ], data_type='date', histogram_type='equi-height')
+        values = ['1991-12-31', '1992-01-02', "'1993-01-15'", '1993-07-01', '1993-07-02', '1995-03-04 12:00:00',
+                  '1998-12-01', '1999-01-01', '0000-00-00']
+        self._assert_same_as_strings(hist, values)
+
+    def test_datetime(self):
+        hist = HistogramStats(buckets=[
+            HistogramBucket(min_value='2024-01-01 00:00:00', max_value='2024-01-01 12:00:00.5',
+                            cum_freq=0.5, row_count=1000),
+            HistogramBucket(min_value='2024-01-02 00:00:00', max_value='2024-03-01 00:00:00',
+                            cum_freq=1, row_count=1000),
+        ], data_type='datetime', histogram_type='equi-height', null_values=0.1)
+        values = ['2023-12-31 23:59:59', '2024-01-01 00:00:00', '2024-01-01T06:30:00.25', '2024-01-01 18:00:00',
+                  '2024-02-01', '2024-03-01 00:00:00', '2025-01-01']
+        self._assert_same_as_strings(hist, values)
+
+
+class TestColumnarBuckets(unittest.TestCase):
+    def _assert_round_trip(self, hist: HistogramStats):
+        self.assertIsInstance(hist.buckets, HistogramBuckets)
+        restored = HistogramStats.from_json(hist.to_json())
+        self.assertEqual(restored.to_json(), hist.to_json())
+        self.assertEqual(restored.buckets, hist.buckets)
+        self.assertEqual(list(hist.buckets)[1:], hist.buckets[1:])
+
+    def test_round_trip(self):
+        self._assert_round_trip(_build_int_histogram('mysql'))
+        self._assert_round_trip(HistogramStats(buckets=[
+            HistogramBucket(min_value='a', max_value='c', cum_freq=0.5, row_count=3),
+            HistogramBucket(min_value='e', max_value='中文', cum_freq=1, row_count=3),
+        ], data_type='varchar', histogram_type='equi-height'))
+        self._assert_round_trip(HistogramStats(buckets=[
+            HistogramBucket(min_value=1, max_value=2 ** 70, cum_freq=1, row_count=3)], data_type='bigint',
+            histogram_type='equi-height'))
+        self._assert_round_trip(HistogramStats.init_all_null_histogram('int'))
+
+    def test_read_only(self):
+        hist = _build_int_histogram('mysql')
+        bucket = hist.buckets[0]
+        with self.assertRaises(ValidationError):
+            bucket.cum_freq = 0.1
+        with self.assertRaises(TypeError):
+            hist.buckets[0] = bucket
+        self.assertEqual(hist.buckets[0], bucket)
+        self.assertEqual(HistogramBucket(**bucket.model_dump()), bucket)
+        self.assertEqual(bucket, HistogramBucket(**bucket.model_dump()))
+        self.assertNotEqual(bucket, hist.buckets[1])
+        self.assertEqual(bucket.to_dict(), HistogramBucket(**bucket.model_dump()).to_dict())
+
+    def test_memory(self):
+        # 10x smaller than a HistogramBucket per bucket
+        for hist in [_build_int_histogram('mysql', n_buckets=1024),
+                     HistogramStats(buckets=[HistogramBucket(min_value=f'value_{i:05d}', max_value=f'value_{i:05d}z',
+                                                             cum_freq=(i + 1) / 1024, row_count=10)
+                                             for i in range(1024)], data_type='varchar',
+                                    histogram_type='equi-height')]:
+            self.assertLess(estimate_histogram_bytes(hist) * 10, approx_sizeof(list(hist.buckets)))
+
+
+class _FakeTableEnv:
+    """
+    answers the queries of generate_table_histograms_by_sample from a dataframe
+    """
+
+    def __init__(self, df: pd.DataFrame, data_types: dict):
+        self.df = df
+        self.data_types = data_types
+        self.sqls = []
+
+    def get_version(self):
+        return MySQLVersion.MySQL_8
+
+    def get_table_meta(self, db_name, table_name):
+        return Table(name=table_name, db=db_name,
+                     columns=[Column(name=name, data_type=t) for name, t in self.data_types.items()])
+
+    def query_for_dataframe(self, sql):
+        self.sqls.append(sql)
+        if sql.startswith('SELECT COUNT(1)'):
+            row = {'total_rows': len(self.df)}
+            for agg, name, alias in re.findall(r'(COUNT|MIN|MAX)\(`(\w+)`\) AS (\w+)', sql):
+                row[alias] = {'COUNT': self.df[name].count, 'MIN': self.df[name].min, 'MAX': self.df[name].max}[agg]()
+            return pd.DataFrame([row])
+        names = re.findall(r'`(\w+)` AS (c_\d+)', sql)
+        return self.df[[name for name, _ in names]].set_axis([alias for _, alias in names], axis=1)
+
+
+class TestTableSampleHistogram(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(0)
+        n = 1000
+        self.df = pd.DataFrame({
+            'status': [rnd.choice([1, 2, 3, None]) for _ in range(n)],
+            'score': [rnd.random() * 100 for _ in range(n)],
+            'name': [f'user_{rnd.randint(0, 500):04d}' for _ in range(n)],
+            'empty': [None] * n,
+        })
+        self.env = _FakeTableEnv(self.df, {'status': 'int', 'score': 'double', 'name': 'varchar', 'empty': 'int'})
+
+    def test_queries_per_table(self):
+        hists = generate_table_histograms_by_sample(self.env, 'db', 'tb', n_buckets=16)
+        self.assertEqual(2, len(self.env.sqls))
+        self.assertEqual({'status', 'score', 'name', 'empty'}, set(hists))
+        self.assertTrue(all(hist is not None for hist in hists.values()))
+        self.assertEqual(1, hists['empty'].null_values)
+
+    def test_singleton(self):
+        hist = generate_table_histograms_by_sample(self.env, 'db', 'tb', n_buckets=16, col_names=['status'])['status']
+        self.assertEqual('singleton', hist.histogram_type)
+        counts = self.df['status'].value_counts().sort_index()
+        self.assertEqual([1, 2, 3], [b.min_value for b in hist.buckets])
+        np.testing.assert_allclose([b.cum_freq for b in hist.buckets], counts.cumsum() / len(self.df))
+        self.assertAlmostEqual(self.df['status'].isna().mean(), hist.null_values)
+
+    def test_equi_height(self):
+        hists = generate_table_histograms_by_sample(self.env, 'db', 'tb', n_buckets=16, col_names=['score', 'name'])
+        for name, hist in hists.items():
+            col = self.df[name]
+            self.assertEqual('equi-height', hist.histogram_type)
+            self.assertEqual(16, len(hist.buckets))
+            self.assertEqual(col.min(), hist.buckets[0].min_value)
+            self.assertEqual(col.max(), hist.buckets[-1].max_value)
+            self.assertAlmostEqual(1, hist.buckets[-1].cum_freq)
+            for b in hist.buckets:
+                in_bucket = col[(col >= b.min_value) & (col <= b.max_value)]
+                self.assertAlmostEqual((col <= b.max_value).mean(), b.cum_freq)
+                self.assertEqual(in_bucket.nunique(), b.row_count)
+
+    def test_sampled_singleton(self):
+        # a sample with few distinct values is not the whole column
+        hist = build_histogram_from_column_sample([1] * 990 + [2] * 10, 'int', 64, 0., min_value=1,
+                                                  max_value=100000, sampling_rate=0.001)
+        self.assertEqual('equi-height', hist.histogram_type)
+        self.assertEqual([(1, 1, 1), (2, 100000, 2)], [(b.min_value, b.max_value, b.row_count) for b in hist.buckets])
+        # unless the ndv is known
+        hist = build_histogram_from_column_sample([1] * 990 + [2] * 10, 'int', 64, 0., min_value=1, max_value=2,
+                                                  sampling_rate=0.001, ndv=2)
+        self.assertEqual('singleton', hist.histogram_type)
+
+    def test_temporal_and_decimal(self):
+        df = pd.DataFrame({
+            'created': pd.date_range('2024-01-01', periods=100, freq='6h').insert(0, pd.NaT),
+            'day': [datetime.date(2024, 1, i % 5 + 1) for i in range(101)],
+            'price': [Decimal(i) / 8 for i in range(100)] + [Decimal('1E+3')],
+        })
+        env = _FakeTableEnv(df, {'created': 'datetime', 'day': 'date', 'price': 'decimal'})
+        hists = generate_table_histograms_by_sample(env, 'db', 'tb', n_buckets=8)
+
+        created = hists['created']
+        self.assertEqual('equi-height', created.histogram_type)
+        self.assertEqual('2024-01-01 00:00:00.000000', created.buckets[0].min_value)
+        self.assertEqual('2024-01-25 18:00:00.000000', created.buckets[-1].max_value)
+        self.assertAlmostEqual(1 / 101, created.null_values)
+        self.assertEqual(100, sum(b.row_count for b in created.buckets))
+
+        day = hists['day']
+        self.assertEqual('singleton', day.histogram_type)
+        self.assertEqual([f'2024-01-0{i} 00:00:00.000000' for i in range(1, 6)], [b.min_value for b in day.buckets])
+
+        price = hists['price']
+        self.assertEqual('equi-height', price.histogram_type)
+        self.assertEqual((0, 1000), (price.buckets[0].min_value, price.buckets[-1].max_value))
+        # round trip of the bucket strings
+        self.assertEqual(price.to_json(), HistogramStats.from_json(price.to_json()).to_json())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,909 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+SPDX-License-Identifier: MIT
+"""
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+
+import msgpack
+from werkzeug.serving import make_server
+from werkzeug.wsgi import get_input_stream
+
+from sub_platforms.sql_opt.common.exceptions import PayloadTooLargeException, RequestFormatException
+from sub_platforms.sql_opt.meta import Table
+from sub_platforms.sql_opt.videx import videx_service, videx_logging
+from sub_platforms.sql_opt.videx.videx_client import VidexClient
+from sub_platforms.sql_opt.videx.videx_ingest import dump_task_meta_stream, parse_task_meta_stream, iter_lines, \
+    iter_decompressed_chunks
+from sub_platforms.sql_opt.videx.model.videx_model_innodb import VidexModelInnoDB
+from sub_platforms.sql_opt.videx.videx_concurrency import AdmissionControl
+from sub_platforms.sql_opt.videx.videx_deadline import request_deadline, deadline_expired, mark_degraded, \
+    current_deadline
+from sub_platforms.sql_opt.videx.videx_dispatch import parse_func_id, videx_funcs
+from sub_platforms.sql_opt.videx.videx_histogram import HistogramBucket, HistogramStats
+from sub_platforms.sql_opt.videx.videx_metadata import construct_videx_task_meta_from_local_files, VidexDBTaskStats
+from sub_platforms.sql_opt.videx.videx_metrics import metrics
+from sub_platforms.sql_opt.videx.videx_service import VidexSingleton, VidexTaskCache, create_videx_env_multi_db, \
+    rewrite_create_table_ddl, ddl_referenced_tables, videx_server_address
+from sub_platforms.sql_opt.videx.videx_task_store import VidexTaskStore
+from sub_platforms.sql_opt.videx.videx_utils import load_json_from_file, get_local_ip
+
+
+def build_rr_request(videx_db: str, task_id: str, column: str, value: str, index_name: str) -> dict:
+    """
+    records_in_range request of `column = value`
+    """
+    return {'item_type': 'videx_request',
+            'properties': {'dbname': videx_db,
+                           'function': 'virtual ha_rows ha_videx::records_in_range(uint, key_range*, key_range*)',
+                           'table_name': 'ITEM', 'target_storage_engine': 'INNODB',
+                           'videx_options': json.dumps({"task_id": task_id})},
+            "data": [{"item_type": "min_key", "properties": {"index_name": index_name, "length": "3",
+                                                             "operator": "="},
+                      "data": [{"item_type": "column_and_bound",
+                                "properties": {"column": column, "value": value}, "data": []}]},
+                     {"item_type": "max_key", "properties": {"index_name": index_name, "length": "3",
+                                                             "operator": ">"},
+                      "data": [{"item_type": "column_and_bound",
+                                "properties": {"column": column, "value": value}, "data": []}]}]}
+
+
+class VidexServiceTestBase(unittest.TestCase):
+    def setUp(self):
+        hist_dict = {
+            'ITEM': {
+                "I_PRICE": HistogramStats(
+                    buckets=[
+                        HistogramBucket(min_value=1, max_value=3, cum_freq=0.6, row_count=60),
+                        HistogramBucket(min_value=4, max_value=4, cum_freq=0.8, row_count=20),
+                        HistogramBucket(min_value=5, max_value=6, cum_freq=1, row_count=20)
+                    ],
+                    data_type="decimal", null_values=0., histogram_type="basic"),
+                "I_IM_ID": HistogramStats(
+                    buckets=[
+                        HistogramBucket(min_value=1, max_value=1, cum_freq=0.25, row_count=1),
+                        HistogramBucket(min_value=2, max_value=2, cum_freq=0.5, row_count=1),
+                        HistogramBucket(min_value=3, max_value=3, cum_freq=0.75, row_count=1),
+                        HistogramBucket(min_value=4, max_value=4, cum_freq=1, row_count=1),
+                    ],
+                    data_type="int", null_values=0., histogram_type="basic")
+            }
+        }
+        self.raw_db = 'tpcc'
+        self.videx_db = 'videx_tpcc'
+        self.task_id = 'test_service_tpcc'
+        stats_dict = load_json_from_file(
+            os.path.join(os.path.dirname(__file__), "data/test_videx_meta_record_in_ranges_tpcc.json"))
+        stats_dict['ITEM']['TABLE_ROWS'] = 100
+        for tb in stats_dict:
+            if tb not in hist_dict:
+                hist_dict[tb] = {}
+        self.task_meta = construct_videx_task_meta_from_local_files(
+            task_id=self.task_id,
+            videx_db=self.videx_db,
+            stats_file=stats_dict,
+            hist_file=hist_dict,
+            ndv_single_file={tb: {} for tb in stats_dict},
+            ndv_mulcol_file=None,
+            gt_rec_in_ranges_file=None,
+            gt_req_resp_file=None,
+        )
+        self.singleton = VidexSingleton()
+        self.singleton.add_task_meta(self.task_meta.to_dict())
+        videx_service.videx_meta_singleton = self.singleton
+        self.client = videx_service.app.test_client()
+
+    def rr_request(self, column: str, value: str, index_name: str = None) -> dict:
+        index_name = index_name or f"idx_{column}"
+        return build_rr_request(self.videx_db, self.task_id, column, value, index_name)
+
+
+class TestAskBatch(VidexServiceTestBase):
+    def test_batch_same_as_single(self):
+        items = [self.rr_request('I_PRICE', '3.00', 'idx_I_PRICE_I_IM_ID'),
+                 self.rr_request('I_IM_ID', '3'),
+                 self.rr_request('I_IM_ID', '2')]
+        expect = [self.singleton.ask(item) for item in items]
+        self.assertEqual(self.singleton.ask_batch(items), expect)
+
+    def test_batch_per_item_error(self):
+        bad_table = self.rr_request('I_IM_ID', '3')
+        bad_table['properties']['table_name'] = 'NOT_EXIST'
+        other_task = self.rr_request('I_IM_ID', '3')
+        other_task['properties']['videx_options'] = json.dumps({"task_id": "other"})
+        results = self.singleton.ask_batch([self.rr_request('I_IM_ID', '3'), bad_table, other_task])
+        self.assertEqual([code for code, _, _ in results], [200, 404, 400])
+
+    def test_batch_endpoint(self):
+        items = [self.rr_request('I_IM_ID', '3'), self.rr_request('I_IM_ID', '4')]
+        resp = self.client.post('/ask_videx_batch', json={'items': items}).get_json()
+        self.assertEqual(resp['code'], 200)
+        self.assertEqual([r['code'] for r in resp['data']], [200, 200])
+        self.assertEqual([r['data'] for r in resp['data']], [self.singleton.ask(item)[2] for item in items])
+
+    def test_batch_vectorized(self):
+        # an IN list on two indexes, answered by one histogram search per column
+        items = [self.rr_request('I_IM_ID', str(v)) for v in range(0, 12)] + \
+                [self.rr_request('I_PRICE', f'{v / 4:.2f}', 'idx_I_PRICE_I_IM_ID') for v in range(0, 30)]
+        results = self.singleton.ask_batch(items)
+        task_cache = self.singleton.cache[self.task_id]
+        handler = videx_funcs.get('records_in_range')
+        model = self.singleton.get_videx_table_stats(task_cache, self.videx_db, 'item')
+        self.assertEqual(model.records_in_range_batch(items[:3]), [model.records_in_range(item) for item in items[:3]])
+        for item, (code, _, data) in zip(items, results):
+            self.assertEqual(code, 200)
+            self.assertEqual(data, {k: str(v) for k, v in handler.handler(model, item).items()})
+
+
+class TestTaskStore(VidexServiceTestBase):
+    """
+    two singletons sharing one task store, like two gunicorn workers
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.store_dir = tempfile.TemporaryDirectory()
+        store = VidexTaskStore(self.store_dir.name)
+        self.worker_a = VidexSingleton(task_store=store, store_revalidate_interval=0)
+        self.worker_b = VidexSingleton(task_store=store, store_revalidate_interval=0)
+
+    def tearDown(self):
+        self.store_dir.cleanup()
+
+    def test_task_shared_by_workers(self):
+        req = self.rr_request('I_IM_ID', '3')
+        self.assertEqual(self.worker_b.ask(req)[0], 502)
+        self.worker_a.add_task_meta(self.task_meta.to_dict())
+        self.assertEqual(self.worker_b.ask(req), self.singleton.ask(req))
+
+        # updated by worker a, worker b reloads it
+        meta = self.task_meta.to_dict()
+        meta['meta_dict'][self.videx_db]['item']['rows'] = 200
+        self.worker_a.add_task_meta(meta)
+        self.assertEqual(self.worker_b.resolve_task_cache(self.task_id, req)[0]
+                         .db_tasks_stats.get_table_meta(self.videx_db, 'ITEM').rows, 200)
+
+        # evicted from memory by worker a, but still in store
+        self.worker_a.clear_cache({'key_list': [self.task_id]})
+        self.assertNotIn(self.task_id, self.worker_a.cache)
+        self.assertEqual(self.worker_a.ask(req)[0], 200)
+
+        # purged by worker a
+        self.worker_a.clear_cache({'key_list': [self.task_id], 'purge_store': True})
+        self.assertEqual(self.worker_b.ask(req)[0], 502)
+
+    def test_preload(self):
+        self.worker_a.add_task_meta(self.task_meta.to_dict())
+        restarted = VidexSingleton(task_store=VidexTaskStore(self.store_dir.name))
+        self.assertEqual(restarted.preload_from_store(), [self.task_id])
+        self.assertIn(self.task_id, restarted.cache)
+        req = self.rr_request('I_IM_ID', '3')
+        self.assertEqual(restarted.ask(req), self.singleton.ask(req))
+
+    def test_non_task_meta_merged_across_workers(self):
+        meta = json.loads(self.task_meta.to_json())
+        meta['task_id'] = None
+        self.worker_a.add_task_meta(meta)
+        other = json.loads(json.dumps(meta))
+        other['meta_dict'] = {'other_db': other['meta_dict'][self.videx_db]}
+        other['stats_dict'] = {'other_db': other['stats_dict'][self.videx_db]}
+        self.worker_b.add_task_meta(other)
+
+        req = self.rr_request('I_IM_ID', '3')
+        req['properties']['videx_options'] = json.dumps({})
+        self.assertEqual(self.worker_a.ask(req)[0], 200)
+        req['properties']['dbname'] = 'other_db'
+        self.assertEqual(self.worker_a.ask(req)[0], 200)
+
+
+
+class SlowVidexModel(VidexModelInnoDB):
+    n_built = 0
+
+    def __init__(self, *args, **kwargs):
+        SlowVidexModel.n_built += 1
+        time.sleep(0.05)
+        super().__init__(*args, **kwargs)
+
+
+class TestConcurrency(VidexServiceTestBase):
+    def test_model_built_once(self):
+        def load_meta(task_id):
+            time.sleep(0.05)
+            return self.task_meta.model_copy(update={'task_id': task_id})
+
+        SlowVidexModel.n_built = 0
+        singleton = VidexSingleton(VidexModelClass=SlowVidexModel, load_meta_by_task_id_func=load_meta)
+        load_meta_calls = []
+        singleton.load_meta_by_task_id_func = lambda task_id: load_meta_calls.append(task_id) or load_meta(task_id)
+        req = self.rr_request('I_IM_ID', '3')
+        results = []
+
+        def ask():
+            results.append(singleton.ask(req))
+            singleton.request_counter.incr()
+
+        threads = [threading.Thread(target=ask) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [self.singleton.ask(req)] * 8)
+        self.assertEqual(load_meta_calls, [self.task_id])
+        self.assertEqual(SlowVidexModel.n_built, 1)
+        self.assertEqual(singleton.request_count, 8)
+
+    def test_prefetch_task(self):
+        started, release = threading.Event(), threading.Event()
+        load_meta_calls = []
+
+        def load_meta(task_id):
+            load_meta_calls.append(task_id)
+            started.set()
+            release.wait(5)
+            return self.task_meta.model_copy(update={'task_id': task_id})
+
+        self.singleton.load_meta_by_task_id_func = load_meta
+        data = self.client.post('/prefetch_task', json={'task_ids': ['cold', self.task_id]}).get_json()['data']
+        self.assertEqual(data, {'cold': 'scheduled', self.task_id: 'cached'})
+        # requests of a task in flight wait for the same load
+        req = self.rr_request('I_IM_ID', '3')
+        req['properties']['videx_options'] = json.dumps({"task_id": 'cold'})
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.singleton.ask(req))) for _ in range(4)]
+        for t in threads:
+            t.start()
+        self.assertTrue(started.wait(5))
+        self.assertEqual(self.singleton.prefetch_tasks(['cold']), {'cold': 'loading'})
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual([r[2] for r in results], [{'value': '25'}] * 4)
+        self.assertEqual(load_meta_calls, ['cold'])
+        self.assertEqual(self.singleton.prefetch_tasks(['cold']), {'cold': 'cached'})
+
+
+
+class TestMemoryBudget(VidexServiceTestBase):
+    def add_task(self, singleton: VidexSingleton, task_id: str):
+        singleton.add_task_meta(self.task_meta.model_copy(update={'task_id': task_id}).to_dict())
+        req = self.rr_request('I_IM_ID', '3')
+        req['properties']['videx_options'] = json.dumps({"task_id": task_id})
+        self.assertEqual(singleton.ask(req), self.singleton.ask(self.rr_request('I_IM_ID', '3')))
+
+    def test_memory_accounting(self):
+        self.add_task(self.singleton, self.task_id)
+        usage = self.singleton.memory_usage()[self.task_id]
+        self.assertGreater(usage['stats_bytes'], 0)
+        self.assertGreater(usage['model_bytes'], 0)
+
+    def test_stats_bytes_lazy(self):
+        # not walked without a memory budget
+        self.add_task(self.singleton, self.task_id)
+        self.assertIsNone(self.singleton.cache[self.task_id].stats_bytes)
+
+        task_cache = VidexTaskCache(self.task_meta)
+        self.assertIsNone(task_cache.derive(self.task_meta, []).stats_bytes)
+        n_bytes = task_cache.total_stats_bytes()
+        self.assertGreater(n_bytes, 0)
+        # updated incrementally once computed
+        self.assertEqual(task_cache.derive(self.task_meta, []).stats_bytes, n_bytes)
+
+    def test_models_discarded_before_tasks(self):
+        self.add_task(self.singleton, self.task_id)
+        usage = self.singleton.memory_usage()[self.task_id]
+        stats_bytes, model_bytes = usage['stats_bytes'], usage['model_bytes']
+
+        # room for two tasks and one model: the model of the least recently used task is discarded
+        singleton = VidexSingleton(cache_max_bytes=2 * stats_bytes + model_bytes + model_bytes // 2)
+        self.add_task(singleton, 'task_a')
+        self.add_task(singleton, 'task_b')
+        self.assertEqual(list(singleton.cache), ['task_a', 'task_b'])
+        self.assertEqual(singleton.memory_usage()['task_a']['model_bytes'], 0)
+        self.assertGreater(singleton.memory_usage()['task_b']['model_bytes'], 0)
+
+        # not enough for three tasks: all models are discarded, then the least recently used task is evicted
+        self.add_task(singleton, 'task_c')
+        self.assertEqual(list(singleton.cache), ['task_b', 'task_c'])
+        self.assertLessEqual(singleton.cache.total_bytes([singleton.non_task_cache]), singleton.cache.max_bytes)
+
+
+class TestResponseCache(VidexServiceTestBase):
+    def test_repeated_request_hits(self):
+        req = self.rr_request('I_IM_ID', '3')
+        expect = self.singleton.ask(req)
+        # same request with different dict order and name case
+        same = json.loads(json.dumps(req))
+        same['properties'] = dict(reversed(list(same['properties'].items())))
+        same['properties']['table_name'] = 'item'
+        self.assertEqual(self.singleton.ask(same), expect)
+        self.assertEqual(self.singleton.ask(self.rr_request('I_IM_ID', '2'))[2], {'value': '25'})
+        stats = self.singleton.response_cache_stats()[self.task_id]
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 2, 2))
+
+    def test_invalidated_by_meta_change(self):
+        req = self.rr_request('I_IM_ID', '3')
+        self.assertEqual(self.singleton.ask(req)[2], {'value': '25'})
+        meta = self.task_meta.to_dict()
+        meta['meta_dict'][self.videx_db]['item']['rows'] = 200
+        self.singleton.add_task_meta(meta)
+        self.assertEqual(self.singleton.ask(req)[2], {'value': '50'})
+
+    def test_errors_not_cached(self):
+        bad = self.rr_request('I_IM_ID', '3')
+        bad['properties']['table_name'] = 'NOT_EXIST'
+        self.assertEqual(self.singleton.ask(bad)[0], 404)
+        self.assertEqual(self.singleton.response_cache_stats()[self.task_id]['size'], 0)
+
+
+class TestClearCache(VidexServiceTestBase):
+    def setUp(self):
+        super().setUp()
+        self.singleton.add_task_meta(self.task_meta.model_copy(update={'task_id': 'other_task'}).to_dict())
+        self.req = self.rr_request('I_IM_ID', '3')
+        self.other_req = json.loads(json.dumps(self.req))
+        self.other_req['properties']['videx_options'] = json.dumps({"task_id": "other_task"})
+        self.expect = self.singleton.ask(self.req)
+        self.assertEqual(self.singleton.ask(self.other_req), self.expect)
+
+    def test_clear_task(self):
+        resp = self.client.post('/clear_cache', json={'key_list': [self.task_id]}).get_json()
+        self.assertEqual(resp['data'], {'tasks': [self.task_id], 'models': [], 'purged': []})
+        self.assertEqual(list(self.singleton.cache), ['other_task'])
+        self.assertEqual(self.singleton.ask(self.other_req), self.expect)
+
+    def test_clear_table_models(self):
+        resp = self.client.post('/clear_cache', json={'key_list': [self.task_id], 'scope': 'table',
+                                                      'tables': [f'{self.videx_db}.ITEM']}).get_json()
+        self.assertEqual(resp['data']['models'], [f'{self.task_id}/{self.videx_db}.item'])
+        self.assertEqual(list(self.singleton.cache), [self.task_id, 'other_task'])
+        self.assertEqual(self.singleton.response_cache_stats()[self.task_id]['size'], 0)
+        self.assertEqual(self.singleton.response_cache_stats()['other_task']['size'], 1)
+        self.assertEqual(self.singleton.ask(self.req), self.expect)
+
+    def test_clear_all_models(self):
+        resp = self.client.post('/clear_cache', json={'scope': 'model'}).get_json()
+        self.assertEqual(sorted(resp['data']['models']),
+                         [f'other_task/{self.videx_db}.item', f'{self.task_id}/{self.videx_db}.item'])
+        self.assertEqual(self.singleton.memory_usage()['other_task']['model_bytes'], 0)
+        self.assertEqual(self.singleton.ask(self.other_req), self.expect)
+
+    def test_bad_scope(self):
+        resp = self.client.post('/clear_cache', json={'scope': 'table'}).get_json()
+        self.assertEqual(resp['code'], 400)
+        self.assertEqual(len(self.singleton.cache), 2)
+
+
+class TestPatchTaskMeta(VidexServiceTestBase):
+    def test_update_histogram(self):
+        req = self.rr_request('I_IM_ID', '3')
+        price_req = self.rr_request('I_PRICE', '3.00', 'idx_I_PRICE_I_IM_ID')
+        self.assertEqual(self.singleton.ask(req)[2], {'value': '25'})
+        price_resp = self.singleton.ask(price_req)
+        hist = HistogramStats(buckets=[HistogramBucket(min_value=1, max_value=3, cum_freq=0.5, row_count=3),
+                                       HistogramBucket(min_value=4, max_value=4, cum_freq=1, row_count=1)],
+                              data_type="int", null_values=0., histogram_type="basic")
+        resp = self.client.post('/update_gt_stats', json={
+            'task_id': self.task_id, 'dbname': self.videx_db, 'table_name': 'ITEM',
+            'histograms': {'I_IM_ID': hist.to_dict()}, 'ndvs_single': {'I_IM_ID': 4}}).get_json()
+        self.assertEqual(resp['code'], 200)
+        self.assertEqual(resp['data'], {'patched': ['histograms', 'ndvs_single'],
+                                        'models': [f'{self.videx_db}.item']})
+        self.assertNotEqual(self.singleton.ask(req)[2], {'value': '25'})
+        self.assertEqual(self.singleton.ask(price_req), price_resp)
+
+    def test_patch_keeps_other_task_models(self):
+        self.singleton.add_task_meta(self.task_meta.model_copy(update={'task_id': 'other_task'}).to_dict())
+        other_req = self.rr_request('I_IM_ID', '3')
+        other_req['properties']['videx_options'] = json.dumps({"task_id": "other_task"})
+        self.singleton.ask(other_req)
+        result = self.singleton.update_table_stats({'task_id': self.task_id, 'dbname': self.videx_db,
+                                                    'table_name': 'ITEM', 'gt_rec_in_ranges': []})
+        self.assertEqual(result['patched'], ['gt_rec_in_ranges'])
+        self.assertGreater(self.singleton.memory_usage()['other_task']['model_bytes'], 0)
+        self.assertEqual(self.singleton.response_cache_stats()['other_task']['size'], 1)
+
+    def test_set_variables(self):
+        resp = self.client.post('/set_task_variables', json={
+            'task_id': self.task_id, 'variables': {'sort_buffer_size': 1024}}).get_json()
+        self.assertEqual(resp['code'], 200)
+        self.assertEqual(self.singleton.cache[self.task_id].db_tasks_stats.db_config.sort_buffer_size.value, 1024)
+
+    def test_copy_on_write(self):
+        snapshot = self.singleton.cache[self.task_id]
+        district_model = self.singleton.get_videx_table_stats(snapshot, self.videx_db, 'district')
+        old_item_stats = snapshot.db_tasks_stats.get_table_stats_info(self.videx_db, 'item')
+        self.singleton.update_table_stats({'task_id': self.task_id, 'dbname': self.videx_db,
+                                           'table_name': 'ITEM', 'ndvs_single': {'I_IM_ID': 4}})
+        # readers of the old snapshot see the old meta
+        self.assertIs(snapshot.db_tasks_stats.get_table_stats_info(self.videx_db, 'item'), old_item_stats)
+        new_snapshot = self.singleton.cache[self.task_id]
+        self.assertIsNot(new_snapshot, snapshot)
+        self.assertEqual(new_snapshot.db_tasks_stats.get_table_stats_info(self.videx_db, 'item').ndv_dict['I_IM_ID'], 4)
+        # unchanged tables and models are shared
+        self.assertIs(new_snapshot.db_tasks_stats.get_table_stats_info(self.videx_db, 'district'),
+                      snapshot.db_tasks_stats.get_table_stats_info(self.videx_db, 'district'))
+        self.assertIs(new_snapshot.get_table_model_cache(self.videx_db, 'district'), district_model)
+
+    def test_merge_non_task_meta(self):
+        item_only = self.task_meta.model_copy(update={'task_id': None}).shallow_copy()
+        item_only.meta_dict[self.videx_db] = {'item': item_only.meta_dict[self.videx_db]['item']}
+        item_only.stats_dict[self.videx_db] = {'item': item_only.stats_dict[self.videx_db]['item']}
+        self.singleton.add_task_stats(item_only)
+        snapshot = self.singleton.non_task_cache
+        self.singleton.add_task_stats(self.task_meta.model_copy(update={'task_id': None}))
+        self.assertEqual(list(snapshot.db_tasks_stats.meta_dict[self.videx_db]), ['item'])
+        merged = self.singleton.non_task_cache.db_tasks_stats
+        self.assertEqual(merged.get_meta_info_keys(), self.task_meta.get_meta_info_keys())
+
+    def test_errors(self):
+        resp = self.client.post('/update_gt_stats', json={
+            'task_id': self.task_id, 'dbname': self.videx_db, 'table_name': 'NOT_EXIST', 'ndvs_single': {}})
+        self.assertEqual(resp.get_json()['code'], 400)
+        resp = self.client.post('/set_task_variables', json={'task_id': 'not_exist', 'variables': {}})
+        self.assertEqual(resp.get_json()['code'], 404)
+        resp = self.client.post('/set_task_variables', json={'task_id': self.task_id, 'variables': {'x': 1}})
+        self.assertEqual(resp.get_json()['code'], 400)
+
+
+class TestStreamIngestion(VidexServiceTestBase):
+    def setUp(self):
+        super().setUp()
+        self.stream = b''.join(dump_task_meta_stream(self.task_meta))
+
+    def tearDown(self):
+        videx_service.app.config['VIDEX_MAX_DECOMPRESSED_BYTES'] = videx_service.DEFAULT_MAX_DECOMPRESSED_BYTES
+
+    def test_round_trip(self):
+        # small chunks, lines are split across chunks
+        chunks = iter_decompressed_chunks(io.BytesIO(gzip.compress(self.stream)), gzip_encoded=True, chunk_size=7)
+        parsed = parse_task_meta_stream(iter_lines(chunks))
+        # same as the task meta parsed from a whole json body
+        self.assertEqual(parsed.to_json(), VidexDBTaskStats.from_json(self.task_meta.to_json()).to_json())
+
+    def test_stream_endpoint(self):
+        singleton = VidexSingleton()
+        videx_service.videx_meta_singleton = singleton
+        resp = self.client.post('/create_task_meta_stream', data=gzip.compress(self.stream),
+                                headers={'Content-Encoding': 'gzip'}).get_json()
+        self.assertEqual(resp['code'], 200)
+        self.assertEqual(resp['data']['tables'], len(self.task_meta.stats_dict[self.videx_db]))
+        req = self.rr_request('I_IM_ID', '3')
+        self.assertEqual(singleton.ask(req), self.singleton.ask(req))
+
+    def test_size_limit(self):
+        videx_service.app.config['VIDEX_MAX_DECOMPRESSED_BYTES'] = 1000
+        with self.assertRaises(PayloadTooLargeException):
+            list(iter_decompressed_chunks(io.BytesIO(gzip.compress(self.stream)), True, max_bytes=1000))
+        resp = self.client.post('/create_task_meta_stream', data=gzip.compress(self.stream),
+                                headers={'Content-Encoding': 'gzip'})
+        self.assertEqual(resp.status_code, 413)
+        self.assertEqual(resp.get_json()['code'], 413)
+        resp = self.client.post('/create_task_meta', data=gzip.compress(self.task_meta.to_json().encode('utf-8')),
+                                headers={'Content-Encoding': 'gzip', 'Content-Type': 'application/json'})
+        self.assertEqual(resp.status_code, 413)
+
+    def test_size_limit_bounded_memory(self):
+        # 64 MiB of zeros in about 64 KB of gzip, rejected before being inflated
+        bomb = gzip.compress(b'0' * (64 << 20), compresslevel=1)
+        tracemalloc.start()
+        try:
+            with self.assertRaises(PayloadTooLargeException):
+                for _ in iter_decompressed_chunks(io.BytesIO(bomb), True, max_bytes=1 << 20):
+                    pass
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 8 << 20)
+
+    def test_truncated_stream(self):
+        body = gzip.compress(self.stream)
+        with self.assertRaises(RequestFormatException):
+            list(iter_decompressed_chunks(io.BytesIO(body[:len(body) // 2]), True))
+        resp = self.client.post('/create_task_meta_stream', data=body[:len(body) // 2],
+                                headers={'Content-Encoding': 'gzip'})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_bad_stream(self):
+        resp = self.client.post('/create_task_meta_stream', data=b'{"no_task_id": 1}\n')
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.get_json()['code'], 400)
+
+
+class TestGetStats(VidexServiceTestBase):
+    def test_legacy_format(self):
+        resp = self.client.get('/videx/visualization/get_stats').get_json()
+        self.assertEqual(resp['data'], {'stats': {}})
+
+    def test_pagination_and_projection(self):
+        url = f'/videx/visualization/get_stats?task_id={self.task_id}&offset=1&limit=2&exclude=histogram_dict,extra_info'
+        data = self.client.get(url).get_json()['data']
+        tables = sorted(self.task_meta.stats_dict[self.videx_db])
+        self.assertEqual(data['total'], len(tables))
+        self.assertEqual([t['table_name'] for t in data['tables']], tables[1:3])
+        self.assertNotIn('histogram_dict', data['tables'][0]['stats'])
+        self.assertIn('ndv_dict', data['tables'][0]['stats'])
+
+        data = self.client.get(f'/videx/visualization/get_stats?task_id={self.task_id}&table=item'
+                               f'&fields=histogram_dict&meta=0').get_json()['data']
+        self.assertEqual(len(data['tables']), 1)
+        self.assertEqual(list(data['tables'][0]), ['dbname', 'table_name', 'stats'])
+        self.assertEqual(sorted(data['tables'][0]['stats']['histogram_dict']), ['I_IM_ID', 'I_PRICE'])
+
+    def test_invalid_pagination(self):
+        for query in ['offset=x', 'limit=-1', 'offset=-2&limit=1']:
+            resp = self.client.get(f'/videx/visualization/get_stats?task_id={self.task_id}&{query}').get_json()
+            self.assertEqual(resp['code'], 400, query)
+        data = self.client.get(f'/videx/visualization/get_stats?task_id={self.task_id}&limit=0').get_json()['data']
+        self.assertEqual(data['tables'], [])
+
+    def test_stream_gzip(self):
+        url = f'/videx/visualization/get_stats?task_id={self.task_id}'
+        expect = self.client.get(url).get_json()
+        resp = self.client.get(url + '&stream=1&gzip=1')
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(resp.data)), expect)
+        self.assertEqual(self.client.get('/videx/visualization/get_stats?task_id=x').get_json()['code'], 404)
+
+
+class TestMetrics(VidexServiceTestBase):
+    def test_metrics_endpoint(self):
+        metrics.reset()
+        req = self.rr_request('I_IM_ID', '3')
+        self.client.post('/ask_videx', json=req)
+        self.client.post('/ask_videx', json=req)
+        bad = self.rr_request('I_IM_ID', '3')
+        bad['properties']['table_name'] = 'NOT_EXIST'
+        self.client.post('/ask_videx', json=bad)
+
+        resp = self.client.get('/metrics')
+        self.assertTrue(resp.content_type.startswith('text/plain'))
+        lines = resp.get_data(as_text=True).splitlines()
+
+        def value_of(prefix: str) -> float:
+            matched = [line for line in lines if line.startswith(prefix)]
+            self.assertEqual(len(matched), 1, prefix)
+            return float(matched[0].rsplit(' ', 1)[1])
+
+        rr = 'func="records_in_range",strategy="innodb"'
+        self.assertEqual(value_of(f'videx_requests_total{{{rr},code="200"'), 2)
+        self.assertEqual(value_of(f'videx_requests_total{{{rr},code="404"'), 1)
+        self.assertEqual(value_of(f'videx_request_errors_total{{{rr}'), 1)
+        self.assertEqual(value_of(f'videx_request_seconds_bucket{{{rr},pid="{os.getpid()}",le="+Inf"}}'), 3)
+        self.assertEqual(value_of('videx_cache_requests_total{cache="response",result="hit"'), 1)
+        self.assertEqual(value_of('videx_cache_requests_total{cache="model",result="miss"'), 1)
+        self.assertEqual(value_of('videx_phase_seconds_count{phase="range_parse"'), 1)
+        self.assertEqual(value_of('videx_phase_seconds_count{phase="histogram_search"'), 1)
+        self.assertGreater(value_of('videx_process_resident_memory_bytes'), 0)
+        self.assertEqual(value_of('videx_cached_tasks'), 1)
+
+
+class TestDispatch(VidexServiceTestBase):
+    def tearDown(self):
+        videx_funcs.unregister('table_rows')
+
+    def test_parse_func_id(self):
+        self.assertEqual(parse_func_id('virtual ha_rows ha_videx::records_in_range(uint, key_range *, key_range *)'),
+                         'records_in_range')
+        self.assertEqual(parse_func_id('virtual longlong ha_videx::get_memory_buffer_size() const'),
+                         'get_memory_buffer_size')
+        self.assertEqual(parse_func_id('INFO_LOW'), 'info_low')
+        # exact match, not substring
+        self.assertIsNone(videx_funcs.get('virtual double ha_videx::scan_time_v2()'))
+
+    def test_register_function(self):
+        req = self.rr_request('I_IM_ID', '3')
+        req['properties']['function'] = 'virtual ha_rows ha_videx::table_rows()'
+        self.assertEqual(self.singleton.ask(req)[0], 400)
+        videx_funcs.register('table_rows', handler=lambda model, r: {"value": model.table_stats.records})
+        self.assertEqual(self.singleton.ask(req), (200, 'OK', {'value': '100'}))
+
+    def test_invalid_request(self):
+        req = self.rr_request('I_IM_ID', '3')
+        req['data'] = req['data'][:1]
+        code, message, _ = self.singleton.ask(req)
+        self.assertEqual(code, 400)
+        self.assertIn("item types of 'data' must be ['min_key', 'max_key']", message)
+
+
+class TestMsgpack(VidexServiceTestBase):
+    def test_ask_videx(self):
+        req = self.rr_request('I_IM_ID', '3')
+        resp = self.client.post('/ask_videx', data=msgpack.packb(req),
+                                headers={'Content-Type': 'application/msgpack', 'Accept': 'application/msgpack'})
+        self.assertEqual(resp.mimetype, 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(resp.data), {'code': 200, 'message': 'OK', 'data': {'value': '25'}})
+        # json is the default
+        resp = self.client.post('/ask_videx', data=msgpack.packb(req), content_type='application/msgpack')
+        self.assertEqual(resp.get_json()['data'], {'value': '25'})
+
+    def test_invalid_body(self):
+        req = self.rr_request('I_IM_ID', '3')
+        del req['properties']
+        resp = self.client.post('/ask_videx', data=msgpack.packb(req), content_type='application/msgpack')
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn('properties', resp.get_json()['errors'])
+        resp = self.client.post('/ask_videx', data=b'\xc1', content_type='application/msgpack')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_create_task_meta(self):
+        meta = self.task_meta.model_copy(update={'task_id': 'msgpack_task'})
+        body = gzip.compress(msgpack.packb(meta.model_dump(mode='json')))
+        resp = self.client.post('/create_task_meta', data=body,
+                                headers={'Content-Type': 'application/msgpack', 'Content-Encoding': 'gzip'})
+        self.assertEqual(resp.get_json()['code'], 200)
+        # same as the json upload
+        self.assertEqual(self.singleton.cache['msgpack_task'].db_tasks_stats.to_json(),
+                         VidexDBTaskStats.from_json(meta.to_json()).to_json())
+
+
+class TestWarmup(VidexServiceTestBase):
+    def test_warmup_task(self):
+        req = {'task_id': self.task_id, 'wait': True}
+        report = self.client.post('/warmup_task', json=req).get_json()['data']
+        self.assertEqual(report['state'], 'done')
+        table = f'{self.videx_db}.item'
+        n_tables = len(self.task_meta.get_stats_info_keys()[self.videx_db])
+        self.assertEqual(len(report['tables']), n_tables)
+        self.assertFalse(report['tables'][table]['cached'])
+        self.assertGreaterEqual(report['tables'][table]['seconds'], 0)
+        self.assertEqual(self.client.get(f'/warmup_task?task_id={self.task_id}').get_json()['data'], report)
+        # the first query hits the built model
+        metrics.reset()
+        self.singleton.ask(self.rr_request('I_IM_ID', '3'))
+        self.assertIn('videx_cache_requests_total{cache="model",result="hit"', metrics.render())
+
+        self.assertEqual(self.client.post('/warmup_task', json={'task_id': 'x'}).get_json()['code'], 404)
+        self.assertEqual(self.client.post('/warmup_task', json={'task_id': self.task_id, 'tables': ['item']}
+                                          ).get_json()['code'], 400)
+
+    def test_warmup_on_create(self):
+        meta = self.task_meta.model_copy(update={'task_id': 'warm_task'})
+        data = self.client.post('/create_task_meta?warmup=1', json=json.loads(meta.to_json())).get_json()['data']
+        self.assertEqual(data['warmup']['task_id'], 'warm_task')
+        deadline = time.time() + 5
+        while self.singleton.warmup_report('warm_task')['state'] != 'done' and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.singleton.cache['warm_task'].built_models()),
+                         len(self.task_meta.get_stats_info_keys()[self.videx_db]))
+
+
+class TestDeadline(VidexServiceTestBase):
+    def test_nested_deadline(self):
+        with request_deadline(10) as outer:
+            with request_deadline(20) as inner:
+                self.assertIs(inner, outer)
+            with request_deadline(0) as inner:
+                self.assertTrue(deadline_expired())
+                mark_degraded('ndv')
+            self.assertFalse(deadline_expired())
+            self.assertEqual(outer.degraded, ['ndv'])
+        self.assertIsNone(current_deadline())
+
+    def test_fallback_after_deadline(self):
+        req = self.rr_request('I_IM_ID', '3')
+        self.singleton.request_timeout = 0
+        # histograms are skipped: all rows, and the answer is not cached
+        self.assertEqual(self.singleton.ask(req), (200, 'OK', {'value': '100'}))
+        self.assertEqual(self.singleton.response_cache_stats()[self.task_id]['size'], 0)
+        self.singleton.request_timeout = 10
+        self.assertEqual(self.singleton.ask(req), (200, 'OK', {'value': '25'}))
+
+    def test_admission_control(self):
+        req = self.rr_request('I_IM_ID', '3')
+        self.singleton.admission = AdmissionControl(max_in_flight=1)
+        self.assertTrue(self.singleton.admission.try_enter())
+        resp = self.client.post('/ask_videx', json=req).get_json()
+        self.assertEqual((resp['code'], resp['data']), (503, {}))
+        resp = self.client.post('/ask_videx_batch', json={'items': [req, req]}).get_json()
+        self.assertEqual([item['code'] for item in resp['data']], [503, 503])
+        self.singleton.admission.leave()
+        self.assertEqual(self.client.post('/ask_videx', json=req).get_json()['data'], {'value': '25'})
+        self.assertEqual((self.singleton.admission.in_flight, self.singleton.admission.rejected.value), (0, 2))
+
+
+class TestRequestLog(VidexServiceTestBase):
+    def tearDown(self):
+        videx_logging.set_request_log_policy()
+
+    def test_sampled_summary(self):
+        videx_logging.set_request_log_policy(sample_n=1000)
+        self.singleton.request_counter.incr()  # not sampled: request index 1, 2
+        with self.assertLogs(level='INFO') as logs:
+            self.client.post('/ask_videx', json=self.rr_request('I_IM_ID', '3'))
+            bad = self.rr_request('I_IM_ID', '3')
+            bad['properties']['table_name'] = 'NOT_EXIST'
+            self.client.post('/ask_videx', json=bad)
+        # only the error is logged, with payload
+        request_logs = [line for line in logs.output if '] ==' in line]
+        self.assertEqual(len(request_logs), 2)
+        self.assertIn('func=records_in_range task=test_service_tpcc table=videx_tpcc.NOT_EXIST index=idx_I_IM_ID',
+                      request_logs[0])
+        self.assertIn('request data: {"data"', request_logs[1])
+
+    def test_full_payload_for_task(self):
+        videx_logging.set_request_log_policy(sample_n=1, full_payload_task_ids=[self.task_id])
+        with self.assertLogs(level='INFO') as logs:
+            self.client.post('/ask_videx', json=self.rr_request('I_IM_ID', '3'))
+        request_logs = [line for line in logs.output if '] ==' in line]
+        self.assertEqual(len(request_logs), 3)
+        self.assertIn('result=25', request_logs[1])
+
+
+class FlakyApp:
+    """
+    WSGI app answering 503 to the first `failures` requests, then delegating to the VIDEX app.
+    """
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.requests = 0
+
+    def __call__(self, environ, start_response):
+        self.requests += 1
+        if self.requests <= self.failures:
+            get_input_stream(environ).read()
+            start_response('503 Service Unavailable', [('Content-Type', 'text/plain')])
+            return [b'busy']
+        return videx_service.app(environ, start_response)
+
+
+class TestVidexClient(VidexServiceTestBase):
+    def setUp(self):
+        super().setUp()
+        self.wsgi_app = FlakyApp(failures=0)
+        self.server = make_server('127.0.0.1', 0, self.wsgi_app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.videx_client = VidexClient(f'127.0.0.1:{self.server.server_port}', retries=2, backoff=0.)
+
+    def tearDown(self):
+        self.videx_client.close()
+        self.server.shutdown()
+
+    def test_stream_upload_with_progress(self):
+        singleton = VidexSingleton()
+        videx_service.videx_meta_singleton = singleton
+        progress = []
+        resp = self.videx_client.create_task_meta_stream(
+            self.task_meta, progress=lambda p: progress.append((p.tables_sent, p.total_tables, p.bytes_sent)))
+        self.assertEqual(resp.json()['code'], 200)
+        n_tables = len(self.task_meta.get_stats_info_keys()[self.videx_db])
+        self.assertEqual(progress[-1][:2], (n_tables, n_tables))
+        self.assertEqual([p[2] for p in progress], sorted(p[2] for p in progress))
+        req = self.rr_request('I_IM_ID', '3')
+        self.assertEqual(singleton.ask(req), self.singleton.ask(req))
+
+    def test_retry(self):
+        self.wsgi_app.failures = 2
+        singleton = VidexSingleton()
+        videx_service.videx_meta_singleton = singleton
+        attempts = set()
+        resp = self.videx_client.create_task_meta_stream(self.task_meta, progress=lambda p: attempts.add(p.attempt))
+        self.assertEqual(resp.json()['code'], 200)
+        self.assertEqual(self.wsgi_app.requests, 3)
+        self.assertIn(3, attempts)
+        self.assertIn(self.task_id, singleton.cache)
+
+        # give up after all retries, and return the last response
+        self.wsgi_app.failures, self.wsgi_app.requests = 10, 0
+        resp = self.videx_client.create_task_meta(self.task_meta)
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(self.wsgi_app.requests, 3)
+
+    def test_sync_task_meta(self):
+        self.assertEqual(self.videx_client.sync_task_meta(self.task_meta)['mode'], 'unchanged')
+        self.singleton.ask(self.rr_request('I_IM_ID', '3'))
+
+        meta = self.task_meta.shallow_copy()
+        meta.patch_table_stats(self.videx_db, 'stock', ndvs_single={'S_QUANTITY': 7})
+        meta.drop_tables([(self.videx_db, 'history')])
+        result = self.videx_client.sync_task_meta(meta)
+        self.assertEqual((result['code'], result['mode']), (200, 'delta'))
+        self.assertEqual(result['tables'], [f'{self.videx_db}.stock'])
+        self.assertEqual(result['dropped'], [f'{self.videx_db}.history'])
+        # the server has the same content, and keeps the models of the unchanged tables
+        task_cache = self.singleton.cache[self.task_id]
+        self.assertEqual(self.singleton.task_content_hashes({'task_id': self.task_id})['tables'],
+                         VidexTaskCache(meta).content_hashes())
+        self.assertEqual(task_cache.built_models(), [f'{self.videx_db}.item'])
+        self.assertEqual(self.videx_client.sync_task_meta(meta)['mode'], 'unchanged')
+
+        # db_config differs, or the task is not on the server
+        meta.set_variables({'innodb_page_size': 8192})
+        self.assertEqual(self.videx_client.sync_task_meta(meta)['mode'], 'full')
+        other = self.task_meta.model_copy(update={'task_id': 'other_task'})
+        self.assertEqual(self.videx_client.sync_task_meta(other)['mode'], 'full')
+        self.assertIn('other_task', self.singleton.cache)
+
+    def test_content_hash(self):
+        # hashes are the same after a json round trip, as the server parses the uploaded meta
+        parsed = VidexDBTaskStats.from_json(self.task_meta.to_json())
+        self.assertEqual(VidexTaskCache(parsed).content_hashes(), VidexTaskCache(self.task_meta).content_hashes())
+        self.assertEqual(parsed.header_content_hash(), self.task_meta.header_content_hash())
+        resp = self.client.get('/task_content_hashes?task_id=not_exist').get_json()
+        self.assertEqual(resp['code'], 404)
+
+
+class FakeDDLEnv:
+    def __init__(self, fail_tables=()):
+        self.fail_tables = fail_tables
+        self.executed = []
+        self.lock = threading.Lock()
+
+    def execute(self, sql, params=None):
+        if any(f'`{tb}`' in sql for tb in self.fail_tables):
+            raise RuntimeError(f"cannot execute {sql[:30]}")
+        with self.lock:
+            # foreign_key_checks=1: the parent table must be created before, in the db named by the DDL
+            created = {tuple(name.strip('`') for name in stmt.split()[2].split('.'))
+                       for stmt in self.executed if stmt.startswith('CREATE TABLE')}
+            if sql.startswith('CREATE TABLE'):
+                for parent in ddl_referenced_tables(sql, default_db=''):
+                    if parent not in created:
+                        raise RuntimeError(f"(1824, Failed to open the referenced table '{parent}')")
+            self.executed.append(sql)
+
+
+class TestServerAddress(unittest.TestCase):
+    def test_address_of_bind(self):
+        self.assertEqual(videx_server_address('127.0.0.1:5002'), '127.0.0.1:5002')
+        self.assertEqual(videx_server_address('0.0.0.0:5002'), f'{get_local_ip()}:5002')
+        self.assertEqual(videx_server_address('videx-host'), 'videx-host:8000')
+        self.assertIsNone(videx_server_address('unix:/tmp/videx.sock'))
+
+
+class TestCreateVidexEnv(unittest.TestCase):
+    def test_rewrite_ddl(self):
+        ddl = "CREATE TABLE `t1` (\n  `id` int\n) ENGINE=InnoDB SECONDARY_ENGINE=rapid DEFAULT CHARSET=utf8mb4"
+        self.assertEqual(rewrite_create_table_ddl(ddl, 'VIDEX', 'db1'),
+                         "CREATE TABLE `db1`.`t1` (\n  `id` int\n) ENGINE=VIDEX  DEFAULT CHARSET=utf8mb4")
+        self.assertTrue(rewrite_create_table_ddl("create table if not exists old.t1 (id int)", 'VIDEX', 'db1')
+                        .startswith("create table if not exists `db1`.t1 "))
+        with self.assertRaises(ValueError):
+            rewrite_create_table_ddl("DROP TABLE t1", 'VIDEX', 'db1')
+
+    def test_parallel_ddl(self):
+        meta_dict = {db: {f't{i}': Table(name=f't{i}', ddl=f"CREATE TABLE `t{i}` (id int) ENGINE=InnoDB")
+                          for i in range(20)} for db in ('db1', 'db2')}
+        env = FakeDDLEnv(fail_tables=['t3'])
+        report = create_videx_env_multi_db(env, meta_dict, max_workers=4)
+        self.assertEqual(sorted(report['failed']), ['db1.t3', 'db2.t3'])
+        self.assertEqual(len(report['tables']), 40)
+        self.assertGreaterEqual(report['tables']['db2.t19']['seconds'], 0)
+        self.assertIn("CREATE TABLE `db2`.`t19` (id int) ENGINE=VIDEX", env.executed)
+        # tables of a failed database are skipped
+        report = create_videx_env_multi_db(FakeDDLEnv(fail_tables=['db1']), meta_dict)
+        self.assertEqual(report['failed'], ['db1'])
+        self.assertEqual(len(report['tables']), 20)
+
+    def test_foreign_keys(self):
+        child_ddl = ("CREATE TABLE `child` (\n  `id` int,\n  `pid` int,\n"
+                     "  CONSTRAINT `fk_p` FOREIGN KEY (`pid`) REFERENCES `parent` (`id`)\n) ENGINE=InnoDB")
+        self.assertEqual(rewrite_create_table_ddl(child_ddl, 'VIDEX', 'db1'),
+                         child_ddl.replace('`child`', '`db1`.`child`').replace('`parent`', '`db1`.`parent`')
+                         .replace('InnoDB', 'VIDEX'))
+        self.assertIn("REFERENCES `other`.`parent`",
+                      rewrite_create_table_ddl(child_ddl.replace('`parent`', '`other`.`parent`'), 'VIDEX', 'db1'))
+
+        # the child comes first in meta, and every db has the same table names
+        meta_dict = {db: {'child': Table(name='child', ddl=child_ddl),
+                          'parent': Table(name='parent', ddl="CREATE TABLE `parent` (`id` int) ENGINE=InnoDB"),
+                          't0': Table(name='t0', ddl="CREATE TABLE `t0` (`id` int) ENGINE=InnoDB")}
+                     for db in ('db1', 'db2')}
+        env = FakeDDLEnv()
+        report = create_videx_env_multi_db(env, meta_dict, max_workers=4)
+        self.assertEqual(report['failed'], [])
+        self.assertEqual(len(report['tables']), 6)
+        self.assertIn("REFERENCES `db2`.`parent` (`id`)", env.executed[-1] + env.executed[-2])
+
+
+if __name__ == '__main__':
+    unittest.main()